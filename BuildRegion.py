@@ -3,85 +3,129 @@
 import logging
 logging.basicConfig(level=logging.WARNING)
 from tile import Tile
-from utils import setspawnandsave, save, cleanmkdir
+from region import Region
+from buildgraph import BuildGraph
+from utils import setspawnandsave, cleanmkdir
 import argparse
 import os
 import shutil
 import yaml
-from multiprocessing import Pool
-#from multiprocessing.pool import AsyncResult
+from scheduler import Scheduler
 from itertools import product
-from tree import Tree, treeObjs
-from ore import Ore, oreObjs
 from pymclevel import mclevel, box
+from pymclevel.regionfile import MCRegionFile
 import time
+from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
 from math import floor, ceil
-import fnmatch
 from klogger import klogger, klog_levels
+from osgeo import gdal
+from osgeo.gdalconst import GA_ReadOnly
+import numpy
+
+# the region this worker builds tiles and regions for
+workerregion = None
+
+def initworker(name):
+    """Load the region once per worker rather than once per task."""
+    global workerregion
+    yamlfile = file(os.path.join('Regions', name, 'Region.yaml'))
+    workerregion = yaml.load(yamlfile)
+    yamlfile.close()
 
 def buildtile(args):
-    """Given a region name and coordinates, build the corresponding tile."""
+    """Given a region name and coordinates, build the corresponding tile.
+
+    Returns the tile's coordinates, digest, whether it was built, and
+    its peak."""
     # this should work for single and multi threaded cases
-    (log, name, tilex, tiley) = args
+    (log, name, tilex, tiley, engine, recorded, dryrun) = args
     log.log_debug(1,"Building tile (%d,%d) of map %s..." % \
                     (tilex, tiley, name))
-    yamlfile = file(os.path.join('Regions', name, 'Region.yaml'))
-    myRegion = yaml.load(yamlfile)
-    yamlfile.close()
-    myTile = Tile(myRegion, tilex, tiley)
+    myTile = Tile(workerregion, tilex, tiley, engine)
     myTile.log = log
-    myTile()
+    myTile(recorded, dryrun)
+    return (tilex, tiley, myTile.digest, myTile.built, myTile.peak)
 
 def buildregion(args):
-    """Given a region name and coordinates, build the corresponding region from tile chunks."""
+    """Given a region name and coordinates, write the corresponding region file from tile chunks."""
     # this should work for single and multi threaded cases
     (log, name, regionx, regiony) = args
     log.log_debug(1,"Building region (%d,%d) of map %s..." % \
                   (regionx, regiony, name))
-    yamlfile = file(os.path.join('Regions', name, 'Region.yaml'))
-    myRegion = yaml.load(yamlfile)
-    yamlfile.close()
+    myRegion = workerregion
     regionsize = 32 * 16
     tilexrange = xrange(regionx * (regionsize / myRegion.tilesize), \
                         (regionx + 1) * (regionsize / myRegion.tilesize))
     tileyrange = xrange(regiony * (regionsize / myRegion.tilesize), \
                         (regiony + 1) * (regionsize / myRegion.tilesize))
-    maintiledir = None
+    tilechunks = myRegion.tilesize / 16
+
+    regionname = 'r.%d.%d.mca' % (regionx, regiony)
+    if myRegion.tilesize == regionsize:
+        # the tile is the region, so its region file is already complete
+        srcpath = os.path.join('Regions', name, 'Tiles', '%dx%d' % (regionx, regiony), 'region', regionname)
+        if os.path.exists(srcpath):
+            shutil.copyfile(srcpath, os.path.join('Worlds', name, 'region', regionname))
+        return
+
+    # finished chunks are copied as they are stored, still compressed,
+    # from each tile's region file into the world's region file
+    dstfile = None
+    numchunks = 0
     for tilex, tiley in product(tilexrange, tileyrange):
         if (tilex < myRegion.tiles['xmin']) or (tilex >= myRegion.tiles['xmax']) or \
            (tiley < myRegion.tiles['ymin']) or (tiley >= myRegion.tiles['ymax']):
             continue
         tiledir = os.path.join('Regions', name, 'Tiles', '%dx%d' % (tilex, tiley))
-        if not(os.path.exists(tiledir)) or not(os.path.exists(os.path.join(tiledir, 'level.dat'))):
-            log.log_debug(1,"Skipping missing tile" % (tilex, tiley))
+        srcpath = os.path.join(tiledir, 'region', regionname)
+        if not(os.path.exists(srcpath)):
+            log.log_debug(1,"Skipping missing tile %dx%d" % (tilex, tiley))
             continue
-        if maintiledir == None:
-            maintiledir = tiledir
-            maintileworld = mclevel.MCInfdevOldLevel(tiledir, create=False)
-            # If this hack is necessary, it's dumb. It seems to be.
-            maintileworld.copyBlocksFrom(maintileworld, maintileworld.bounds, \
-                                         maintileworld.bounds.origin)
-        else:
-            log.log_debug(2,"Copying tile %dx%d to %s" % (tilex, tiley, maintiledir))
-            tileworld = mclevel.MCInfdevOldLevel(tiledir, create=False)
-            maintileworld.copyBlocksFrom(tileworld, tileworld.bounds, tileworld.bounds.origin)
-            tileworld = None
+        if dstfile == None:
+            dstfile = MCRegionFile(os.path.join('Worlds', name, 'region', regionname), (regionx, regiony))
+        log.log_debug(2,"Copying tile %dx%d to %s" % (tilex, tiley, regionname))
+        srcfile = MCRegionFile(srcpath, (regionx, regiony))
+        for cx, cz in product(xrange(tilex * tilechunks, (tilex + 1) * tilechunks), \
+                              xrange(tiley * tilechunks, (tiley + 1) * tilechunks)):
+            dstfile.copyChunkFrom(srcfile, cx, cz)
+            numchunks += 1
+        srcfile.close()
 
-    if maintiledir == None:
-        log.log_debug(1,"Region (%d,%d) appears to be complete; skipping." % (regionx, regiony))
+    if dstfile == None:
+        log.log_debug(1,"Region (%d,%d) has no tiles; skipping." % (regionx, regiony))
         return
-    else:
-        log.log_debug(2,"maintiledir is %s" % maintiledir)
-
-    save(maintileworld)
-    maintileworld = None
-    srcdir = os.path.join(maintiledir, 'region')
-    dstdir = os.path.join('Worlds', name, 'region')
-    for path, dirlist, filelist in os.walk(srcdir):
-        for name in fnmatch.filter(filelist, "*.mca"):
-            shutil.move(os.path.join(path,name),dstdir)
-            log.log_debug(2,"Moved file %s to %s" % (os.path.join(path,name),dstdir))
-    os.remove(os.path.join(maintiledir,'level.dat'))
+    dstfile.close()
+    log.log_debug(2,"Wrote %d chunks to %s" % (numchunks, regionname))
+
+def tilecosts(region, tiles):
+    """Predict the relative cost of building each tile.
+
+    Water is quick to build while land has trees and, with schematics,
+    developed land has buildings, so the cost is sampled from a coarse
+    read of the landcover band.  Samples beyond the map are water."""
+    samples = 16
+    size = region.tilesize
+    numtilesx = region.tiles['xmax'] - region.tiles['xmin']
+    numtilesy = region.tiles['ymax'] - region.tiles['ymin']
+    lcarray = numpy.zeros((numtilesy * samples, numtilesx * samples), dtype=numpy.int16) + 11
+    mapds = gdal.Open(region.mapname, GA_ReadOnly)
+    # the map may not cover the grid of tiles, so read what it has at
+    # the same number of samples per tile
+    xsize = min(numtilesx * size, mapds.RasterXSize)
+    ysize = min(numtilesy * size, mapds.RasterYSize)
+    bufxsize = int(ceil(xsize * samples / float(size)))
+    bufysize = int(ceil(ysize * samples / float(size)))
+    lcarray[:bufysize, :bufxsize] = mapds.GetRasterBand(Region.rasters['landcover']).ReadAsArray(0, 0, \
+                                        xsize, ysize, bufxsize, bufysize)
+    mapds = None
+    cost = (lcarray != 11).astype(float)
+    if region.doSchematics:
+        cost[(lcarray >= 21) & (lcarray <= 25)] = 2
+    costs = []
+    for tile in tiles:
+        (tilex, tiley) = (tile[2] - region.tiles['xmin'], tile[3] - region.tiles['ymin'])
+        costs.append(0.1 + cost[tiley*samples:(tiley+1)*samples, tilex*samples:(tilex+1)*samples].mean())
+    return costs
 
 def main():
     """Builds a region."""
@@ -96,6 +140,10 @@ def main():
                         help='enable single-threaded mode for debugging or profiling')
     parser.add_argument('--safemerge', action='store_true', \
                         help='use \"safer\" method of merging tiles together')
+    parser.add_argument('--engine', default='column', choices=Tile.engines, \
+                        help='terrain engine used to build tiles (default %(default)s)')
+    parser.add_argument('--dry-run', action='store_true', dest='dryrun', \
+                        help='report which tiles would be rebuilt without building anything')
     parser.add_argument("-v", "--verbosity", action="count", \
                         help="increase output verbosity")
     parser.add_argument("-q", "--quiet", action="store_true", \
@@ -113,6 +161,7 @@ def main():
 
     # build the region
     log.log_info("Building region %s..." % args.name)
+    start = time.time()
     yamlfile = file(os.path.join('Regions', args.name, 'Region.yaml'))
     myRegion = yaml.load(yamlfile)
     yamlfile.close()
@@ -121,40 +170,41 @@ def main():
     if not os.path.exists(myRegion.mapname):
         log.log_fatal("No map file exists!")
 
-    # tree and ore variables
-    treeobjs = dict([(tree.name, tree) for tree in treeObjs])
-    trees = dict([(name, list()) for name in treeobjs])
-    oreobjs = dict([(ore.name, ore) for ore in oreObjs])
-    ores = dict([(name, list()) for name in oreobjs])
-
-    # generate overall world
-    worlddir = os.path.join('Worlds', args.name)
-    world = mclevel.MCInfdevOldLevel(worlddir, create=True)
-    peak = [0, 0, 0]
-    save(world)
-    world = None
+    # only tiles whose inputs changed are rebuilt
+    graph = BuildGraph(myRegion.graphname)
 
     # generate individual tiles
     tilexrange = xrange(myRegion.tiles['xmin'], myRegion.tiles['xmax'])
     tileyrange = xrange(myRegion.tiles['ymin'], myRegion.tiles['ymax'])
     name = myRegion.name
-    tiles = [(log, name, x, y) for x, y in product(tilexrange, tileyrange)]
+    tiles = [(log, name, x, y, args.engine, graph.digests.get('tile/%dx%d' % (x, y)), args.dryrun) \
+             for x, y in product(tilexrange, tileyrange)]
     if args.single:
-        # single process version
-        log.log_warn("Single-threaded region merge")
-        for tile in tiles:
-            buildtile(tile)
-    else:
-        # multi-process version
-        pool = Pool()
-        rs = pool.map_async(buildtile, tiles)
-        pool.close()
-        while not(rs.ready()):
-            remaining = rs._number_left
-            log.log_info("Waiting for %s buildtile tasks to complete..." %
-                         remaining)
-            time.sleep(10)
-        pool.join()        # Just as a precaution.
+        log.log_warn("Single-threaded tile build")
+    scheduler = Scheduler(log, args.single, initializer=initworker, initargs=(name,))
+    tilestart = time.time()
+    results = scheduler(buildtile, tiles, tilecosts(myRegion, tiles), 'tiles', \
+                        lambda tile: 'Tile %dx%d' % (tile[2], tile[3]))
+
+    rebuilt = [(result[0], result[1]) for result in results if result[3]]
+    if args.dryrun:
+        for (x, y) in rebuilt:
+            log.log_info("Would rebuild: tile %dx%d" % (x, y))
+        log.log_info("Would rebuild %d of %d tiles." % (len(rebuilt), len(tiles)))
+        return
+    for (x, y, digest, built, tilepeak) in results:
+        graph.record('tile/%dx%d' % (x, y), digest)
+    graph.save()
+    log.log_info("Rebuilt %d of %d tiles in %.1f seconds." % (len(rebuilt), len(tiles), time.time() - tilestart))
+
+    # the highest peak of any tile
+    peak = [0, 0, 0]
+    for (x, y, digest, built, tilepeak) in results:
+        if (tilepeak[1] > peak[1]):
+            peak = tilepeak
+
+    # generate overall world
+    worlddir = os.path.join('Worlds', args.name)
 
     # Necessary for tile-welding -> regions
     cleanmkdir(worlddir)
@@ -173,28 +223,18 @@ def main():
         # merge individual tiles into regions
         log.log_info("Merging %d tiles into one world..." % len(tiles))
         for tile in tiles:
-            (dummy, name, x, y) = tile
+            (dummy, name, x, y, engine, recorded, dryrun) = tile
             tiledir = os.path.join('Regions', name, 'Tiles', '%dx%d' % (x, y))
             if not(os.path.isfile(os.path.join(tiledir, 'Tile.yaml'))):
                 log.log_fatal("The following tile is missing. Please re-run this script:\n%s" % \
                       os.path.join(tiledir, 'Tile.yaml'))
 
         if args.single:
-            # single process version
             log.log_warn("Single-threaded region merge")
-            for region in regions:
-                buildregion(region)
-        else:
-            # multi-process version
-            pool = Pool()
-            rs = pool.map_async(buildregion, regions)
-            pool.close()
-            while not(rs.ready()):
-                remaining = rs._number_left
-                log.log_info("Waiting for %s buildregion tasks to complete..." %
-                             remaining)
-                time.sleep(10)
-            pool.join()        # Just as a precaution.
+        mergestart = time.time()
+        scheduler(buildregion, regions, label='regions', \
+                  describe=lambda region: 'Region %dx%d' % (region[2], region[3]))
+        log.log_info("Merged %d regions in %.1f seconds." % (len(regions), time.time() - mergestart))
 
     world = mclevel.MCInfdevOldLevel(worlddir, create=True)
     if not(args.safemerge):
@@ -205,42 +245,24 @@ def main():
         tilebox = box.BoundingBox((mcoffsetx, 0, mcoffsetz), (mcsizex, world.Height, mcsizez))
         world.createChunksInBox(tilebox)
 
-    for tile in tiles:
-        (dummy, name, x, y) = tile
-        tiledir = os.path.join('Regions', name, 'Tiles', '%dx%d' % (x, y))
-        tilefile = file(os.path.join(tiledir, 'Tile.yaml'))
-        newtile = yaml.load(tilefile)
-        tilefile.close()
-        if (newtile.peak[1] > peak[1]):
-            peak = newtile.peak
-        for treetype in newtile.trees:
-            trees.setdefault(treetype, []).extend(newtile.trees[treetype])
-        if myRegion.doOre:
-            for oretype in newtile.ores:
-                ores.setdefault(oretype, []).extend(newtile.ores[oretype])
-        if args.safemerge:
+    if args.safemerge:
+        for (x, y, digest, built, tilepeak) in results:
+            tiledir = os.path.join('Regions', name, 'Tiles', '%dx%d' % (x, y))
             tileworld = mclevel.MCInfdevOldLevel(tiledir, create=False)
             world.copyBlocksFrom(tileworld, tileworld.bounds, tileworld.bounds.origin)
             tileworld = False
 
-    # plant trees in our world
-    log.log_info("Planting %d trees at the region level..." % \
-                 sum([len(trees[treetype]) for treetype in trees]))
-    Tree.placetreesinregion(trees, treeobjs, world)
-
-    # deposit ores in our world
-    if myRegion.doOre:
-        log.log_info("Depositing %d ores at the region level..." % \
-                     sum([len(ores[oretype]) for oretype in ores]))
-        Ore.placeoreinregion(ores, oreobjs, world)
-
     # tie up loose ends
     world.setPlayerGameType(1)
     setspawnandsave(world, peak)
     oldyamlpath = os.path.join('Regions', args.name, 'Region.yaml')
     newyamlpath = os.path.join('Worlds', args.name, 'Region.yaml')
     shutil.copy(oldyamlpath, newyamlpath)
-    shutil.rmtree(os.path.join('Regions', name, 'Tiles'))
+
+    # peak memory of this process and of the largest worker
+    log.log_info("Built region %s in %.1f seconds, peak memory %d MB (largest worker %d MB)." % \
+                 (args.name, time.time() - start, getrusage(RUSAGE_SELF).ru_maxrss / 1024, \
+                  getrusage(RUSAGE_CHILDREN).ru_maxrss / 1024))
 
 if __name__ == '__main__':
     main()
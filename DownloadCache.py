@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+from region import Region
+from cache import Cache
+import sys
+import argparse
+from klogger import klogger, klog_levels
+
+def main():
+    """Reports on and trims the shared download cache."""
+    parser = argparse.ArgumentParser(description='Reports download cache hit rate and disk usage.')
+    parser.add_argument('--evict', type=int, help='remove least recently used downloads until the cache fits in this many megabytes')
+    parser.add_argument("-v", "--verbosity", action="count", \
+                        help="increase output verbosity")
+    parser.add_argument("-q", "--quiet", action="store_true", \
+                        help="suppress informational output")
+    args = parser.parse_args()
+
+    # set up logging
+    log_level = klog_levels.LOG_INFO
+    if args.quiet:
+        log_level = klog_levels.LOG_ERROR
+    if args.verbosity:
+        # v=1 is DEBUG 1, v=2 is DEBUG 2, and so on
+        log_level += args.verbosity
+    log = klogger(log_level)
+
+    cache = Cache(Region.downloadtop)
+    if args.evict != None:
+        removed = cache.evict(args.evict * 1024 * 1024)
+        log.log_info("Evicted %d entries." % removed)
+
+    (hits, misses) = cache.hitrate()
+    lookups = hits + misses
+    rate = 100.0 * hits / lookups if lookups > 0 else 0
+    (archivebytes, memberbytes) = cache.usage()
+    log.log_info("Cache %s holds %d entries." % (Region.downloadtop, len(cache.manifest['entries'])))
+    log.log_info("Hit rate: %d of %d lookups (%.1f%%)" % (hits, lookups, rate))
+    log.log_info("Disk usage: %d bytes in archives, %d bytes extracted, %d bytes total" % \
+                 (archivebytes, memberbytes, archivebytes + memberbytes))
+
+if __name__ == '__main__':
+    sys.exit(main())
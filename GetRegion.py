@@ -51,7 +51,7 @@ def main():
     parser.add_argument('--xmin', required=True, type=float, help='westernmost longitude (west is negative)')
     parser.add_argument('--ymax', required=True, type=float, help='northernmost latitude (south is negative)')
     parser.add_argument('--ymin', required=True, type=float, help='southernmost longitude (south is negative)')
-    parser.add_argument('--tilesize', type=int, help='tilesize value (default %d)' % Region.tilesize)
+    parser.add_argument('--tilesize', type=int, help='tilesize value (default %d, 512 makes each tile one region file)' % Region.tilesize)
     parser.add_argument('--scale', type=int, help='scale value (default %d)' % Region.scale)
     parser.add_argument('--vscale', type=int, help='vscale value (default %d)' % Region.vscale)
     parser.add_argument('--trim', type=int, help='trim value (default %d)' % Region.trim)
@@ -62,6 +62,10 @@ def main():
     parser.add_argument('--landcoverIDs', default=default_landcoverIDs, type=checkLandcoverIDs, help='ordered list of product IDs (default %s)' % default_landcoverIDs)
     parser.add_argument('--enable-ore', action='store_true', dest='doOre', default=False, help='enable ore generation')
     parser.add_argument('--enable-schematics', action='store_true', dest='doSchematics', default=False, help='enable schematic usage')
+    parser.add_argument('--download-threads', type=int, dest='downloadthreads', help='concurrent downloads (default %d)' % Region.downloadthreads)
+    parser.add_argument('--download-cache-size', type=int, dest='downloadcachesize', help='evict least recently used downloads beyond this many megabytes')
+    parser.add_argument('--cachemax', type=int, help='GDAL cache size in megabytes (default %d)' % Region.cachemax)
+    parser.add_argument('--warpmemory', type=int, help='GDAL warp memory limit in megabytes (default %d)' % Region.warpmemory)
     parser.add_argument("-v", "--verbosity", action="count", \
                         help="increase output verbosity")
     parser.add_argument("-q", "--quiet", action="store_true", \
@@ -79,10 +83,14 @@ def main():
 
     # create the region
     log.log_info("Creating new region %s..." % args.name)
-    myRegion = Region(name=args.name, xmax=args.xmax, xmin=args.xmin, ymax=args.ymax, ymin=args.ymin, scale=args.scale, vscale=args.vscale, trim=args.trim, tilesize=args.tilesize, sealevel=args.sealevel, maxdepth=args.maxdepth, oiIDs=args.orthoIDs, lcIDs=args.landcoverIDs, elIDs=args.elevationIDs, doOre=args.doOre, doSchematics=args.doSchematics)
+    myRegion = Region(name=args.name, xmax=args.xmax, xmin=args.xmin, ymax=args.ymax, ymin=args.ymin, scale=args.scale, vscale=args.vscale, trim=args.trim, tilesize=args.tilesize, sealevel=args.sealevel, maxdepth=args.maxdepth, oiIDs=args.orthoIDs, lcIDs=args.landcoverIDs, elIDs=args.elevationIDs, doOre=args.doOre, doSchematics=args.doSchematics, cachemax=args.cachemax, warpmemory=args.warpmemory)
 
     log.log_info("Retrieving files...")
     myRegion.log = log
+    if args.downloadthreads:
+        myRegion.downloadthreads = args.downloadthreads
+    if args.downloadcachesize:
+        myRegion.downloadcachesize = args.downloadcachesize
     myRegion.getfiles()
 
 if __name__ == '__main__':
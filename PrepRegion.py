@@ -7,6 +7,7 @@ import argparse
 import os
 import yaml
 from klogger import klogger, klog_levels
+from region import Region
 
 def main():
     """Rebuilds maps on broken regions."""
@@ -14,6 +15,11 @@ def main():
     parser.add_argument('--name', required=True, type=str, help='name of region')
     parser.add_argument('--disable-opencl', action='store_false', dest='doOCL', default=True, help='disable OpenCL code')
     parser.add_argument('--single', action='store_true', help='enable single-threaded mode for debugging or profiling')
+    parser.add_argument('--stream', action='store_true', help='warp elevation and orthoimagery per tile instead of in a first pass')
+    parser.add_argument('--store', action='store_true', help='also write a tile-aligned memory-mapped copy of the map for building')
+    parser.add_argument('--dry-run', action='store_true', dest='dryrun', help='report which warps and prep tiles would be rebuilt without building anything')
+    parser.add_argument('--cachemax', type=int, help='GDAL cache size in megabytes (default %d)' % Region.cachemax)
+    parser.add_argument('--warpmemory', type=int, help='GDAL warp memory limit in megabytes (default %d)' % Region.warpmemory)
     parser.add_argument("-v", "--verbosity", action="count", \
                         help="increase output verbosity")
     parser.add_argument("-q", "--quiet", action="store_true", \
@@ -35,7 +41,13 @@ def main():
     yamlfile.close()
 
     myRegion.log = log
-    myRegion.buildmap(args.doOCL, args.single)
+    if args.cachemax:
+        myRegion.cachemax = args.cachemax
+    if args.warpmemory:
+        myRegion.warpmemory = args.warpmemory
+    myRegion.buildmap(args.doOCL, args.single, args.stream, args.dryrun)
+    if args.store and not args.dryrun:
+        myRegion.buildstore()
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,72 @@
+# build graph module
+import os
+import hashlib
+import yaml
+import numpy
+
+class BuildGraph:
+    """Remembers the digest of the inputs each target was built from.
+
+    Targets are strings such as 'warp/elevation', 'prep/0x1/crust' or
+    'tile/12x-4'.  A target whose inputs still hash to the recorded
+    digest does not need to be built again."""
+
+    # source directory for code versions
+    codedir = os.path.dirname(os.path.abspath(__file__))
+
+    def __init__(self, filename):
+        self.filename = filename
+        if os.path.exists(filename):
+            graphfile = file(filename)
+            self.digests = yaml.load(graphfile)
+            graphfile.close()
+        else:
+            self.digests = {}
+
+    @staticmethod
+    def digest(*parts):
+        """SHA-1 of arrays, dictionaries and anything else with a stable repr."""
+        sha = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, numpy.ndarray):
+                sha.update('%s%s' % (part.dtype, part.shape))
+                sha.update(numpy.ascontiguousarray(part).tostring())
+            elif isinstance(part, dict):
+                sha.update(repr(sorted(part.items())))
+            else:
+                sha.update(repr(part))
+        return sha.hexdigest()
+
+    @staticmethod
+    def filestat(filename):
+        """Stand-in for the contents of a large file: its path, size and mtime."""
+        stat = os.stat(filename)
+        return (os.path.abspath(filename), stat.st_size, int(stat.st_mtime))
+
+    @staticmethod
+    def codeversion(modules):
+        """Digest of the source of the named modules."""
+        sha = hashlib.sha1()
+        for module in modules:
+            sourcefile = open(os.path.join(BuildGraph.codedir, '%s.py' % module), 'rb')
+            sha.update(sourcefile.read())
+            sourcefile.close()
+        return sha.hexdigest()
+
+    def current(self, target, digest):
+        """True if target was last built from inputs with this digest."""
+        return self.digests.get(target) == digest
+
+    def recorded(self, prefix):
+        """Recorded digests of the targets under prefix, keyed by the rest of their names."""
+        return dict([(target[len(prefix):], digest) for (target, digest) in self.digests.items() if target.startswith(prefix)])
+
+    def record(self, target, digest):
+        self.digests[target] = digest
+
+    def save(self):
+        graphtemp = '%s.tmp' % self.filename
+        graphfile = file(graphtemp, 'w')
+        yaml.dump(self.digests, graphfile)
+        graphfile.close()
+        os.rename(graphtemp, self.filename)
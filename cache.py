@@ -0,0 +1,180 @@
+# download cache module
+import os
+import time
+import hashlib
+import shutil
+import threading
+import yaml
+
+class Cache:
+    """Content-addressed store of downloaded archives and their extracted members.
+
+    Archives live under objects/ named by their SHA-1 so regions which
+    share USGS tiles share one copy.  The manifest maps each key to its
+    URL, size, checksum, extracted members and last-used time."""
+
+    # bytes per read while hashing
+    blocksize = 1024 * 1024
+
+    def __init__(self, top):
+        self.top = top
+        self.objectdir = os.path.join(top, 'objects')
+        if not os.path.exists(self.objectdir):
+            os.makedirs(self.objectdir)
+        self.manifestname = os.path.join(top, 'manifest.yaml')
+        self.lock = threading.Lock()
+        if os.path.exists(self.manifestname):
+            manifestfile = file(self.manifestname)
+            self.manifest = yaml.load(manifestfile)
+            manifestfile.close()
+        else:
+            self.manifest = { 'entries': {}, 'hits': 0, 'misses': 0 }
+
+    def save(self):
+        """Write the manifest atomically.  Caller holds the lock."""
+        manifesttemp = '%s.tmp' % self.manifestname
+        manifestfile = file(manifesttemp, 'w')
+        yaml.dump(self.manifest, manifestfile)
+        manifestfile.close()
+        os.rename(manifesttemp, self.manifestname)
+
+    @staticmethod
+    def checksum(filename):
+        """SHA-1 of a file."""
+        digest = hashlib.sha1()
+        infile = open(filename, 'rb')
+        while True:
+            data = infile.read(Cache.blocksize)
+            if not data:
+                break
+            digest.update(data)
+        infile.close()
+        return digest.hexdigest()
+
+    def objectpath(self, entry):
+        """Path of the archive for an entry."""
+        if entry['suffix'] == '':
+            return os.path.join(self.objectdir, entry['checksum'])
+        return os.path.join(self.objectdir, '%s.%s' % (entry['checksum'], entry['suffix']))
+
+    def memberpaths(self, entry):
+        """Paths of the extracted members of an entry."""
+        return [os.path.join(self.top, member) for member in entry['members']]
+
+    def lookup(self, key):
+        """Return the archive for key if it is cached, otherwise None.
+
+        Counts a hit or a miss and marks the entry as used.  These are
+        only kept in memory until the manifest is next written."""
+        self.lock.acquire()
+        try:
+            entry = self.manifest['entries'].get(key)
+            if entry != None and os.path.exists(self.objectpath(entry)):
+                self.manifest['hits'] += 1
+                entry['lastused'] = time.time()
+                retval = self.objectpath(entry)
+            else:
+                self.manifest['misses'] += 1
+                retval = None
+            return retval
+        finally:
+            self.lock.release()
+
+    def extracted(self, key):
+        """True if every recorded member of key is present."""
+        self.lock.acquire()
+        try:
+            entry = self.manifest['entries'].get(key)
+            return entry != None and entry['members'] != [] and \
+                   all([os.path.exists(member) for member in self.memberpaths(entry)])
+        finally:
+            self.lock.release()
+
+    def add(self, key, url, filename):
+        """Move a finished download into the store and return its new path."""
+        checksum = Cache.checksum(filename)
+        size = os.path.getsize(filename)
+        # everything after the first dot, so tar.gz stays whole
+        parts = os.path.basename(filename).split('.', 1)
+        suffix = parts[1] if len(parts) > 1 else ''
+        self.lock.acquire()
+        try:
+            entry = { 'url': url, 'size': size, 'checksum': checksum, 'suffix': suffix, \
+                      'members': [], 'lastused': time.time() }
+            archive = self.objectpath(entry)
+            if os.path.exists(archive):
+                # identical content is already stored
+                os.remove(filename)
+            else:
+                shutil.move(filename, archive)
+            self.manifest['entries'][key] = entry
+            self.save()
+            return archive
+        finally:
+            self.lock.release()
+
+    def setmembers(self, key, members):
+        """Record the extracted members of key."""
+        self.lock.acquire()
+        try:
+            entry = self.manifest['entries'][key]
+            entry['members'] = [os.path.relpath(member, self.top) for member in members]
+            self.save()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """Write the manifest with the counts and use times of lookups."""
+        self.lock.acquire()
+        try:
+            self.save()
+        finally:
+            self.lock.release()
+
+    def usage(self):
+        """Return (archive bytes, member bytes) on disk."""
+        self.lock.acquire()
+        try:
+            archives = {}
+            members = 0
+            for entry in self.manifest['entries'].values():
+                archive = self.objectpath(entry)
+                if os.path.exists(archive):
+                    archives[archive] = os.path.getsize(archive)
+                members += sum([os.path.getsize(member) for member in self.memberpaths(entry) if os.path.exists(member)])
+            return (sum(archives.values()), members)
+        finally:
+            self.lock.release()
+
+    def hitrate(self):
+        """Return (hits, misses)."""
+        return (self.manifest['hits'], self.manifest['misses'])
+
+    def evict(self, maxbytes):
+        """Remove least recently used entries until the cache fits in maxbytes.
+
+        Returns the number of entries removed."""
+        (archivebytes, memberbytes) = self.usage()
+        total = archivebytes + memberbytes
+        removed = 0
+        self.lock.acquire()
+        try:
+            entries = self.manifest['entries']
+            for key in sorted(entries.keys(), key=lambda key: entries[key]['lastused']):
+                if total <= maxbytes:
+                    break
+                entry = entries.pop(key)
+                for member in self.memberpaths(entry):
+                    if os.path.exists(member):
+                        total -= os.path.getsize(member)
+                        os.remove(member)
+                # archives may be shared by identical downloads
+                archive = self.objectpath(entry)
+                if os.path.exists(archive) and not any([self.objectpath(other) == archive for other in entries.values()]):
+                    total -= os.path.getsize(archive)
+                    os.remove(archive)
+                removed += 1
+            self.save()
+        finally:
+            self.lock.release()
+        return removed
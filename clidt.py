@@ -138,3 +138,52 @@ class CLIDT:
         self.program = None
         self.queue = None
         self.ctx = None
+
+if __name__ == '__main__':
+    # benchmark the CPU backend on a landcover prep tile
+    # defaults match the default region: prepTileSizeOverlap 1100,
+    # maxdepth 32, scale 6 and 30 meter landcover pixels
+    import time
+    from invdisttree import Invdisttree
+
+    size = 1100 + 2 * 32
+    scale = 6
+    lcscale = 30
+    nnear = CLIDT.nnear
+    ncheck = 50000
+    seed = 1
+
+    exec "\n".join( sys.argv[1:] )  # python clidt.py size= ...
+    np.random.seed(seed)
+
+    lcsize = size * scale // lcscale + 1
+    coords = np.array([(x, y) for y in xrange(0, lcsize * lcscale, lcscale) for x in xrange(0, lcsize * lcscale, lcscale)])
+    values = np.random.choice([11, 21, 22, 41, 42, 43, 52, 71, 81, 82, 90], len(coords))
+    base = np.array([(x, y) for y in xrange(0, size * scale, scale) for x in xrange(0, size * scale, scale)])
+    print "CLIDT CPU backend: %d landcover points -> %d x %d prep tile, nnear %d" % (len(coords), size, size, nnear)
+
+    for majority in [True, False]:
+        start = time.time()
+        retval = CLIDT(coords, values, base, wantCL=False, nnear=nnear, majority=majority)()
+        vectime = time.time() - start
+
+        # the original loop is too slow for a whole tile, so time a slice
+        IDT = Invdisttree(coords, values)
+        start = time.time()
+        looped = np.asarray(IDT.loop(base[:ncheck], nnear, majority=majority), dtype=np.int32)
+        looptime = (time.time() - start) * len(base) / ncheck
+
+        # the loop breaks majority ties in dict order, the vectorized
+        # version to the smallest value, so count the differences that
+        # are ties between equally weighted values
+        differ = np.nonzero(looped != retval[:ncheck])[0]
+        ties = 0
+        for index in differ:
+            w = 1 / IDT.distances[index]
+            w /= np.sum(w)
+            zix = values[IDT.ix[index]]
+            if abs(np.sum(w[zix == looped[index]]) - np.sum(w[zix == retval[index]])) < 1e-9:
+                ties += 1
+
+        print "%s: vectorized %.1f seconds, loop %.1f seconds (estimated), %d of %d sample points differ, %d of them ties" % \
+            ('majority' if majority else 'weighted', vectime, looptime, len(differ), ncheck, ties)
@@ -0,0 +1,157 @@
+# download module
+import os
+import errno
+import time
+import urllib2
+import shutil
+import tarfile
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+class Downloader:
+    """Fetch many URLs concurrently with resumable, size-checked transfers."""
+
+    # bytes per read
+    blocksize = 1024 * 1024
+
+    # concurrent transfers
+    threads = 4
+
+    def __init__(self, threads=None):
+        if threads == None:
+            self.threads = Downloader.threads
+        else:
+            if (threads > 0):
+                self.threads = int(threads)
+            else:
+                raise AttributeError, 'bad threads %s' % threads
+
+    @staticmethod
+    def resolve(url):
+        """Follow redirects and return the final URL and its size."""
+        page = urllib2.urlopen(url)
+        finalurl = page.geturl()
+        if 'Content-Length' in page.headers:
+            size = int(page.headers['Content-Length'])
+        else:
+            size = None
+        page.close()
+        return (finalurl, size)
+
+    @staticmethod
+    def fetch(url, filename, size=None):
+        """Download url to filename, resuming any partial file.
+
+        Returns the number of bytes transferred.  If the size is known
+        the finished file must match it or IOError is raised."""
+        if os.path.exists(filename):
+            existsize = os.path.getsize(filename)
+        else:
+            existsize = 0
+        if size != None:
+            if existsize == size:
+                return 0
+            if existsize > size:
+                # not the file we expected, so start over
+                existsize = 0
+
+        req = urllib2.Request(url)
+        if existsize > 0:
+            req.add_header('Range', 'bytes=%d-' % existsize)
+        page = urllib2.urlopen(req)
+        if existsize > 0 and 'Content-Range' not in page.headers:
+            # the server sent the whole file so overwrite rather than skip
+            existsize = 0
+        if size == None and 'Content-Length' in page.headers:
+            size = existsize + int(page.headers['Content-Length'])
+
+        numbytes = 0
+        output = open(filename, 'ab' if existsize > 0 else 'wb')
+        try:
+            while True:
+                data = page.read(Downloader.blocksize)
+                if not data:
+                    break
+                output.write(data)
+                numbytes += len(data)
+        finally:
+            output.close()
+            page.close()
+
+        if size != None and os.path.getsize(filename) != size:
+            raise IOError, '%s is %d bytes, expected %d' % (filename, os.path.getsize(filename), size)
+        return numbytes
+
+    @staticmethod
+    def extract(archive, destination):
+        """Stream members out of a zip or tar archive in-process.
+
+        destination(name) gives the path for a member or None to skip it.
+        Each path is written once, so the first matching member wins.
+        Returns the paths written."""
+        written = []
+        def store(infile, name):
+            path = destination(name)
+            if path == None or path in written:
+                return
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError, inst:
+                # another thread may have made it first
+                if inst.errno != errno.EEXIST:
+                    raise
+            pathtemp = '%s.tmp' % path
+            outfile = open(pathtemp, 'wb')
+            shutil.copyfileobj(infile, outfile, Downloader.blocksize)
+            outfile.close()
+            os.rename(pathtemp, path)
+            written.append(path)
+
+        if zipfile.is_zipfile(archive):
+            zf = zipfile.ZipFile(archive)
+            try:
+                for name in zf.namelist():
+                    if destination(name) != None:
+                        infile = zf.open(name)
+                        store(infile, name)
+                        infile.close()
+            finally:
+                zf.close()
+        else:
+            # one pass over the compressed stream
+            tf = tarfile.open(archive, 'r|*')
+            try:
+                for member in tf:
+                    if member.isfile() and destination(member.name) != None:
+                        store(tf.extractfile(member), member.name)
+            finally:
+                tf.close()
+        return written
+
+    def __call__(self, function, jobs):
+        """Run function over (key, args) jobs concurrently.
+
+        function(*args) must return the number of bytes it transferred.
+        Returns a dictionary of key: (results, bytes, seconds) where
+        seconds is from the first start to the last finish for that key."""
+        def timed(job):
+            (key, args) = job
+            start = time.time()
+            (result, numbytes) = function(*args)
+            return (key, result, numbytes, start, time.time())
+
+        pool = ThreadPool(self.threads)
+        try:
+            finished = pool.map(timed, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        retval = {}
+        for (key, result, numbytes, start, end) in finished:
+            if key not in retval:
+                retval[key] = ([], 0, start, end)
+            (results, totalbytes, first, last) = retval[key]
+            results.append(result)
+            retval[key] = (results, totalbytes + numbytes, min(first, start), max(last, end))
+        return dict([(key, (results, totalbytes, last - first)) for (key, (results, totalbytes, first, last)) in retval.items()])
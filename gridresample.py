@@ -0,0 +1,106 @@
+# grid resampling module
+from __future__ import division
+import numpy as np
+from math import ceil, sqrt, pi
+from invdisttree import Invdisttree
+from clidt import CLIDT
+
+class GridIDT:
+    """Solve the IDT problem when the inputs are regular grids.
+
+    The source is an axis-aligned raster window and the destination is
+    a regular grid, so the neighbours of each destination point are
+    found by index arithmetic over a small window of source pixels
+    instead of through a KD-tree.  Use CLIDT for anything irregular."""
+
+    # destination points processed at once
+    chunksize = 32768
+
+    def __init__(self, values, geotrans, origin, scale, shape, nnear=None, majority=True, p=1):
+        # values: source raster window
+        # geotrans: GDAL geotransform of values[0, 0]
+        # origin: (xmin, ymax) of the destination grid
+        # scale: destination grid spacing
+        # shape: (rows, cols) of the destination grid
+        if not GridIDT.regular(geotrans):
+            raise AttributeError, "geotransform %s is not axis-aligned" % str(geotrans)
+        self.values = np.asarray(values, dtype=np.int32)
+        self.geotrans = geotrans
+        self.origin = origin
+        self.scale = scale
+        self.shape = shape
+        if nnear == None:
+            self.nnear = CLIDT.nnear
+        else:
+            self.nnear = nnear
+        self.majority = majority
+        self.p = p
+
+    @staticmethod
+    def regular(geotrans):
+        """Returns True if the geotransform has no rotation terms."""
+        return geotrans[2] == 0 and geotrans[4] == 0
+
+    def interpolate(self, dist, z):
+        """Inverse-distance weighting or majority vote over sorted neighbours."""
+        if self.nnear == 1:
+            return z[:, 0]
+        retval = np.array(z[:, 0], dtype=np.float64)
+        rows = dist[:, 0] >= 1e-10
+        w = 1 / dist[rows]**self.p
+        w /= np.sum(w, axis=1)[:, np.newaxis]
+        if self.majority:
+            retval[rows] = Invdisttree.majority(z[rows], w)
+        else:
+            retval[rows] = np.einsum('ij,ij->i', w, z[rows])
+        return retval
+
+    def __call__(self):
+        (rows, cols) = self.shape
+        (ny, nx) = self.values.shape
+
+        # fractional source pixel of every destination column and row
+        # NB: CLIDT stores coordinates as whole meters, so do the same
+        (xmin, ymax) = [np.floor(value) for value in self.origin]
+        (srcx, srcy) = [np.floor(value) for value in (self.geotrans[0], self.geotrans[3])]
+        fi = (xmin + self.scale * np.arange(cols) - srcx) / self.geotrans[1]
+        fj = (ymax - self.scale * np.arange(rows) - srcy) / self.geotrans[5]
+
+        # the window must be wide enough to hold the nnear nearest pixels
+        half = int(ceil(sqrt(self.nnear / pi))) + 1
+        offsets = np.arange(1 - half, half + 1)
+        width = len(offsets)
+        ci = np.floor(fi).astype(np.intp)[:, np.newaxis] + offsets
+        cj = np.floor(fj).astype(np.intp)[:, np.newaxis] + offsets
+        dx = (ci - fi[:, np.newaxis]) * self.geotrans[1]
+        dy = (cj - fj[:, np.newaxis]) * self.geotrans[5]
+        validi = (ci >= 0) & (ci < nx)
+        validj = (cj >= 0) & (cj < ny)
+        ci = np.clip(ci, 0, nx - 1)
+        cj = np.clip(cj, 0, ny - 1)
+
+        retval = np.zeros(self.shape, dtype=np.int32)
+        chunkrows = max(1, self.chunksize // cols)
+        for start in xrange(0, rows, chunkrows):
+            stop = min(start + chunkrows, rows)
+            # (row, col, window row, window col) flattened to one row per point
+            dist = np.hypot(dy[start:stop, np.newaxis, :, np.newaxis], dx[np.newaxis, :, np.newaxis, :])
+            valid = validj[start:stop, np.newaxis, :, np.newaxis] & validi[np.newaxis, :, np.newaxis, :]
+            dist = np.where(valid, dist, np.inf).reshape(-1, width * width)
+            z = self.values[cj[start:stop, np.newaxis, :, np.newaxis], ci[np.newaxis, :, np.newaxis, :]].reshape(-1, width * width)
+            # keep the nnear nearest, closest first
+            order = np.argsort(dist, axis=1, kind='mergesort')[:, :self.nnear]
+            index = np.arange(len(dist))[:, np.newaxis]
+            retval[start:stop] = self.interpolate(dist[index, order], z[index, order]).reshape(stop - start, cols)
+
+        # windows cut short by the edge of the source may miss some of the
+        # nearest pixels, so those points go through a KD-tree instead
+        edge = ~validj.all(axis=1)[:, np.newaxis] | ~validi.all(axis=1)[np.newaxis, :]
+        if edge.any():
+            (j, i) = np.nonzero(edge)
+            (sj, si) = np.mgrid[0:ny, 0:nx]
+            coords = np.column_stack([(srcx + self.geotrans[1] * si).ravel(), (srcy + self.geotrans[5] * sj).ravel()])
+            points = np.column_stack([xmin + self.scale * i, ymax - self.scale * j])
+            IDT = Invdisttree(coords, self.values.ravel())
+            retval[j, i] = IDT(points, self.nnear, p=self.p, majority=self.majority)
+        return retval
@@ -78,6 +78,56 @@ is exceedingly sensitive to distance and to h.
         if self.wsum is None:
             self.wsum = np.zeros(nnear)
 
+        self.distances, self.ix = self.tree.query( q, k=nnear, eps=eps )
+        interpol = np.zeros( (len(self.distances),) + np.shape(self.z[0]) )
+        if nnear == 1:
+            interpol[:] = self.z[self.ix]
+        else:
+            exact = self.distances[:,0] < 1e-10
+            interpol[exact] = self.z[self.ix[exact,0]]
+            rows = ~exact
+            ix = self.ix[rows]
+            # weight z s by 1/dist, one row per query point --
+            w = 1 / self.distances[rows]**p
+            if weights is not None:
+                w *= weights[ix]  # >= 0
+            w /= np.sum( w, axis=1 )[:,np.newaxis]
+            if majority:
+                interpol[rows] = self.majority( self.z[ix], w )
+            else:
+                interpol[rows] = np.einsum( 'ij,ij...->i...', w, self.z[ix] )
+            if self.stat:
+                self.wn += len(w)
+                self.wsum += np.sum( w, axis=0 )
+        return interpol if qdim > 1  else interpol[0]
+
+    @staticmethod
+    def majority( zix, w, chunksize=65536 ):
+        """ weighted majority vote along each row of zix, ties to the smallest value
+            (loop breaks ties in dict order instead) """
+        values, codes = np.unique( zix, return_inverse=True )
+        codes = codes.reshape( zix.shape )
+        nvalues = len(values)
+        winners = np.zeros( len(zix), dtype=np.intp )
+            # one bincount per chunk of rows, each row offset into its own bins --
+        for start in xrange( 0, len(zix), chunksize ):
+            chunk = codes[start:start+chunksize]
+            nrows = len(chunk)
+            bins = chunk + nvalues * np.arange(nrows)[:,np.newaxis]
+            votes = np.bincount( bins.ravel(), weights=w[start:start+chunksize].ravel(),
+                minlength=nrows*nvalues )
+            winners[start:start+nrows] = votes.reshape( nrows, nvalues ).argmax( axis=1 )
+        return values[winners]
+
+    def loop( self, q, nnear=6, eps=0, p=1, weights=None, majority=False ):
+        """ the original per-point version of __call__, kept for comparison """
+        q = np.asarray(q)
+        qdim = q.ndim
+        if qdim == 1:
+            q = np.array([q])
+        if self.wsum is None:
+            self.wsum = np.zeros(nnear)
+
         self.distances, self.ix = self.tree.query( q, k=nnear, eps=eps )
         interpol = np.zeros( (len(self.distances),) + np.shape(self.z[0]) )
         jinterpol = 0
@@ -1,10 +1,13 @@
 # ore module
 from __future__ import division
-from random import randint
+from random import Random
 from math import pi
 from scipy.special import cbrt
 from itertools import product
-from utils import materialNamed
+import time
+import numpy
+from utils import materialNamed, tileseed
+from memoize import memoize
 
 # http://www.minecraftforum.net/topic/25886-elites-of-minecraft-the-miner-first-ore-loss-calculated/ (must be logged in)
 
@@ -15,6 +18,9 @@ class Ore:
     # we use 'end stone' actually since 'stone' might be in a schematic
     stoneID = materialNamed('End Stone')
 
+    # what the End Stone left over becomes
+    fillID = materialNamed('Stone')
+
     def __init__(self, name, depth=None, rounds=None, size=None):
         # nobody checks names
         # NB: ore names are block names too, consider fixing this
@@ -23,70 +29,124 @@ class Ore:
         self.rounds = rounds
         self.size = size
 
-    def __call__(self, coords):
-        # generate ellipsoid values based on parameters
-        (mcx, mcy, mcz) = coords
+    def shape(self, rng):
+        """Draw the radii of an ore body from rng."""
         # start with random radius-like values
-        x0 = randint(1, 4)
-        y0 = randint(1, 4)
-        z0 = randint(1, 4)
+        x0 = rng.randint(1, 4)
+        y0 = rng.randint(1, 4)
+        z0 = rng.randint(1, 4)
         v0 = 4/3 * pi * x0 * y0 * z0
         # scale to match volume and round up
         scale = cbrt(self.size / v0)
         x1 = int(round(scale * x0))
         y1 = int(round(scale * y0))
         z1 = int(round(scale * z0))
-        # pre-calculate squares
-        x2 = x1 * x1
-        y2 = y1 * y1
-        z2 = z1 * z1
-        # generate ranges
-        xr = xrange(-1 * x1, x1)
-        yr = xrange(-1 * y1, y1)
-        zr = xrange(-1 * z1, z1)
-        # calculate ellipsoid
-        oreCoords = [ [mcx+x, mcy+y, mcz+z] for x, y, z in product(xr, yr, zr) if x*x/x2+y*y/y2+z*z/z2 <= 1 ]
-        # if len(oreCoords) > self.size+2:
-        #     print "warning: oreCoords larger than self.size -- %d > %d" % (len(oreCoords), self.size)
-        # if len(oreCoords) < self.size-2:
-        #     print "warning: oreCoords smaller than self.size -- %d < %d" % (len(oreCoords), self.size)
-        return oreCoords
+        return (x1, y1, z1)
 
     @staticmethod
-    def placeoreintile(tile):
-        # strictly speaking, this should be in class Tile somehow
-        oreobjs = dict([(ore.name, ore) for ore in oreObjs])
-        tile.ores = dict([(name, list()) for name in oreobjs])
-
-        for ore in oreobjs:
-            extent = cbrt(oreobjs[ore].size)*2
-            maxy = pow(2, oreobjs[ore].depth)
-            numrounds = int(oreobjs[ore].rounds * (tile.size/16) * (tile.size/16))
-            oreID = materialNamed(oreobjs[ore].name)
+    @memoize()
+    def mask(radii):
+        """Return the ellipsoid with these radii as a boolean array.
+
+        The array is indexed [x, z, y] like chunk arrays, with the
+        center of the body at [x1, z1, y1].  There are few distinct
+        radii, so each mask is computed once."""
+        (x1, y1, z1) = radii
+        x = numpy.arange(-1 * x1, x1, dtype=float)[:, numpy.newaxis, numpy.newaxis]
+        z = numpy.arange(-1 * z1, z1, dtype=float)[numpy.newaxis, :, numpy.newaxis]
+        y = numpy.arange(-1 * y1, y1, dtype=float)[numpy.newaxis, numpy.newaxis, :]
+        # same terms in the same order as the scalar test
+        return x*x/(x1*x1) + y*y/(y1*y1) + z*z/(z1*z1) <= 1
+
+    @staticmethod
+    def bodies(name, tilex, tiley, size):
+        """Return the ore bodies rooted in a tile as (ore, coords, radii).
+
+        Each tile has its own random stream, so any tile can work out
+        the bodies of its neighbours."""
+        rng = Random(tileseed('%s/ore' % name, tilex, tiley))
+        retval = []
+        for ore in oreObjs:
+            maxy = pow(2, ore.depth)
+            numrounds = int(ore.rounds * (size/16) * (size/16))
             for dummy in xrange(numrounds):
-                orex = randint(0, tile.size)
-                orey = randint(0, maxy)
-                orez = randint(0, tile.size)
-                coords = [orex+tile.mcoffsetx, orey, orez+tile.mcoffsetz]
-                if (orex < extent or (tile.size-orex) < extent or
-                    orez < extent or (tile.size-orez) < extent):
-                    try:
-                        tile.ores[ore]
-                    except KeyError:
-                        tile.ores[ore] = []
-                    tile.ores[ore].append(coords)
-                else:
-                    for x, y, z in oreobjs[ore](coords):
-                        if tile.world.blockAt(x, y, z) == Ore.stoneID:
-                            tile.world.setBlockAt(x, y, z, oreID)
+                orex = rng.randint(0, size)
+                orey = rng.randint(0, maxy)
+                orez = rng.randint(0, size)
+                coords = [orex+tilex*size, orey, orez+tiley*size]
+                retval.append((ore, coords, ore.shape(rng)))
+        return retval
 
     @staticmethod
-    def placeoreinregion(ores, oreobjs, world):
-        for ore in ores:
-            oreID = materialNamed(oreobjs[ore].name)
-            for x, y, z in ores[ore]:
-                if world.blockAt(x, y, z) == Ore.stoneID:
-                    world.setBlockAt(x, y, z, oreID)
+    def placeoreinchunk(chunk, cx, cz, bodies):
+        """Place ore bodies in a chunk and turn the End Stone left over into Stone.
+
+        The chunk's blocks are scanned for End Stone once.  Each body
+        writes ore only where End Stone remains, in the order given.
+        Returns the number of ore blocks placed."""
+        sentinel = chunk.Blocks == Ore.stoneID
+        height = chunk.Blocks.shape[2]
+        numblocks = 0
+        for (ore, coords, radii) in bodies:
+            (mcx, mcy, mcz) = coords
+            (x1, y1, z1) = radii
+            lox = max(mcx - x1, cx << 4)
+            hix = min(mcx + x1, (cx + 1) << 4)
+            loz = max(mcz - z1, cz << 4)
+            hiz = min(mcz + z1, (cz + 1) << 4)
+            loy = max(mcy - y1, 0)
+            hiy = min(mcy + y1, height)
+            if lox >= hix or loz >= hiz or loy >= hiy:
+                continue
+            window = (slice(lox & 0xf, ((hix - 1) & 0xf) + 1), slice(loz & 0xf, ((hiz - 1) & 0xf) + 1), slice(loy, hiy))
+            body = Ore.mask(radii)[lox-mcx+x1:hix-mcx+x1, loz-mcz+z1:hiz-mcz+z1, loy-mcy+y1:hiy-mcy+y1] & sentinel[window]
+            chunk.Blocks[window][body] = materialNamed(ore.name)
+            sentinel[window][body] = False
+            numblocks += int(body.sum())
+        chunk.Blocks[sentinel] = Ore.fillID
+        chunk.dirty = True
+        return numblocks
+
+    @staticmethod
+    def placeoreintile(tile):
+        """Place ore if the tile wants it and replace all End Stone with Stone.
+
+        Each chunk of the tile gets one pass covering both."""
+        # strictly speaking, this should be in class Tile somehow
+        # bodies rooted in neighbouring tiles may reach into this one,
+        # and every tile places them in the same order
+        start = time.time()
+        xmin = tile.mcoffsetx
+        zmin = tile.mcoffsetz
+        xmax = xmin + tile.size
+        zmax = zmin + tile.size
+        buckets = {}
+        numbodies = 0
+        if tile.doOre:
+            for tilex, tiley in product(xrange(tile.tilex-1, tile.tilex+2), xrange(tile.tiley-1, tile.tiley+2)):
+                if (tilex < tile.tiles['xmin']) or (tilex >= tile.tiles['xmax']) or \
+                   (tiley < tile.tiles['ymin']) or (tiley >= tile.tiles['ymax']):
+                    continue
+                for (ore, coords, radii) in Ore.bodies(tile.name, tilex, tiley, tile.size):
+                    (mcx, mcy, mcz) = coords
+                    (x1, y1, z1) = radii
+                    lox = max(mcx - x1, xmin)
+                    hix = min(mcx + x1, xmax)
+                    loz = max(mcz - z1, zmin)
+                    hiz = min(mcz + z1, zmax)
+                    if lox >= hix or loz >= hiz:
+                        continue
+                    numbodies += 1
+                    for chunkpos in product(xrange(lox >> 4, ((hix - 1) >> 4) + 1), xrange(loz >> 4, ((hiz - 1) >> 4) + 1)):
+                        buckets.setdefault(chunkpos, []).append((ore, coords, radii))
+
+        numblocks = 0
+        for (cx, cz) in tile.world.allChunks:
+            numblocks += Ore.placeoreinchunk(tile.world.getChunk(cx, cz), cx, cz, buckets.get((cx, cz), []))
+        if tile.doOre:
+            elapsed = time.time() - start
+            tile.log.log_debug(1,"Placed %d ores (%d blocks) in tile %dx%d in %.2f seconds (%d ores/sec)" % \
+                               (numbodies, numblocks, tile.tilex, tile.tiley, elapsed, numbodies / elapsed if elapsed > 0 else 0))
 
 oreObjs = [
     Ore('Dirt', 7, 20, 32),
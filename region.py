@@ -4,31 +4,35 @@ from __future__ import division
 from math import ceil, floor
 import math
 import suds
-import re
 import os
 import urllib2
 import urlparse
-from progressbar import ProgressBar, Percentage, Bar, ETA, FileTransferSpeed
-from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import threading
 import yaml
 import logging
 from time import sleep
 import time
-import tarfile
+import random
 logging.basicConfig(level=logging.INFO)
-from utils import cleanmkdir
+from utils import tileseed
+from download import Downloader
+from cache import Cache
+from buildgraph import BuildGraph
+from scheduler import Scheduler
 from itertools import product
 from terrain import Terrain
 from pymclevel import mclevel
 import utmll
 
 from osgeo import gdal, osr
-from osgeo.gdalconst import GDT_Int16, GA_ReadOnly
+from osgeo.gdalconst import GDT_Int16, GA_ReadOnly, GA_Update
 from bathy import getBathy
 from crust import Crust
 import numpy
 #
 from clidt import CLIDT
+from gridresample import GridIDT
 
 class SmartRedirectHandler(urllib2.HTTPRedirectHandler):
     """Handle temporary redirections by saving status."""
@@ -50,6 +54,12 @@ class Region:
     t_srs = "+proj=utm +datum=WGS84 +zone=%d +units=m"
     #t_srs = "+proj=aea +datum=NAD83 +lat_1=29.5 +lat_2=45.5 +lat_0=23 +lon_0=-96 +x_0=0 +y_0=0 +units=m"
 
+    # extent corners as (x, y) keys
+    corners = [('xmin', 'ymin'), ('xmax', 'ymin'), ('xmin', 'ymax'), ('xmax', 'ymax')]
+
+    # modules whose code shapes the prep tiles
+    prepmodules = ['region', 'crust', 'bathy', 'clidt', 'gridresample', 'invdisttree', 'terrain']
+
     # raster layer order
     rasters = {'landcover': 1, 'elevation': 2, 'bathy': 3, 'crust': 4, 'orthor': 5, 'orthog': 6, 'orthob': 7, 'orthoir': 8}
     
@@ -63,6 +73,13 @@ class Region:
     prepTileSize = 1000
     prepTileSizeOverlap = 1100
 
+    # GDAL block cache and warp buffer sizes in megabytes
+    cachemax = 512
+    warpmemory = 256
+
+    # elevation and orthoimagery nodata value
+    srcnodata = '-340282346638529993179660072199368212480.000'
+
     # tileheight is height of map in Minecraft units TODO XXX CHANGE
     tileheight = mclevel.MCInfdevOldLevel.Height
 
@@ -78,11 +95,20 @@ class Region:
     # FIXME: check N2F value
     exsuf = { 'N3F': '13', 'N2F': '12', 'N1F': '1' }
 
+    # concurrent downloads
+    downloadthreads = Downloader.threads
+
+    # deepest quad-split of a request validation area
+    maxsplits = 6
+
+    # download cache limit in megabytes, None for no limit
+    downloadcachesize = None
+
     # download directory
     downloadtop = os.path.abspath('Downloads')
     regiontop = os.path.abspath('Regions')
 
-    def __init__(self, name, xmax, xmin, ymax, ymin, tilesize=None, scale=None, vscale=None, trim=None, sealevel=None, maxdepth=None, oiIDs=None, lcIDs=None, elIDs=None, doOre=True, doSchematics=False):
+    def __init__(self, name, xmax, xmin, ymax, ymin, tilesize=None, scale=None, vscale=None, trim=None, sealevel=None, maxdepth=None, oiIDs=None, lcIDs=None, elIDs=None, doOre=True, doSchematics=False, cachemax=None, warpmemory=None):
         """Create a region based on lat-longs and other parameters."""
         # NB: smart people check names
         self.name = name
@@ -90,9 +116,9 @@ class Region:
         # Zone computation for UTM
         lat_center = (ymax + ymin) / 2.
         lon_center = (xmax + xmin) / 2.
-        zone_num = utmll.latlon_to_zone_number(lat_center, lon_center)
+        self.zone = utmll.latlon_to_zone_number(lat_center, lon_center)
         self.utm = utmll.latlon_to_zone_identifier(lat_center, lon_center)
-        self.t_srs = self.t_srs % zone_num
+        self.t_srs = self.t_srs % self.zone
 
         # tile must be an even multiple of chunk width
         # chunkWidth not defined in pymclevel but is hardcoded everywhere
@@ -168,42 +194,38 @@ class Region:
         self.doOre = doOre
         self.doSchematics = doSchematics
 
+        # GDAL memory sizes are kept for preparing the region
+        if cachemax != None:
+            self.cachemax = int(cachemax)
+        if warpmemory != None:
+            self.warpmemory = int(warpmemory)
+
         # crazy directory fun
+        # NB: existing contents are kept so that rebuilds are incremental
         self.regiondir = os.path.join(Region.regiontop, self.name)
-        cleanmkdir(self.regiondir)
-
         self.mapsdir = os.path.join(self.regiondir, 'Datasets')
-        cleanmkdir(self.mapsdir)
+        if not os.path.exists(self.mapsdir):
+            os.makedirs(self.mapsdir)
 
-        self.mapname = os.path.join(self.regiondir, 'Map.tif')
+        # digests of the inputs of everything built for this region
+        self.graphname = os.path.join(self.regiondir, 'Build.yaml')
+
+        # the map is a mosaic of the prep tiles
+        self.mapname = os.path.join(self.regiondir, 'Map.vrt')
+        self.storename = os.path.join(self.regiondir, 'Map.npy')
 
         # these are the latlong values
         self.llextents = { 'xmax': max(xmax, xmin), 'xmin': min(xmax, xmin), 'ymax': max(ymax, ymin), 'ymin': min(ymax, ymin) }
 
-        # access the web service
-        # NB: raise hell if it is inaccessible
-        wsdlConv = "http://extract.cr.usgs.gov/XMLWebServices/Coordinate_Conversion_Service.asmx?WSDL"
-        clientConv = suds.client.Client(wsdlConv)
-        # This web service returns suds.sax.text.Text not XML sigh
-        Convre = "<X Coordinate>(.*?)</X Coordinate > <Y Coordinate>(.*?)</Y Coordinate >"
-
-        # convert from WGS84 to Albers
-        ULdict = {'X_Value': self.llextents['xmin'], 'Y_Value': self.llextents['ymin'], 'Current_Coordinate_System': Region.wgs84, 'Target_Coordinate_System': Region.utm}
-        (ULx, ULy) = re.findall(Convre, clientConv.service.getCoordinates(**ULdict))[0]
-        URdict = {'X_Value': self.llextents['xmax'], 'Y_Value': self.llextents['ymin'], 'Current_Coordinate_System': Region.wgs84, 'Target_Coordinate_System': Region.utm}
-        (URx, URy) = re.findall(Convre, clientConv.service.getCoordinates(**URdict))[0]
-        LLdict = {'X_Value': self.llextents['xmin'], 'Y_Value': self.llextents['ymax'], 'Current_Coordinate_System': Region.wgs84, 'Target_Coordinate_System': Region.utm}
-        (LLx, LLy) = re.findall(Convre, clientConv.service.getCoordinates(**LLdict))[0]
-        LRdict = {'X_Value': self.llextents['xmax'], 'Y_Value': self.llextents['ymax'], 'Current_Coordinate_System': Region.wgs84, 'Target_Coordinate_System': Region.utm}
-        (LRx, LRy) = re.findall(Convre, clientConv.service.getCoordinates(**LRdict))[0]
+        # convert the corners from WGS84 to UTM
+        llcorners = numpy.array([[self.llextents[x], self.llextents[y]] for (x, y) in Region.corners])
+        (eastings, northings) = self.fromlatlon(llcorners[:,1], llcorners[:,0])
 
         # select maximum values for landcover extents
-        xfloat = [float(x) for x in [ULx, URx, LLx, LRx]]
-        yfloat = [float(y) for y in [ULy, URy, LLy, LRy]]
-        mxmax = max(xfloat)
-        mxmin = min(xfloat)
-        mymax = max(yfloat)
-        mymin = min(yfloat)
+        mxmax = eastings.max()
+        mxmin = eastings.min()
+        mymax = northings.max()
+        mymin = northings.min()
 
         # calculate tile edges
         realsize = self.scale * self.tilesize
@@ -218,33 +240,13 @@ class Region:
         self.utmextents['landcover'] = { 'xmax': self.utmextents['elevation']['xmax'] + borderwidth, 'xmin': self.utmextents['elevation']['xmin'] - borderwidth, 'ymax': self.utmextents['elevation']['ymax'] + borderwidth, 'ymin': self.utmextents['elevation']['ymin'] - borderwidth }
         self.utmextents['ortho'] = { 'xmax': self.tiles['xmax'] * realsize, 'xmin': self.tiles['xmin'] * realsize, 'ymax': self.tiles['ymax'] * realsize, 'ymin': self.tiles['ymin'] * realsize }
 
-        # now convert back from Albers to WGS84
+        # now convert back from UTM to WGS84
         for maptype in ['ortho', 'landcover', 'elevation']:
-            ULdict = {'X_Value': self.utmextents[maptype]['xmin'], \
-                      'Y_Value': self.utmextents[maptype]['ymin'], \
-                      'Current_Coordinate_System': Region.utm, \
-                      'Target_Coordinate_System': Region.wgs84}
-            (ULx, ULy) = re.findall(Convre, clientConv.service.getCoordinates(**ULdict))[0]
-            URdict = {'X_Value': self.utmextents[maptype]['xmax'], \
-                      'Y_Value': self.utmextents[maptype]['ymin'], \
-                      'Current_Coordinate_System': Region.utm, \
-                      'Target_Coordinate_System': Region.wgs84}
-            (URx, URy) = re.findall(Convre, clientConv.service.getCoordinates(**URdict))[0]
-            LLdict = {'X_Value': self.utmextents[maptype]['xmin'], \
-                      'Y_Value': self.utmextents[maptype]['ymax'], \
-                      'Current_Coordinate_System': Region.utm, \
-                      'Target_Coordinate_System': Region.wgs84}
-            (LLx, LLy) = re.findall(Convre, clientConv.service.getCoordinates(**LLdict))[0]
-            LRdict = {'X_Value': self.utmextents[maptype]['xmax'], \
-                      'Y_Value': self.utmextents[maptype]['ymax'], \
-                      'Current_Coordinate_System': Region.utm, \
-                      'Target_Coordinate_System': Region.wgs84}
-            (LRx, LRy) = re.findall(Convre, clientConv.service.getCoordinates(**LRdict))[0]
+            utmcorners = numpy.array([[self.utmextents[maptype][x], self.utmextents[maptype][y]] for (x, y) in Region.corners])
+            (lats, lons) = self.tolatlon(utmcorners[:,0], utmcorners[:,1])
 
             # select maximum values
-            xfloat = [float(x) for x in [ULx, URx, LLx, LRx]]
-            yfloat = [float(y) for y in [ULy, URy, LLy, LRy]]
-            self.wgs84extents[maptype] = { 'xmax': max(xfloat), 'xmin': min(xfloat), 'ymax': max(yfloat), 'ymin': min(yfloat) }
+            self.wgs84extents[maptype] = { 'xmax': float(lons.max()), 'xmin': float(lons.min()), 'ymax': float(lats.max()), 'ymin': float(lats.min()) }
 
         # check availability of product IDs and identify specific layer IDs
         self.oilayer = self.checkavail(orthoIDs, 'ortho')
@@ -256,6 +258,17 @@ class Region:
         yaml.dump(self, stream)
         stream.close()
 
+    def fromlatlon(self, lats, lons):
+        """Convert WGS84 arrays to UTM in the region zone."""
+        (eastings, northings, dummy, dummy) = utmll.from_latlon(lats, lons, self.zone)
+        # t_srs has no +south so northings are signed rather than offset
+        northings = numpy.where(lats < 0, northings - 10000000, northings)
+        return (eastings, northings)
+
+    def tolatlon(self, eastings, northings):
+        """Convert UTM arrays in the region zone to WGS84."""
+        return utmll.to_latlon(eastings, northings, self.zone, northern=True, strict=False)
+
     def layertype(self, layerID):
         """Return 'elevation' or 'landcover' or 'ortho' depending on layerID."""
         return [key for key in self.productIDs.keys() if layerID in self.productIDs[key]][0]
@@ -335,61 +348,116 @@ class Region:
             raise AttributeError, 'no acceptable compression format found'
         return str(layerID)
 
+    @staticmethod
+    def quadsplit(extents):
+        """Split extents into four equal squares."""
+        xmid = (extents['xmin'] + extents['xmax']) / 2
+        ymid = (extents['ymin'] + extents['ymax']) / 2
+        return [{ 'xmin': xmin, 'xmax': xmax, 'ymin': ymin, 'ymax': ymax } \
+                for (xmin, xmax) in [(extents['xmin'], xmid), (xmid, extents['xmax'])] \
+                for (ymin, ymax) in [(extents['ymin'], ymid), (ymid, extents['ymax'])]]
+
+    def requestaoi(self, clientRequest, layerID, fullLayerID, mapextents):
+        """Request download URLs for one area of interest.
+
+        Returns None if the server says the area is too large."""
+        xmlString = "<REQUEST_SERVICE_INPUT><AOI_GEOMETRY><EXTENT><TOP>%f</TOP>" \
+                    "<BOTTOM>%f</BOTTOM><LEFT>%f</LEFT><RIGHT>%f</RIGHT></EXTENT>" \
+                    "<SPATIALREFERENCE_WKID/></AOI_GEOMETRY><LAYER_INFORMATION>" \
+                    "<LAYER_IDS>%s</LAYER_IDS></LAYER_INFORMATION><CHUNK_SIZE>%d</CHUNK_SIZE>" \
+                    "<JSON></JSON></REQUEST_SERVICE_INPUT>" % \
+                    (mapextents['ymax'], mapextents['ymin'], mapextents['xmin'], \
+                    mapextents['xmax'], fullLayerID, 250) # can be 100, 15, 25, 50, 75, 250
+
+        if layerID in self.seamlessIDs:
+            response = clientRequest.service.processAOI2(xmlString)
+            self.log.log_debug(1,"Requested URLs for seamless layer ID %s (aka %s)..." % \
+                               (layerID, fullLayerID))
+        else:
+            response = clientRequest.service.getTiledDataDirectURLs2(xmlString)
+            self.log.log_debug(1,"Requested URLs for tiled layer ID %s..." % layerID)
+
+        # I am still a bad man.
+        downloadURLs = [x.rsplit("</DOWNLOAD_URL>")[0] for x in response.split("<DOWNLOAD_URL>")[1:]]
+        if len(downloadURLs) <= 0:
+            if "<ERROR>" in response and "area of interest" in response:
+                return None
+            else: 
+                raise IOError, "No downloadURLs, and unknown error! Response was:\n%s" % response
+        return downloadURLs
+
     def requestvalidation(self, layerIDs):
-        """Generates download URLs from layer IDs."""
+        """Generates download URLs from layer IDs.
+
+        Areas the server finds too large are split into quarters, and only
+        those are requested again.  Requests run concurrently.  Their
+        responses are remembered on disk by layer and extent, as are the
+        full layer IDs of seamless products."""
         retval = {}
 
         # request validation
         wsdlRequest = "http://extract.cr.usgs.gov/requestValidationService/wsdl/RequestValidationService.wsdl"
-        clientRequest = suds.client.Client(wsdlRequest)
-
-        # we now iterate through layerIDs
+        # suds clients are not thread-safe so each thread gets its own
+        local = threading.local()
+
+        memoname = os.path.join(Region.downloadtop, 'validation.yaml')
+        if os.path.exists(memoname):
+            memofile = file(memoname)
+            memo = yaml.load(memofile)
+            memofile.close()
+        else:
+            memo = {}
+
+        def request(job):
+            (layerID, fullLayerID, mapextents) = job
+            key = '%s %f %f %f %f' % (fullLayerID, mapextents['xmin'], mapextents['xmax'], mapextents['ymin'], mapextents['ymax'])
+            if key not in memo:
+                if not hasattr(local, 'client'):
+                    local.client = suds.client.Client(wsdlRequest)
+                memo[key] = self.requestaoi(local.client, layerID, fullLayerID, mapextents)
+            return memo[key]
+
+        jobs = []
         for layerID in layerIDs:
-            retry = True
-            divisions = 1
             layertype = self.layertype(layerID)
-            fullLayerID = self.pid2FullPid(layerID) if layerID in self.seamlessIDs else layerID
-            downloadURLs = []
-
-            while retry:
-                for (xi, yi) in product(xrange(divisions),xrange(divisions)):
-                    baseextents = self.wgs84extents[layertype]
-                    mapextents = {}
-                    mapextents['xmin'] = baseextents['xmin'] + float(xi) * (baseextents['xmax']-baseextents['xmin']) / divisions
-                    mapextents['xmax'] = baseextents['xmin'] + float(1 + xi) * (baseextents['xmax']-baseextents['xmin']) / divisions
-                    mapextents['ymin'] = baseextents['ymin'] + float(yi) * (baseextents['ymax']-baseextents['ymin']) / divisions
-                    mapextents['ymax'] = baseextents['ymin'] + float(1 + yi) * (baseextents['ymax']-baseextents['ymin']) / divisions
-                    xmlString = "<REQUEST_SERVICE_INPUT><AOI_GEOMETRY><EXTENT><TOP>%f</TOP>" \
-                                "<BOTTOM>%f</BOTTOM><LEFT>%f</LEFT><RIGHT>%f</RIGHT></EXTENT>" \
-                                "<SPATIALREFERENCE_WKID/></AOI_GEOMETRY><LAYER_INFORMATION>" \
-                                "<LAYER_IDS>%s</LAYER_IDS></LAYER_INFORMATION><CHUNK_SIZE>%d</CHUNK_SIZE>" \
-                                "<JSON></JSON></REQUEST_SERVICE_INPUT>" % \
-                                (mapextents['ymax'], mapextents['ymin'], mapextents['xmin'], \
-                                mapextents['xmax'], fullLayerID, 250) # can be 100, 15, 25, 50, 75, 250
-        
-                    if layerID in self.seamlessIDs:
-                        response = clientRequest.service.processAOI2(xmlString)
-                        self.log.log_debug(1,"Requested URLs for seamless layer ID %s (aka %s)..." % \
-                                           (layerID, fullLayerID))
+            fullLayerID = layerID
+            if layerID in self.seamlessIDs:
+                # the full product ID is remembered too
+                key = 'product %s' % layerID
+                if key not in memo:
+                    memo[key] = self.pid2FullPid(layerID)
+                fullLayerID = memo[key]
+            jobs.append((layerID, fullLayerID, self.wgs84extents[layertype]))
+            retval[layerID] = []
+
+        pool = ThreadPool(self.downloadthreads)
+        try:
+            for depth in xrange(Region.maxsplits + 1):
+                if jobs == []:
+                    break
+                responses = pool.map(request, jobs, chunksize=1)
+                splits = []
+                for ((layerID, fullLayerID, mapextents), downloadURLs) in zip(jobs, responses):
+                    if downloadURLs == None:
+                        splits += [(layerID, fullLayerID, quarter) for quarter in Region.quadsplit(mapextents)]
                     else:
-                        response = clientRequest.service.getTiledDataDirectURLs2(xmlString)
-                        self.log.log_debug(1,"Requested URLs for tiled layer ID %s..." % layerID)
-        
-                    # I am still a bad man.
-                    downloadURLs += [x.rsplit("</DOWNLOAD_URL>")[0] for x in response.split("<DOWNLOAD_URL>")[1:]]
-                    if len(downloadURLs) <= 0:
-                        if "<ERROR>" in response and "area of interest" in response:
-                            # AOI was too large. Try again.
-                            divisions += 1
-                            self.log.log_warn("USGS server indicated AOI was too large. " \
-                                              "Trying again with %d pieces" % (divisions**2))
-                            break
-                        else: 
-                            self.log.log_fatal("No downloadURLs, and unknown error! Response was:\n%s" % response)
-                    retry = False
-
-            retval[layerID] = downloadURLs
-
+                        # neighbouring squares can share tiles
+                        retval[layerID] += [downloadURL for downloadURL in downloadURLs if downloadURL not in retval[layerID]]
+                if splits != []:
+                    self.log.log_warn("USGS server indicated AOI was too large. " \
+                                      "Trying again with %d pieces" % len(splits))
+                jobs = splits
+        finally:
+            pool.close()
+            pool.join()
+            memotemp = '%s.tmp' % memoname
+            memofile = file(memotemp, 'w')
+            yaml.dump(memo, memofile)
+            memofile.close()
+            os.rename(memotemp, memoname)
+
+        if jobs != []:
+            self.log.log_fatal("AOI still too large after %d splits!" % Region.maxsplits)
         return retval
 
     @staticmethod
@@ -408,105 +476,89 @@ class Region:
             justfile = os.path.split(longfile)[1]
         return justfile
 
-    def retrievefile(self, layerID, downloadURL):
-        """Retrieve the datafile associated with the URL.  This may require downloading it from the USGS servers or extracting it from a local archive."""
+    def initiatedownload(self, layerID, downloadURL):
+        """Queue a seamless download and return its request ID."""
+        self.log.log_debug(1,"  Requesting download for %s." % layerID)
+        try:
+            page = urllib2.urlopen(downloadURL.replace(' ','%20'))
+        except IOError, e:
+            if hasattr(e, 'reason'):
+                raise IOError, e.reason
+            elif hasattr(e, 'code'):
+                raise IOError, e.code
+            else:
+                raise IOError
+        result = page.read()
+        page.close()
+        # parse response for request id
+        if result.find("VALID>false") > -1:
+            raise IOError, "download request for %s was not valid" % layerID
+        startPos = result.find("<ns:return>") + 11
+        endPos = result.find("</ns:return>")
+        requestID = result[startPos:endPos]
+        # give the server a moment before asking for status
+        sleep(5)
+        return requestID
+
+    def retrievefile(self, layerID, downloadURL, cache):
+        """Retrieve the datafile associated with the URL.  This may require downloading it from the USGS servers or extracting it from a local archive.
+
+        Returns the datafile and the number of bytes downloaded."""
         self.log.log_info("Attempting to retrieve %s..." % downloadURL)
         fname = Region.getfn(downloadURL)
         layerdir = os.path.join(Region.downloadtop, layerID)
-        if not os.path.exists(layerdir):
-            os.makedirs(layerdir)
         downloadfile = os.path.join(layerdir, fname)
+        key = '%s/%s' % (layerID, fname)
+
+        # FIXME: this is grotesque
+        extracthead = fname.split('.')[0]
+        layertype = self.layertype(layerID)
+        if layertype == 'elevation':
+            extractfiles = [os.path.join(extracthead, '.'.join(['float%s_%s' % (extracthead, Region.exsuf[layerID]), suffix])) for suffix in 'flt', 'hdr', 'prj']
+        elif layertype == 'ortho':
+            extractfiles = ['.'.join([extracthead, suffix]) for suffix in ['tif']]
+        else: # if layertype == 'landcover':
+            extractfiles = ['.'.join([extracthead, suffix]) for suffix in 'tif', 'tfw']
+        datafile = os.path.join(layerdir, extractfiles[0])
+
+        # nothing to do if another region already fetched and extracted this
+        archive = cache.lookup(key)
+        if archive != None and cache.extracted(key):
+            self.log.log_debug(1,"Using cached files for layerID %s" % layerID)
+            return (datafile, 0)
+
+        numBytes = 0
+        if archive != None:
+            self.log.log_debug(1,"Using cached archive for layerID %s" % layerID)
 
         # Apparently Range checks don't always work across Redirects
         # So find the final URL before starting the download
-        if not(layerID in self.seamlessIDs):
-            opener = urllib2.build_opener(SmartRedirectHandler())
-            dURL = downloadURL
-            while True:
-                req = urllib2.Request(dURL)
-                webPage = opener.open(req)
-                if hasattr(webPage, 'status') and webPage.status == 302:
-                    dURL = webPage.url
-                else:
-                    break
-            maxSize = int(webPage.headers['Content-Length'])
-            webPage.close()
-
-            if os.path.exists(downloadfile):
-                outputFile = open(downloadfile, 'ab')
-                existSize = os.path.getsize(downloadfile)
-                req.headers['Range'] = 'bytes=%s-%s' % (existSize, maxSize)
-            else:
-                outputFile = open(downloadfile, 'wb')
-                existSize = 0
-            webPage = opener.open(req)
-            if maxSize == existSize:
+        elif not(layerID in self.seamlessIDs):
+            (dURL, maxSize) = Downloader.resolve(downloadURL)
+            if maxSize != None and os.path.exists(downloadfile) and os.path.getsize(downloadfile) == maxSize:
                 self.log.log_debug(1,"Using cached file for layerID %s" % layerID)
             else:
                 self.log.log_debug(1,"Downloading file from server for layerID %s" % layerID)
-                pbar = ProgressBar(widgets=[Percentage(), ' ', Bar(), ' ', ETA(), ' ', FileTransferSpeed()], maxval=maxSize).start()
-                # This chunk size may be small!
-                max_chunk_size = 8192
-                # NB: USGS web servers do not handle resuming downloads correctly
-                # so we have to drop incoming data on the floor
-                if 'Content-Range' in webPage.headers:
-                    # Resuming downloads are now working
-                    # We can start from where we left off
-                    numBytes = existSize
-                else:
-                    numBytes = 0
-                # if numBytes is less than existSize, do not save what we download
-                while numBytes < existSize:
-                    pbar.update(numBytes)
-                    left = existSize - numBytes
-                    chunk_size = left if left < max_chunk_size else max_chunk_size
-                    data = webPage.read(chunk_size)
-                    numBytes = numBytes + len(data)
-                # if numBytes is less than maxSize, save what we download
-                while numBytes < maxSize:
-                    pbar.update(numBytes)
-                    data = webPage.read(max_chunk_size)
-                    if not data:
-                        break
-                    outputFile.write(data)
-                    numBytes = numBytes + len(data)
-                pbar.finish()
-                webPage.close()
-                outputFile.close()
+            numBytes = Downloader.fetch(dURL, downloadfile, maxSize)
 
-        # This code is for Seamless layers. XXX TODO: Doesn't handle partially-fetched files
+        # This code is for Seamless layers.
+        # The request ID is kept beside a partial file so the download can resume.
         else:
-            if os.path.exists(downloadfile):
-                existSize = os.path.getsize(downloadfile)
+            statefile = '%s.request' % downloadfile
+            numBytes = 0
+            if os.path.exists(downloadfile) and not os.path.exists(statefile):
+                self.log.log_debug(1,"Using cached file for layerID %s" % layerID)
             else:
-                self.log.log_debug(1,"  Requesting download for %s." % layerID)
-                # initiateDownload and get the response code
-                # put _this_ in its own function!
-                try:
-                    page = urllib2.urlopen(downloadURL.replace(' ','%20'))
-                except IOError, e:
-                    if hasattr(e, 'reason'):
-                        raise IOError, e.reason
-                    elif hasattr(e, 'code'):
-                        raise IOError, e.code
-                    else:
-                        raise IOError
+                if os.path.exists(statefile):
+                    requestID = open(statefile).read().strip()
+                    self.log.log_debug(1,"  Resuming download for %s." % layerID)
                 else:
-                    result = page.read()
-                    page.close()
-                    # parse response for request id
-                    if result.find("VALID>false") > -1:
-                        # problem with initiateDownload request string
-                        # handle that here
-                        pass
-                    else:
-                        # downloadRequest successfully entered into queue
-                        startPos = result.find("<ns:return>") + 11
-                        endPos = result.find("</ns:return>")
-                        requestID = result[startPos:endPos]
+                    requestID = self.initiatedownload(layerID, downloadURL)
+                    stateFile = open(statefile, 'w')
+                    stateFile.write(requestID)
+                    stateFile.close()
                 self.log.log_debug(2,"  request ID is %s" % requestID)
     
-                sleep(5)
                 while True:
                     dsPage = urllib2.urlopen("http://extract.cr.usgs.gov/axis2/services/DownloadService/getDownloadStatus?downloadID=%s" % requestID)
                     result = dsPage.read()
@@ -527,7 +579,7 @@ class Region:
                     opener = urllib2.build_opener(SmartRedirectHandler())
                     obj = opener.open(page3)
                     location = obj.headers['Location'] 
-                    #filename = location.split('/')[-1].split('#')[0].split('?')[0]        
+                    obj.close()
                 except IOError, e:
                     if hasattr(e, 'reason'):
                         raise IOError, e.reason
@@ -537,14 +589,7 @@ class Region:
                         raise IOError
                 else:
                     self.log.log_debug(1,"  downloading %s now!" % downloadfile)
-                    downloadFile = open(downloadfile, 'wb')
-                    while True:
-                        data = obj.read(8192)
-                        if data == "":
-                            break
-                        downloadFile.write(data)
-                    downloadFile.close()
-                    obj.close()
+                    numBytes = Downloader.fetch(location, downloadfile)
     
                 # UGH
                 setStatusURL = "http://extract.cr.usgs.gov/axis2/services/DownloadService/setDownloadComplete?downloadID=%s" % requestID
@@ -558,116 +603,194 @@ class Region:
                     else:
                         raise IOError
                 else:
-                    result = page4.read()
                     page4.close()
-                    # remove carriage returns
-                    result = result.replace("&#xd;\n"," ")
-                    # parse out status code and status text
-                    startPos = result.find("<ns:return>") + 11
-                    endPos = result.find("</ns:return>")
-                    status = result[startPos:endPos]
+                os.remove(statefile)
 
-        # FIXME: this is grotesque
-        extracthead = fname.split('.')[0]
-        layertype = self.layertype(layerID)
-        if layertype == 'elevation':
-            extractfiles = [os.path.join(extracthead, '.'.join(['float%s_%s' % (extracthead, Region.exsuf[layerID]), suffix])) for suffix in 'flt', 'hdr', 'prj']
-        elif layertype == 'ortho':
-            extractfiles = ['.'.join([extracthead, suffix]) for suffix in ['tif']]
-        else: # if layertype == 'landcover':
-            extractfiles = ['.'.join([extracthead, suffix]) for suffix in 'tif', 'tfw']
-        for extractfile in extractfiles:
-            if os.path.exists(os.path.join(layerdir, extractfile)):
-                self.log.log_debug(1,"Using existing file %s for layerID %s" % (extractfile, layerID))
+        # store the finished download by content
+        if archive == None:
+            archive = cache.add(key, downloadURL, downloadfile)
+
+        extractpaths = [os.path.join(layerdir, extractfile) for extractfile in extractfiles]
+        missing = [extractpath for extractpath in extractpaths if not os.path.exists(extractpath)]
+        if missing == []:
+            self.log.log_debug(1,"Using existing files %s for layerID %s" % (', '.join(extractfiles), layerID))
+        else:
+            if fname[-3:] == 'zip':
+                # members keep their paths within the archive
+                destination = lambda name: os.path.join(layerdir, name) if os.path.join(layerdir, name) in missing else None
+            elif fname[-3:] == 'tgz' or fname[-7:] == 'tar.gz':
+                # the only wanted member is the image, whatever its path
+                destination = lambda name: datafile if name[-3:] == 'tif' and datafile in missing else None
             else:
-                if downloadfile[-3:] == 'zip':
-                    os.system('unzip "%s" "%s" -d "%s"' % (downloadfile, extractfile, layerdir))
-                elif downloadfile[-3:] == 'tgz' or downloadfile[-5:] == 'tar.gz':
-                    tf = tarfile.open(downloadfile,'r')
-                    for fn in tf.getnames():
-                        if fn[-3:] == 'tif':
-                            tf.close()
-                            os.system('tar --strip-components 1 -xzvf "%s" "%s" -C "%s"' % (downloadfile, fn, layerdir))
-                            os.system('mv %s %s/%s.tif' % (fn.split('/')[-1], layerdir, fname.split('.')[0]))
-                            break
-                else:
-                    raise IOError
-        return os.path.join(layerdir, extractfiles[0])
+                raise IOError, "unknown archive type for %s" % fname
+            written = Downloader.extract(archive, destination)
+            if len(written) != len(missing):
+                raise IOError, "%s is missing %s" % (fname, ', '.join([path for path in missing if path not in written]))
+        cache.setmembers(key, extractpaths)
+        return (datafile, numBytes)
 
     def getfiles(self):
         """Get files from USGS and extract them if necessary."""
         layerIDs = [self.oilayer, self.lclayer, self.ellayer]
         downloadURLs = self.requestvalidation(layerIDs)
-        for layerID in downloadURLs.keys():
-            self.log.log_info("Downloading files for layer %s..." % layerID)
-            extractlist = []
-            for downloadURL in downloadURLs[layerID]:
-                extractfile = self.retrievefile(layerID, downloadURL)
-                extractlist.append(extractfile)
+        cache = Cache(Region.downloadtop)
+        graph = BuildGraph(self.graphname)
+        jobs = [(layerID, (layerID, downloadURL, cache)) for layerID in layerIDs for downloadURL in downloadURLs[layerID]]
+        # the download threads share the layer directories, so make them first
+        for layerID in layerIDs:
+            layerdir = os.path.join(Region.downloadtop, layerID)
+            if not os.path.exists(layerdir):
+                os.makedirs(layerdir)
+        self.log.log_info("Downloading %d files for layers %s..." % (len(jobs), ', '.join(layerIDs)))
+        retrieved = Downloader(self.downloadthreads)(self.retrievefile, jobs)
+        for layerID in layerIDs:
+            if layerID in retrieved:
+                (extractlist, numBytes, seconds) = retrieved[layerID]
+            else:
+                (extractlist, numBytes, seconds) = ([], 0, 0)
             if len(extractlist) <= 0:
                 self.log.log_error("Zero files found for layer %s!\n" % layerID)
+            rate = numBytes / seconds / 1024 if seconds > 0 else 0
+            self.log.log_info("Retrieved %d files for layer %s: %d bytes in %.1f seconds (%.1f KB/s)" % \
+                              (len(extractlist), layerID, numBytes, seconds, rate))
+            # skip layers whose files and projection have not changed
+            tiffile = os.path.join(self.mapsdir, '%s.tif' % layerID)
+            layerdigest = BuildGraph.digest(sorted([BuildGraph.filestat(extractfile) for extractfile in extractlist]), self.t_srs)
+            if graph.current('layer/%s' % layerID, layerdigest) and os.path.exists(tiffile):
+                self.log.log_info("Layer %s is up to date." % layerID)
+                continue
             # Build VRTs
             self.log.log_info("Building VRT file for layer %s (this may take some time)..." % layerID)
             vrtfile = os.path.join(self.mapsdir, '%s.vrt' % layerID)
-            buildvrtcmd = 'gdalbuildvrt "%s" %s' % (vrtfile, ' '.join(['"%s"' % os.path.abspath(extractfile) for extractfile in extractlist]))
-            os.system('%s' % buildvrtcmd)
+            self.buildvrt(vrtfile, [os.path.abspath(extractfile) for extractfile in extractlist])
             # Generate warped GeoTIFFs
-            tiffile = os.path.join(self.mapsdir, '%s.tif' % layerID)
-            warpcmd = 'gdalwarp -q -multi -t_srs "%s" "%s" "%s"' % (Region.t_srs, vrtfile, tiffile)
-            os.system('%s' % warpcmd)
-
-    def buildmap(self, wantCL=True, single=False):
-        """Use downloaded files and other parameters to build multi-raster map."""
+            self.warp(vrtfile, tiffile)
+            graph.record('layer/%s' % layerID, layerdigest)
+            graph.save()
+
+        # the warped layers no longer need the cached files
+        if self.downloadcachesize != None:
+            removed = cache.evict(self.downloadcachesize * 1024 * 1024)
+            self.log.log_info("Evicted %d entries from the download cache." % removed)
+        cache.flush()
+
+    def gdalconfig(self):
+        """Apply the GDAL cache size for this run."""
+        gdal.SetCacheMax(int(self.cachemax) * 1024 * 1024)
+
+    def buildvrt(self, vrtfile, srcfiles):
+        """Build a VRT in-process, raising IOError on failure."""
+        self.gdalconfig()
+        try:
+            os.remove(vrtfile)
+        except OSError:
+            pass
+        vrtds = gdal.BuildVRT(vrtfile, srcfiles)
+        if vrtds is None:
+            raise IOError, "unable to build %s: %s" % (vrtfile, gdal.GetLastErrorMsg())
+        vrtds = None
+
+    def warp(self, srcfile, dstfile, extents=None, resample=None, format=None):
+        """Warp a dataset into the region projection in-process, raising IOError on failure.
+
+        If extents is given, the output is clipped to it at the region scale.
+        A format of 'VRT' writes a warped VRT which is only warped when read."""
+        self.gdalconfig()
+        options = { 'dstSRS': self.t_srs, 'multithread': True, \
+                    'warpMemoryLimit': int(self.warpmemory) * 1024 * 1024, \
+                    'warpOptions': ['NUM_THREADS=ALL_CPUS'] }
+        if extents is not None:
+            options.update({ 'xRes': self.scale, 'yRes': self.scale, \
+                             'outputBounds': (extents['xmin'], extents['ymin'], extents['xmax'], extents['ymax']), \
+                             'srcNodata': Region.srcnodata, 'dstNodata': 0 })
+        if resample is not None:
+            options['resampleAlg'] = resample
+        if format is not None:
+            options['format'] = format
+        try:
+            os.remove(dstfile)
+        except OSError:
+            pass
+        dstds = gdal.Warp(dstfile, srcfile, options=gdal.WarpOptions(**options))
+        if dstds is None:
+            raise IOError, "unable to warp %s: %s" % (srcfile, gdal.GetLastErrorMsg())
+        dstds = None
+
+    def minmax(self, srcfile, extents):
+        """Minimum and maximum valid values of a dataset within extents."""
+        srcds = gdal.Open(srcfile, GA_ReadOnly)
+        srcgeotrans = srcds.GetGeoTransform()
+        srcband = srcds.GetRasterBand(1)
+        nodata = srcband.GetNoDataValue()
+        xoff = max(0, int(floor((extents['xmin'] - srcgeotrans[0]) / srcgeotrans[1])))
+        xend = min(srcds.RasterXSize, int(ceil((extents['xmax'] - srcgeotrans[0]) / srcgeotrans[1])))
+        yoff = max(0, int(floor((extents['ymax'] - srcgeotrans[3]) / srcgeotrans[5])))
+        yend = min(srcds.RasterYSize, int(ceil((extents['ymin'] - srcgeotrans[3]) / srcgeotrans[5])))
+        (srcmin, srcmax) = (None, None)
+        # read a strip at a time to bound memory
+        for stripy in xrange(yoff, yend, Region.prepTileSize):
+            strip = srcband.ReadAsArray(xoff, stripy, xend - xoff, min(Region.prepTileSize, yend - stripy))
+            valid = strip > float(Region.srcnodata)
+            if nodata is not None:
+                valid &= (strip != nodata)
+            if not valid.any():
+                continue
+            (stripmin, stripmax) = (strip[valid].min(), strip[valid].max())
+            srcmin = stripmin if srcmin is None else min(srcmin, stripmin)
+            srcmax = stripmax if srcmax is None else max(srcmax, stripmax)
+        srcband = None
+        srcds = None
+        if srcmin is None:
+            raise IOError, "no valid data in %s" % srcfile
+        return (srcmin, srcmax)
+
+    def buildmap(self, wantCL=True, single=False, stream=False, dryrun=False):
+        """Use downloaded files and other parameters to build multi-raster map.
+
+        If stream is True, elevation and orthoimagery are warped into
+        virtual datasets and each prep tile warps only its own window.
+        Only prep tiles whose inputs changed are rebuilt.  If dryrun is
+        True, nothing is built and what would be rebuilt is reported."""
+        graph = BuildGraph(self.graphname)
 
         # warp elevation data into new format
         # NB: can't do this to landcover until mode algorithm is supported
-        self.log.log_info("First-pass warp and store over elevation data...")
+        if stream:
+            (suffix, format, action) = ('warp.vrt', 'VRT', 'Virtual warp')
+        else:
+            (suffix, format, action) = ('new.tif', None, 'First-pass warp and store')
         eltif = os.path.join(self.mapsdir, '%s.tif' % (self.ellayer)) 
-        elfile = os.path.join(self.mapsdir, '%s-new.tif' % (self.ellayer))
+        elfile = os.path.join(self.mapsdir, '%s-%s' % (self.ellayer, suffix))
         elextents = self.utmextents['elevation']
-        warpcmd = 'gdalwarp -q -multi -t_srs "%s" -tr %d %d -te %d %d %d %d' \
-                  ' -r cubic "%s" "%s" -srcnodata "-340282346638529993179660072199368212480.000" ' \
-                  '-dstnodata 0' % (Region.t_srs, self.scale, self.scale, \
-                  elextents['xmin'], elextents['ymin'], elextents['xmax'], \
-                  elextents['ymax'], eltif, elfile)
-
-        try:
-            os.remove(elfile)
-        except OSError:
-            pass
-        # NB: make this work on Windows too!
-        os.system('%s' % warpcmd)
-        self.log.log_info("Completed first-pass warp over elevation data.")
-
-        # Warp ortho data into new format
-        self.log.log_info("First-pass warp and store over orthoimagery data...")
         oitif = os.path.join(self.mapsdir, '%s.tif' % (self.oilayer)) 
-        oifile = os.path.join(self.mapsdir, '%s-new.tif' % (self.oilayer))
+        oifile = os.path.join(self.mapsdir, '%s-%s' % (self.oilayer, suffix))
         oiextents = self.utmextents['ortho']
-        warpcmd = 'gdalwarp -q -multi -t_srs "%s" -tr %d %d -te %d %d %d %d' \
-                  ' -r cubic "%s" "%s" -srcnodata "-340282346638529993179660072199368212480.000" ' \
-                  '-dstnodata 0' % (Region.t_srs, self.scale, self.scale, \
-                  oiextents['xmin'], oiextents['ymin'], oiextents['xmax'], \
-                  oiextents['ymax'], oitif, oifile)
-  
-        try:
-            os.remove(oifile)
-        except OSError:
-            pass
-        # NB: make this work on Windows too!
-        os.system('%s' % warpcmd)
-        self.log.log_info("Completed first-pass warp over orthoimagery data.")
+        for (maptype, srcfile, dstfile, extents) in [('elevation', eltif, elfile, elextents), ('orthoimagery', oitif, oifile, oiextents)]:
+            warpdigest = BuildGraph.digest(BuildGraph.filestat(srcfile), extents, self.scale, self.t_srs, stream)
+            if graph.current('warp/%s' % maptype, warpdigest) and os.path.exists(dstfile):
+                self.log.log_info("Warped %s data is up to date." % maptype)
+            elif dryrun:
+                self.log.log_info("Would rebuild: %s over %s data and every prep tile." % (action, maptype))
+                return
+            else:
+                self.log.log_info("%s over %s data..." % (action, maptype))
+                self.warp(srcfile, dstfile, extents, 'cubic', format)
+                graph.record('warp/%s' % maptype, warpdigest)
+                graph.save()
+                self.log.log_info("Completed %s over %s data." % (action.lower(), maptype))
     
         # First compute global elevation data
         elds = gdal.Open(elfile, GA_ReadOnly)
         elgeoxform = elds.GetGeoTransform()
-        elband = elds.GetRasterBand(1)
-        (elmin, elmax) = elband.ComputeRasterMinMax(False)
+        if stream:
+            # computing this over the virtual warp would warp everything
+            (elmin, elmax) = self.minmax(eltif, elextents)
+        else:
+            (elmin, elmax) = elds.GetRasterBand(1).ComputeRasterMinMax(False)
         elmin = int(elmin)
         elmax = int(elmax)
         elxsize = elds.RasterXSize
         elysize = elds.RasterYSize
-        elband = None
         elds = None
 
         # sealevel depends upon elmin
@@ -732,39 +855,83 @@ class Region:
         elysizetile = elysize if (elysize % Region.prepTileSize) > overlap else \
                       elysize - overlap
         self.log.log_info("Processing %d x %d data array as tiles." % (elxsize, elysize))
-        tiles = [(self.log, self.name, tilex, tiley, elxsize, elysize, lcarr, tifgeotrans, elgeoxform, wantCL) \
+        tiles = [(self.log, self.name, tilex, tiley, elxsize, elysize, lcarr, tifgeotrans, elgeoxform, elfile, oifile, wantCL, \
+                  graph.recorded('prep/%dx%d/' % (tilex, tiley)), dryrun) \
                  for (tilex, tiley) in \
                  product(xrange(int(ceil(float(elxsizetile)/Region.prepTileSize))), \
                          xrange(int(ceil(float(elysizetile)/Region.prepTileSize))))]
 
-        if single:
-            tiftiles = [buildmaptile(tile) for tile in tiles]
-        else:
-            # multi-process ... let's see...
-            pool = Pool()
-            rs = pool.map_async(buildmaptile, tiles)
-            pool.close()
-            while not(rs.ready()):
-                remaining = rs._number_left
-                self.log.log_info("Waiting for " + str(remaining) + " tasks to complete...")
-                time.sleep(10)
-            pool.join()        # Just as a precaution.
-            tiftiles = rs.get()
-
-        # Now join everything together!
-        self.log.log_info("Joining %d files into final TIF image..." % len(tiftiles))
-        mergecmd = 'gdal_merge.py -o "%s" "%s"' % (self.mapname, '" "'.join(tiftiles))
-  
-        try:
-            os.remove(self.mapname)
-        except OSError:
-            pass
-        # NB: make this work on Windows too!
-        os.system('%s' % mergecmd)
+        # edge tiles are smaller, so start the full-size ones first
+        start = time.time()
+        costs = [min(Region.prepTileSizeOverlap, elxsize - tile[2] * Region.prepTileSize) * \
+                 min(Region.prepTileSizeOverlap, elysize - tile[3] * Region.prepTileSize) for tile in tiles]
+        scheduler = Scheduler(self.log, single, initializer=initworker, initargs=(self.name, self.cachemax, self.warpmemory))
+        results = scheduler(buildmaptile, tiles, costs, 'prep tiles', lambda tile: 'Prep tile %dx%d' % (tile[2], tile[3]))
 
-        self.log.log_info("Merge complete! Removing tiles...")
-        [os.remove(tilename) for tilename in tiftiles]
-        self.log.log_info("Cleanup complete.")
+        tiftiles = []
+        rebuilt = 0
+        for (tilex, tiley, tilename, digests, stale) in results:
+            tiftiles.append(tilename)
+            if stale != []:
+                rebuilt += 1
+                if dryrun:
+                    self.log.log_info("Would rebuild: prep tile %dx%d (%s)" % (tilex, tiley, ', '.join(stale)))
+            if not dryrun:
+                for group in digests:
+                    graph.record('prep/%dx%d/%s' % (tilex, tiley, group), digests[group])
+        if dryrun:
+            self.log.log_info("Would rebuild %d of %d prep tiles." % (rebuilt, len(tiles)))
+            return
+        graph.save()
+        self.log.log_info("Rebuilt %d of %d prep tiles." % (rebuilt, len(tiles)))
+
+        # any existing store is now out of date
+        if rebuilt > 0:
+            try:
+                os.remove(self.storename)
+            except OSError:
+                pass
+
+        # tiles hold only their core windows so they can be mosaicked as-is
+        self.log.log_info("Building mosaic of %d tiles..." % len(tiftiles))
+        self.buildvrt(self.mapname, tiftiles)
+
+        tilebytes = sum([os.path.getsize(tilename) for tilename in tiftiles])
+        self.log.log_info("Mosaic complete: %d bytes in %d tiles written in %.1f seconds." % \
+                          (tilebytes, len(tiftiles), time.time() - start))
+
+    def buildstore(self):
+        """Copy the map into a tile-aligned memory-mapped store.
+
+        The store is a (tiley, tilex, row, column, band) array so all
+        eight bands of a tile are one contiguous block which tiles can
+        map without going through GDAL."""
+        self.log.log_info("Storing map as tile-aligned blocks...")
+        mapds = gdal.Open(self.mapname, GA_ReadOnly)
+        size = self.tilesize
+        numtilesx = self.tiles['xmax'] - self.tiles['xmin']
+        numtilesy = self.tiles['ymax'] - self.tiles['ymin']
+        storetemp = '%s.tmp' % self.storename
+        store = numpy.lib.format.open_memmap(storetemp, mode='w+', dtype=numpy.int16, \
+                                             shape=(numtilesy, numtilesx, size, size, len(Region.rasters)))
+        # read one row of tiles at a time, all bands at once
+        mapxsize = min(numtilesx * size, mapds.RasterXSize)
+        for tiley in xrange(numtilesy):
+            rows = min(size, mapds.RasterYSize - tiley * size)
+            if rows <= 0:
+                break
+            strip = mapds.ReadAsArray(0, tiley * size, mapxsize, rows)
+            for tilex in xrange(numtilesx):
+                cols = min(size, mapxsize - tilex * size)
+                if cols <= 0:
+                    break
+                store[tiley, tilex, :rows, :cols] = strip[:, :, tilex*size:tilex*size+cols].transpose(1, 2, 0)
+            strip = None
+        store.flush()
+        store = None
+        mapds = None
+        os.rename(storetemp, self.storename)
+        self.log.log_info("Store complete.")
 
     # Thanks to http://williams.best.vwh.net/avform.htm#LL
     # Takes a base (lat1, lon1) point and offsets by dist meters in the angle direction
@@ -784,13 +951,25 @@ class Region:
         return (math.degrees(lat), math.degrees(lon))
 
 # Global scope
-def buildmaptile(args):
-    (log, name, tilex, tiley, elxsize, elysize, lcarr, tifgeotrans, elgeoxform, wantCL) = args
-    (xminarr, xmaxarr, yminarr, ymaxarr) = lcarr
+# the region whose prep tiles this worker builds
+workerregion = None
+
+def initworker(name, cachemax, warpmemory):
+    """Load the region once per worker rather than once per prep tile.
 
+    The GDAL memory sizes given to this run replace those stored with
+    the region."""
+    global workerregion
     yamlfile = file(os.path.join('Regions', name, 'Region.yaml'))
-    self = yaml.load(yamlfile)
+    workerregion = yaml.load(yamlfile)
     yamlfile.close()
+    workerregion.cachemax = cachemax
+    workerregion.warpmemory = warpmemory
+
+def buildmaptile(args):
+    (log, name, tilex, tiley, elxsize, elysize, lcarr, tifgeotrans, elgeoxform, elfile, oifile, wantCL, recorded, dryrun) = args
+    (xminarr, xmaxarr, yminarr, ymaxarr) = lcarr
+    self = workerregion
 
     offsetx = tilex * Region.prepTileSize
     offsety = tiley * Region.prepTileSize
@@ -798,44 +977,19 @@ def buildmaptile(args):
     sizey   = min(Region.prepTileSizeOverlap, elysize - offsety)
 
     srs = osr.SpatialReference()
-    srs.ImportFromProj4(Region.t_srs)
+    srs.ImportFromProj4(self.t_srs)
     driver = gdal.GetDriverByName("GTiff")
     lctif = os.path.join(self.mapsdir, '%s.tif' % (self.lclayer)) 
     lcextentsWhole = self.utmextents['landcover']
-    elfile = os.path.join(self.mapsdir, '%s-new.tif' % (self.ellayer))
-    oifile = os.path.join(self.mapsdir, '%s-new.tif' % (self.oilayer))
 
-    # GeoTIFF Image Tile
-    # eight bands: landcover, elevation, bathy, crust, oR, oG, oB, oA
-    # data type is GDT_Int16 (elevation can be negative)
-    log.log_debug(1,"Creating output image tile %d, %d with offset " \
-                       "(%d, %d) and size (%d, %d)" % \
-                       (tilex, tiley, offsetx, offsety, sizex, sizey))
+    # only the core window is stored: the overlap belongs to the next tile
+    # unless this tile reaches the edge of the map
+    corex = sizex if (offsetx + sizex >= elxsize) else Region.prepTileSize
+    corey = sizey if (offsety + sizey >= elysize) else Region.prepTileSize
     tilename = os.path.join(self.regiondir, 'Tile_%04d_%04d.tif' % (tilex, tiley))
-    mapds = driver.Create(tilename, sizex, sizey, len(Region.rasters), GDT_Int16)
-    mapds.SetProjection(srs.ExportToWkt())
     # overall map transform should match elevation map transform
     geoxform = [elgeoxform[0] + offsetx * elgeoxform[1], elgeoxform[1], elgeoxform[2], \
                 elgeoxform[3] + offsety * elgeoxform[5], elgeoxform[4], elgeoxform[5]]
-    mapds.SetGeoTransform(geoxform)
-
-    # modify elarray and save it as raster band 2
-    log.log_debug(2,"Adjusting and storing elevation to GeoTIFF...")
-    elds = gdal.Open(elfile, GA_ReadOnly)
-    elarray = elds.GetRasterBand(1).ReadAsArray(offsetx, offsety, sizex, sizey)
-    elds = None
-    actualel = ((elarray - self.trim)/self.vscale)+self.sealevel
-    mapds.GetRasterBand(Region.rasters['elevation']).WriteArray(actualel)
-    elarray = None
-    actualel = None
-
-    # generate crust and save it as raster band 4
-    log.log_debug(2,"Adjusting and storing crust to GeoTIFF...")
-    newcrust = Crust(sizex, sizey, wantCL=wantCL)
-    crustarray = newcrust()
-    mapds.GetRasterBand(Region.rasters['crust']).WriteArray(crustarray)
-    crustarray = None
-    newcrust = None
 
     # Compute new geographic tile extents for landcover
     lcextents = {}
@@ -863,8 +1017,11 @@ def buildmaptile(args):
     lcyminarr = int(yminarr + (offsety / float(lcysize)) * (ymaxarr - yminarr))
     lcymaxarr = int(yminarr + ((offsety + lctysize) / float(lcysize)) * (ymaxarr - yminarr))
 
-    # read landcover array
-    log.log_debug(2,"Warping and storing landcover and bathy data...")
+    # read every input window, since their contents decide what is rebuilt
+    elds = gdal.Open(elfile, GA_ReadOnly)
+    elarray = elds.GetRasterBand(1).ReadAsArray(offsetx, offsety, sizex, sizey)
+    elds = None
+
     log.log_debug(3,"LC extents: %s" % str(lcextents))
     log.log_debug(3,"LC window: %s => %s" % (str([xminarr, xmaxarr, yminarr, ymaxarr]), \
                        str([lcxminarr, lcyminarr, lcxmaxarr-lcxminarr, lcymaxarr-lcyminarr])))
@@ -875,70 +1032,202 @@ def buildmaptile(args):
     if (tifnodata == None):
         tifnodata = 0
     values[values == tifnodata] = 11
-    values = values.flatten()
     tifband = None
     tifds = None
 
-    # 2. a new array of original scale coordinates must be created
-    #    The following two lines should work fine still because x and y are offset into the array
-    tifxrange = [tifgeotrans[0] + tifgeotrans[1] * x for x in xrange(lcxminarr, lcxmaxarr)]
-    tifyrange = [tifgeotrans[3] + tifgeotrans[5] * y for y in xrange(lcyminarr, lcymaxarr)]
-    coords = numpy.array([(x, y) for y in tifyrange for x in tifxrange])
-
-    # 3. a new array of goal scale coordinates must be made
-    # landcover extents are used for the bathy depth array
-    # yes, it's confusing.  sorry.
-    depthxlen = int((lcextents['xmax']-lcextents['xmin'])/self.scale)
-    depthylen = int((lcextents['ymax']-lcextents['ymin'])/self.scale)
-    depthxrange = [lcextents['xmin'] + self.scale * x for x in xrange(depthxlen)]
-    depthyrange = [lcextents['ymax'] - self.scale * y for y in xrange(depthylen)]
-    depthbase = numpy.array([(x, y) for y in depthyrange for x in depthxrange])
-
-    # 4. an inverse distance tree must be built from that
-    lcCLIDT = CLIDT(coords, values, depthbase, wantCL=wantCL)
-
-    # 5. the desired output comes from that inverse distance tree
-    deptharray = lcCLIDT()
-    deptharray.resize((depthylen, depthxlen))
-    lcCLIDT = None
-
-    # 6. Finish and store the band
-    lcarray = deptharray[self.maxdepth:-1*self.maxdepth, self.maxdepth:-1*self.maxdepth]
-    geotrans = [ lcextents['xmin'], self.scale, 0, lcextents['ymax'], 0, -1 * self.scale ]
-    projection = srs.ExportToWkt()
-    bathyarray = getBathy(deptharray, self.maxdepth, geotrans, projection)
-    mapds.GetRasterBand(Region.rasters['bathy']).WriteArray(bathyarray)
-
-    # perform terrain translation
-    # NB: figure out why this doesn't work up above
-    lcpid = self.lclayer[:3]
-    if lcpid in Terrain.translate:
-        trans = Terrain.translate[lcpid]
-        for key in trans:
-            lcarray[lcarray == key] = trans[key]
-        for value in numpy.unique(lcarray).flat:
-            if value not in Terrain.terdict:
-                self.warn("tile has bad value: " + str(value))
-    mapds.GetRasterBand(Region.rasters['landcover']).WriteArray(lcarray)
-
-    # read and store ortho arrays
+    orthoarrays = []
     tifds = gdal.Open(oifile, GA_ReadOnly)
     for band in xrange(1,5):		# That is, [1 2 3 4]
-        log.log_debug(2,"Cropping and storing ortho data (%s band)..." % "-rgba"[band])
         tifband = tifds.GetRasterBand(band)
-        #values = tifband.ReadAsArray(oixminarr, oiyminarr, (oixmaxarr - oixminarr), (oiymaxarr - oiyminarr))
-        values = tifband.ReadAsArray(offsetx, offsety, sizex, sizey)
+        orthovalues = tifband.ReadAsArray(offsetx, offsety, sizex, sizey)
         tifnodata = tifband.GetNoDataValue()
         if (tifnodata == None):
             tifnodata = 0
-        values[values == tifnodata] = -1    #Signal missing
+        orthovalues[orthovalues == tifnodata] = -1    #Signal missing
         tifband = None
-
-        mapds.GetRasterBand(band+Region.rasters['orthor']-1).WriteArray(values)
-        values = None
+        orthoarrays.append(orthovalues)
     tifds = None
 
-    # close the dataset and append it to the tile list
+    # each group of bands is rebuilt only if its inputs changed
+    seed = tileseed('%s/prep' % name, tilex, tiley)
+    # the tile's place on the map is common to every group
+    common = (BuildGraph.codeversion(Region.prepmodules), offsetx, offsety, sizex, sizey, corex, corey, \
+              tuple(geoxform), self.t_srs)
+    digests = { 'elevation': BuildGraph.digest(common, elarray, self.trim, self.vscale, self.sealevel),
+                'crust': BuildGraph.digest(common, seed),
+                'landcover': BuildGraph.digest(common, values, lcarr, tifgeotrans, self.scale, self.maxdepth, self.lclayer),
+                'ortho': BuildGraph.digest(common, *orthoarrays) }
     mapds = None
-    return tilename
+    if os.path.exists(tilename):
+        mapds = gdal.Open(tilename, GA_Update)
+    if mapds is None or (mapds.RasterXSize, mapds.RasterYSize) != (corex, corey):
+        stale = sorted(digests.keys())
+    else:
+        stale = sorted([group for group in digests if recorded.get(group) != digests[group]])
+    if dryrun or stale == []:
+        mapds = None
+        return (tilex, tiley, tilename, digests, stale)
 
+    # GeoTIFF Image Tile
+    # eight bands: landcover, elevation, bathy, crust, oR, oG, oB, oA
+    # data type is GDT_Int16 (elevation can be negative)
+    if len(stale) == len(digests):
+        log.log_debug(1,"Creating output image tile %d, %d with offset " \
+                           "(%d, %d) and size (%d, %d)" % \
+                           (tilex, tiley, offsetx, offsety, sizex, sizey))
+        mapds = None
+        mapds = driver.Create(tilename, corex, corey, len(Region.rasters), GDT_Int16)
+    else:
+        log.log_debug(1,"Updating %s in image tile %d, %d" % (', '.join(stale), tilex, tiley))
+    # an updated tile is placed again too, in case it was left behind
+    mapds.SetProjection(srs.ExportToWkt())
+    mapds.SetGeoTransform(geoxform)
+
+    # modify elarray and save it as raster band 2
+    if 'elevation' in stale:
+        log.log_debug(2,"Adjusting and storing elevation to GeoTIFF...")
+        actualel = ((elarray - self.trim)/self.vscale)+self.sealevel
+        mapds.GetRasterBand(Region.rasters['elevation']).WriteArray(actualel[:corey, :corex])
+        actualel = None
+    elarray = None
+
+    # generate crust and save it as raster band 4
+    if 'crust' in stale:
+        log.log_debug(2,"Adjusting and storing crust to GeoTIFF...")
+        random.seed(seed)
+        newcrust = Crust(sizex, sizey, wantCL=wantCL)
+        crustarray = newcrust()
+        mapds.GetRasterBand(Region.rasters['crust']).WriteArray(crustarray[:corey, :corex])
+        crustarray = None
+        newcrust = None
+
+    if 'landcover' in stale:
+        log.log_debug(2,"Warping and storing landcover and bathy data...")
+
+        # 2. a new array of goal scale coordinates must be made
+        # landcover extents are used for the bathy depth array
+        # yes, it's confusing.  sorry.
+        depthxlen = int((lcextents['xmax']-lcextents['xmin'])/self.scale)
+        depthylen = int((lcextents['ymax']-lcextents['ymin'])/self.scale)
+
+        if GridIDT.regular(tifgeotrans):
+            # 3. both grids are regular so neighbors are found by index arithmetic
+            wingeotrans = [tifgeotrans[0] + tifgeotrans[1] * lcxminarr, tifgeotrans[1], 0, \
+                           tifgeotrans[3] + tifgeotrans[5] * lcyminarr, 0, tifgeotrans[5]]
+            lcGridIDT = GridIDT(values, wingeotrans, (lcextents['xmin'], lcextents['ymax']), \
+                                self.scale, (depthylen, depthxlen))
+            deptharray = lcGridIDT()
+            lcGridIDT = None
+        else:
+            # 3. otherwise an inverse distance tree must be built
+            (tifx, tify) = numpy.meshgrid(numpy.arange(lcxminarr, lcxmaxarr), numpy.arange(lcyminarr, lcymaxarr))
+            coords = numpy.column_stack([(tifgeotrans[0] + tifgeotrans[1] * tifx + tifgeotrans[2] * tify).ravel(), \
+                                         (tifgeotrans[3] + tifgeotrans[4] * tifx + tifgeotrans[5] * tify).ravel()])
+            (depthx, depthy) = numpy.meshgrid(numpy.arange(depthxlen), numpy.arange(depthylen))
+            depthbase = numpy.column_stack([(lcextents['xmin'] + self.scale * depthx).ravel(), \
+                                            (lcextents['ymax'] - self.scale * depthy).ravel()])
+            lcCLIDT = CLIDT(coords, values.flatten(), depthbase, wantCL=wantCL)
+
+            # 4. the desired output comes from that inverse distance tree
+            deptharray = lcCLIDT()
+            deptharray.resize((depthylen, depthxlen))
+            lcCLIDT = None
+
+        # 5. Finish and store the band
+        lcarray = deptharray[self.maxdepth:-1*self.maxdepth, self.maxdepth:-1*self.maxdepth]
+        geotrans = [ lcextents['xmin'], self.scale, 0, lcextents['ymax'], 0, -1 * self.scale ]
+        projection = srs.ExportToWkt()
+        bathyarray = getBathy(deptharray, self.maxdepth, geotrans, projection)
+        mapds.GetRasterBand(Region.rasters['bathy']).WriteArray(bathyarray[:corey, :corex])
+
+        # perform terrain translation
+        # NB: figure out why this doesn't work up above
+        lcpid = self.lclayer[:3]
+        if lcpid in Terrain.translate:
+            trans = Terrain.translate[lcpid]
+            for key in trans:
+                lcarray[lcarray == key] = trans[key]
+            for value in numpy.unique(lcarray).flat:
+                if value not in Terrain.terdict:
+                    self.warn("tile has bad value: " + str(value))
+        mapds.GetRasterBand(Region.rasters['landcover']).WriteArray(lcarray[:corey, :corex])
+    values = None
+
+    # store ortho arrays
+    if 'ortho' in stale:
+        for band in xrange(1,5):
+            log.log_debug(2,"Cropping and storing ortho data (%s band)..." % "-rgba"[band])
+            mapds.GetRasterBand(band+Region.rasters['orthor']-1).WriteArray(orthoarrays[band-1][:corey, :corex])
+    orthoarrays = None
+
+    # close the dataset and add it to the mosaic
+    mapds = None
+    return (tilex, tiley, tilename, digests, stale)
+
+if __name__ == '__main__':
+    # benchmark the prep mosaic: overlapping tiles merged by gdal_merge.py
+    # as buildmap originally did, against core windows in a VRT
+    import sys
+    import shutil
+    import tempfile
+
+    elsize = 4100
+    readrows = 256
+
+    exec "\n".join( sys.argv[1:] )  # python region.py elsize= ...
+
+    overlap = Region.prepTileSizeOverlap - Region.prepTileSize
+    elsizetile = elsize if (elsize % Region.prepTileSize) > overlap else elsize - overlap
+    numtiles = int(ceil(float(elsizetile)/Region.prepTileSize))
+    block = numpy.random.RandomState(1).randint(0, 1000, (Region.prepTileSizeOverlap, Region.prepTileSizeOverlap)).astype(numpy.int16)
+    driver = gdal.GetDriverByName('GTiff')
+
+    def writetiles(tempdir, core):
+        """Write every prep tile, either whole or just its core window."""
+        tilenames = []
+        for (tilex, tiley) in product(xrange(numtiles), xrange(numtiles)):
+            offsetx = tilex * Region.prepTileSize
+            offsety = tiley * Region.prepTileSize
+            sizex = min(Region.prepTileSizeOverlap, elsize - offsetx)
+            sizey = min(Region.prepTileSizeOverlap, elsize - offsety)
+            if core:
+                sizex = sizex if (offsetx + sizex >= elsize) else Region.prepTileSize
+                sizey = sizey if (offsety + sizey >= elsize) else Region.prepTileSize
+            tilename = os.path.join(tempdir, 'Tile_%04d_%04d.tif' % (tilex, tiley))
+            mapds = driver.Create(tilename, sizex, sizey, len(Region.rasters), GDT_Int16)
+            mapds.SetGeoTransform([offsetx, 1, 0, -offsety, 0, -1])
+            for band in xrange(len(Region.rasters)):
+                mapds.GetRasterBand(band+1).WriteArray(block[:sizey, :sizex])
+            mapds = None
+            tilenames.append(tilename)
+        return tilenames
+
+    print "Prep mosaic: %d x %d map, %d x %d prep tiles" % (elsize, elsize, numtiles, numtiles)
+    for flow in ['before', 'after']:
+        tempdir = tempfile.mkdtemp()
+        start = time.time()
+        tilenames = writetiles(tempdir, flow == 'after')
+        tilebytes = sum([os.path.getsize(tilename) for tilename in tilenames])
+        if flow == 'before':
+            mapname = os.path.join(tempdir, 'Map.tif')
+            os.system('gdal_merge.py -o "%s" "%s"' % (mapname, '" "'.join(tilenames)))
+            mapbytes = os.path.getsize(mapname)
+            [os.remove(tilename) for tilename in tilenames]
+        else:
+            mapname = os.path.join(tempdir, 'Map.vrt')
+            mapds = gdal.BuildVRT(mapname, tilenames)
+            mapds = None
+            mapbytes = os.path.getsize(mapname)
+        writetime = time.time() - start
+
+        # buildstore reads the whole map back once
+        start = time.time()
+        mapds = gdal.Open(mapname, GA_ReadOnly)
+        for stripy in xrange(0, elsize, readrows):
+            mapds.ReadAsArray(0, stripy, elsize, min(readrows, elsize - stripy))
+        mapds = None
+        readtime = time.time() - start
+        shutil.rmtree(tempdir)
+
+        print "%s: %.1f MB written in %.1f seconds (tiles %.1f MB, map %.1f MB), map read back in %.1f seconds" % \
+            (flow, (tilebytes + mapbytes) / 1e6, writetime, tilebytes / 1e6, mapbytes / 1e6, readtime)
@@ -0,0 +1,84 @@
+# scheduler module
+import time
+import traceback
+from multiprocessing import Pool
+
+def timedcall(args):
+    """Run one task in a worker, returning its result and timing.
+
+    Exceptions are caught here so the parent sees the worker's traceback."""
+    (function, index, task) = args
+    start = time.time()
+    try:
+        return (index, function(task), time.time() - start, None)
+    except Exception:
+        return (index, None, time.time() - start, traceback.format_exc())
+
+class Scheduler:
+    """Run tasks across worker processes, most expensive first.
+
+    Tasks are handed out one at a time so idle workers take the next
+    task instead of waiting on a prearranged chunk, which keeps every
+    core busy until the cheap tasks at the end are gone."""
+
+    # seconds between progress reports
+    interval = 10
+
+    def __init__(self, log, single=False, processes=None, initializer=None, initargs=()):
+        """initializer(*initargs) runs once in each worker before its
+        first task, or once in this process if single is True."""
+        self.log = log
+        self.single = single
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def __call__(self, function, tasks, costs=None, label='tasks', describe=str):
+        """Return function(task) for each task, in the order of tasks.
+
+        costs predict the relative time of each task and set the order
+        they are started in and the ETA.  describe(task) names a task in
+        the log.  A failed task stops the run at once with RuntimeError."""
+        if costs == None:
+            costs = [1] * len(tasks)
+        costs = [max(float(cost), 1e-6) for cost in costs]
+        order = sorted(xrange(len(tasks)), key=lambda index: costs[index], reverse=True)
+        jobs = [(function, index, tasks[index]) for index in order]
+        totalcost = sum(costs)
+
+        results = [None] * len(tasks)
+        if self.single:
+            if self.initializer != None:
+                self.initializer(*self.initargs)
+            finished = (timedcall(job) for job in jobs)
+            pool = None
+        else:
+            pool = Pool(self.processes, self.initializer, self.initargs)
+            finished = pool.imap_unordered(timedcall, jobs, chunksize=1)
+        start = time.time()
+        lastreport = start
+        donecost = 0
+        try:
+            for done, (index, result, seconds, error) in enumerate(finished, 1):
+                if error != None:
+                    self.log.log_error("%s failed:\n%s" % (describe(tasks[index]), error))
+                    raise RuntimeError, "%s failed" % describe(tasks[index])
+                results[index] = result
+                donecost += costs[index]
+                self.log.log_debug(1,"%s finished in %.2f seconds" % (describe(tasks[index]), seconds))
+                now = time.time()
+                if now - lastreport >= Scheduler.interval and done < len(tasks):
+                    lastreport = now
+                    eta = (now - start) * (totalcost - donecost) / donecost
+                    self.log.log_info("Completed %d of %d %s, about %d seconds remaining..." % \
+                                      (done, len(tasks), label, eta))
+        except:
+            if pool != None:
+                pool.terminate()
+                pool.join()
+            raise
+        if pool != None:
+            pool.close()
+            pool.join()
+        self.log.log_info("Completed %d %s in %.1f seconds." % (len(tasks), label, time.time() - start))
+        return results
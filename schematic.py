@@ -82,5 +82,7 @@ class Schematic:
                     Schematic.schems[key] = newschem
                 schem = Schematic.schems[key]
                 return (y + schem.height - schem.offset, [(crustval, 'Dirt')] + schem.layout[x % schem.length][z % schem.width], None)
+            # columns of this landcover type depend on their position
+            wrapper.schematic = key
             return wrapper
         return decorator
@@ -1,5 +1,6 @@
-from random import random, choice
-from utils import materialNamed, height
+from random import Random
+import numpy
+from utils import materialNamed
 from schematic import Schematic
 
 # Try to get SparseWorld's mcBlockData class, if available
@@ -29,22 +30,78 @@ class Terrain:
     treeProb = 0.001
     forestProb = 0.03
 
+    # plants placed on grass
+    # 80% Tall Grass, 10% Flower, 10% Rose
+    plants = [('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1), 'Flower', 'Rose']
+
+    # random decisions made for each column
+    # key = landcover value
+    # value = (stoneProb, treeProb, trees, tallgrassProb)
+    # trees: equal chances on which kind of tree
+    chances = { 31: (0.50, treeProb, ['Cactus', 'Cactus', 'Cactus', 'Sugar Cane'], 0),
+                32: (0, treeProb, ['Cactus', 'Cactus', 'Cactus', 'Sugar Cane'], 0),
+                41: (0, forestProb, ['Redwood'], 0),
+                42: (0, forestProb, ['Birch'], 0),
+                43: (0, forestProb, ['Redwood', 'Birch'], 0),
+                51: (0.25, treeProb, ['Shrub'], 0),
+                71: (0, 0, [], 0.75),
+                81: (0, 0, [], 0.50),
+                91: (0, 0, [], tallgrassProb) }
+
+    # decision for columns without random choices
+    # (stone, tree, plant)
+    nodecision = (False, None, None)
+
+    # every tree and plant a decision may hold, numbered from 1 by columns
+    treechoices = sorted(set([tree for chance in chances.values() for tree in chance[2]]))
+    plantchoices = [plant for index, plant in enumerate(plants) if plant not in plants[:index]]
+
     # schematic defaults
+    # drawn from a fixed seed so every run (and every worker) agrees
     # 21: 10%, 22: 35%, 23: 65%, 24: 90%, 25: 95%
-    layout21 = [[[(1, 'Stone' if random() < 0.1 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
-    layout22 = [[[(1, 'Stone' if random() < 0.35 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
-    layout23 = [[[(1, 'Stone' if random() < 0.65 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
-    layout24 = [[[(1, 'Stone' if random() < 0.90 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
-    layout25 = [[[(1, 'Stone' if random() < 0.95 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
+    layoutRandom = Random(0)
+    layout21 = [[[(1, 'Stone' if layoutRandom.random() < 0.1 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
+    layout22 = [[[(1, 'Stone' if layoutRandom.random() < 0.35 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
+    layout23 = [[[(1, 'Stone' if layoutRandom.random() < 0.65 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
+    layout24 = [[[(1, 'Stone' if layoutRandom.random() < 0.90 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
+    layout25 = [[[(1, 'Stone' if layoutRandom.random() < 0.95 else 'Grass')] for x in xrange(10)] for x in xrange(10)]
+
+    # random draws
+    # every column of a tile gets one of each, whether it uses it or not
+    drawnames = ['stone', 'tree', 'treetype', 'treeheight', 'plant', 'planttype']
+
+    @staticmethod
+    def draws(rng, shape):
+        """Pre-draw every random value the columns of a tile may need."""
+        return dict([(name, rng.random_sample(shape)) for name in Terrain.drawnames])
 
-    # helper methods
     @staticmethod
-    def placetree(treeProb, whichTree):
-        # two possibilities for whichTree:
-        # string: 100% this kind of tree
-        # list: equal chances on which kind of tree
-        treeType = choice(whichTree) if type(whichTree) is list else whichTree
-        return treeType if random() < treeProb else None
+    def decide(lcarray, draws):
+        """Turn pre-drawn random values into decisions for every column.
+
+        Returns (stone, tree, plant) arrays shaped like lcarray: stone is
+        boolean, tree holds a kind of tree or None, and plant holds a
+        block for the plant on top of grass or None."""
+        stone = numpy.zeros(lcarray.shape, dtype=bool)
+        tree = numpy.empty(lcarray.shape, dtype=object)
+        plant = numpy.empty(lcarray.shape, dtype=object)
+        plants = numpy.empty(len(Terrain.plants), dtype=object)
+        plants[:] = Terrain.plants
+        for lcval in numpy.unique(lcarray):
+            if int(lcval) not in Terrain.chances:
+                continue
+            (stoneProb, treeProb, trees, tallgrassProb) = Terrain.chances[int(lcval)]
+            mask = (lcarray == lcval)
+            isstone = mask & (draws['stone'] < stoneProb)
+            stone |= isstone
+            if trees:
+                hastree = mask & ~isstone & (draws['tree'] < treeProb)
+                choices = numpy.array(trees, dtype=object)
+                tree[hastree] = choices[(draws['treetype'][hastree] * len(trees)).astype(int)]
+            if tallgrassProb:
+                hasplant = mask & (draws['plant'] < tallgrassProb)
+                plant[hasplant] = plants[(draws['planttype'][hasplant] * len(plants)).astype(int)]
+        return stone, tree, plant
 
     # common Terrain methods
     # all Terrain methods accept (x, y, z, crustval) at least
@@ -52,6 +109,7 @@ class Terrain:
     # y: integer level for top of the column (usually unmodified)
     # column: list of counts and blocks with optional data
     # tree: either a type of tree or None
+    # decision: (stone, tree, plant) as made by decide
     @staticmethod
     def placedirt(x, y, z, crustval):
         return (y, [(crustval, 'Dirt')], None)
@@ -67,122 +125,328 @@ class Terrain:
         return (y+1, [(crustval, 'Dirt'), (1, 'Snow Layer')], None)
 
     @staticmethod
-    def placedesert(x, y, z, crustval, stoneProb=0):
-        choices = ['Cactus', 'Cactus', 'Cactus', 'Sugar Cane']
-        (blockType, tree) = ('Stone', None) if random() < stoneProb else ('Sand', Terrain.placetree(Terrain.treeProb, choices))
-        return (y, [(crustval, 'Sand'), (2, blockType)], tree)
+    def placedesert(x, y, z, crustval, decision):
+        (stone, tree, plant) = decision
+        return (y, [(crustval, 'Sand'), (2, 'Stone' if stone else 'Sand')], tree)
     
     @staticmethod
-    def placeforest(x, y, z, crustval, trees):
-        return (y, [(crustval, 'Dirt'), (1, 'Grass')], Terrain.placetree(Terrain.forestProb, trees))
+    def placeforest(x, y, z, crustval, decision):
+        (stone, tree, plant) = decision
+        return (y, [(crustval, 'Dirt'), (1, 'Grass')], tree)
 
     @staticmethod
-    def placeshrubland(x, y, z, crustval, stoneProb):
-        (blockType, tree) = ('Stone', None) if random() < stoneProb else ('Grass', Terrain.placetree(Terrain.treeProb, 'Shrub'))
-        return (y, [(crustval, 'Dirt'), (1, blockType)], tree)
+    def placeshrubland(x, y, z, crustval, decision):
+        (stone, tree, plant) = decision
+        return (y, [(crustval, 'Dirt'), (1, 'Stone' if stone else 'Grass')], tree)
 
     @staticmethod
-    def placegrass(x, y, z, crustval, tallgrassProb=0.05):
-        if (random() < tallgrassProb):
-            # 80% Tall Grass, 10% Flower, 10% Rose
-            choices = [('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1),  ('Tall Grass', 1), 'Flower', 'Rose']
-            return (y+1, [(crustval, 'Dirt'), (1, 'Grass'), (1, choice(choices))], None)
+    def placegrass(x, y, z, crustval, decision):
+        (stone, tree, plant) = decision
+        if plant:
+            return (y+1, [(crustval, 'Dirt'), (1, 'Grass'), (1, plant)], None)
         else:
             return (y, [(crustval, 'Dirt'), (1, 'Grass')], None)
 
     # valid terrain functions
     # 0: default
-    def zero(x, y, z, crustval, bathyval, doSchematics):
+    def zero(x, y, z, crustval, bathyval, doSchematics, decision):
         return (y, [(crustval, 'Obsidian')], None)
 
     # 11: water
-    def eleven(x, y, z, crustval, bathyval, doSchematics):
+    def eleven(x, y, z, crustval, bathyval, doSchematics, decision):
         return Terrain.placewater(x, y, z, crustval, bathyval)
 
     # 12: ice
-    def twelve(x, y, z, crustval, bathyval, doSchematics):
+    def twelve(x, y, z, crustval, bathyval, doSchematics, decision):
         return Terrain.placeice(x, y, z, crustval)
 
     # 21: developed/open-space (<20% developed)
     #@Schematic.use(21, 'OpenSpace', 2, [[[(1, 'Stone')]]], 0)
     @Schematic.use(21, 'OpenSpace', 2, layout21, 0)
-    def twentyone(x, y, z, crustval, bathyval, doSchematics):
+    def twentyone(x, y, z, crustval, bathyval, doSchematics, decision):
         pass
 
     # 22: developed/low-intensity (20-49% developed)
     @Schematic.use(22, 'Neighborhood', 2, layout22, 0)
-    def twentytwo(x, y, z, crustval, bathyval, doSchematics):
+    def twentytwo(x, y, z, crustval, bathyval, doSchematics, decision):
         pass
 
     # 23: developed/medium-intensity (50-79% developed)
     @Schematic.use(23, 'School', 2, layout23, 0)
-    def twentythree(x, y, z, crustval, bathyval, doSchematics):
+    def twentythree(x, y, z, crustval, bathyval, doSchematics, decision):
         pass
 
     # 24: developed/high-intensity (80-100% developed)
     @Schematic.use(24, 'Apartments', 2, layout24, 0)
-    def twentyfour(x, y, z, crustval, bathyval, doSchematics):
+    def twentyfour(x, y, z, crustval, bathyval, doSchematics, decision):
         pass
 
     # 25: commercial-industrial-transportation
     @Schematic.use(25, 'Commercial', 2, layout25, 0)
-    def twentyfive(x, y, z, crustval, bathyval, doSchematics):
+    def twentyfive(x, y, z, crustval, bathyval, doSchematics, decision):
         pass
 
     # 31: barren land (rock/sand/clay)
-    def thirtyone(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placedesert(x, y, z, crustval, stoneProb=0.50)
+    def thirtyone(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placedesert(x, y, z, crustval, decision)
 
     # 32: transitional
-    def thirtytwo(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placedesert(x, y, z, crustval)
+    def thirtytwo(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placedesert(x, y, z, crustval, decision)
 
     # 41: deciduous forest
-    def fortyone(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placeforest(x, y, z, crustval, 'Redwood')
+    def fortyone(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placeforest(x, y, z, crustval, decision)
 
     # 42: evergreen forest
-    def fortytwo(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placeforest(x, y, z, crustval, 'Birch')
+    def fortytwo(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placeforest(x, y, z, crustval, decision)
 
     # 43: mixed forest
-    def fortythree(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placeforest(x, y, z, crustval, ['Redwood', 'Birch'])
+    def fortythree(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placeforest(x, y, z, crustval, decision)
 
     # 51: shrubland
-    def fiftyone(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placeshrubland(x, y, z, crustval, stoneProb=0.25)
+    def fiftyone(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placeshrubland(x, y, z, crustval, decision)
 
     # 71: grassland
-    def seventyone(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placegrass(x, y, z, crustval, tallgrassProb=0.75)
+    def seventyone(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placegrass(x, y, z, crustval, decision)
 
     # 81: pasture/hay
-    def eightyone(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placegrass(x, y, z, crustval, tallgrassProb=0.50)
+    def eightyone(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placegrass(x, y, z, crustval, decision)
 
     # 82: crops
     @Schematic.use(82, 'Farm', 2, [[[(1, ('Farmland', 7)), (1, ('Crops', 7))]]], 1)
-    def eightytwo(x, y, z, crustval, bathyval, doSchematics):
+    def eightytwo(x, y, z, crustval, bathyval, doSchematics, decision):
         pass
 
     # 91: wetlands
-    def ninetyone(x, y, z, crustval, bathyval, doSchematics):
-        return Terrain.placegrass(x, y, z, crustval)
+    def ninetyone(x, y, z, crustval, bathyval, doSchematics, decision):
+        return Terrain.placegrass(x, y, z, crustval, decision)
 
     # dictionary used by place
     terdict = { 0: zero, 11: eleven, 12: twelve, 21: twentyone, 22: twentytwo, 23: twentythree, 24: twentyfour, 25: twentyfive, 31: thirtyone, 32: thirtytwo, 41: fortyone, 42: fortytwo, 43: fortythree, 51: fiftyone, 71: seventyone, 81: eightyone, 82: eightytwo, 91: ninetyone }
 
-    # method that actually places terrain
+    # compiled column templates
+    # key = landcover value
+    # value = dict(key=column, value=(blocks, datas, runs, iswater))
+    templates = dict()
+
+    @staticmethod
+    def template(lcval, column):
+        """Returns the compiled template for a column returned by a terrain method.
+
+        The template holds the top height(column) blocks of the column
+        as block and data arrays, the same blocks as (lo, hi, block, data)
+        runs relative to the bottom of the template, and whether the
+        topmost layer is water."""
+        try:
+            return Terrain.templates[lcval][column]
+        except KeyError:
+            pass
+        blocks = []
+        datas = []
+        runs = []
+        base = 0
+        for (depth, block) in column:
+            (block, data) = block if type(block) is tuple else (block, 0)
+            block = materialNamed(block) if type(block) is str else block
+            runs.append((base, base+depth, block, data))
+            blocks += [block] * depth
+            datas += [data] * depth
+            base += depth
+        iswater = (block == materialNamed('Water'))
+        template = (numpy.array(blocks, dtype=numpy.uint16), numpy.array(datas, dtype=numpy.uint8), runs, iswater)
+        Terrain.templates.setdefault(lcval, dict())[column] = template
+        return template
+
+    # method that selects the template for a column
     @staticmethod
-    def place(x, y, z, lcval, crustval, bathyval, doSchematics, r=None, g=None, b=None, ir=None):
+    def column(x, y, z, lcval, crustval, bathyval, doSchematics, r=None, g=None, b=None, ir=None, decision=nodecision):
+        """Returns (y, template, ortho, tree) for a column.
+
+        The template sits directly below y with End Stone filling the
+        space down to the Bedrock at y=0.  ortho is either None or the
+        (block, data) pair replacing the topmost block."""
         try:
             Terrain.terdict[lcval]
         except KeyError:
             print "lcval value %s not found!" % lcval
-        (y, column, tree) = Terrain.terdict.get(lcval, Terrain.terdict[0])(x, y, z, crustval, bathyval, doSchematics)
-        merged = [ (depth, (block, 0)) if type(block) is not tuple else (depth, block) for (depth, block) in column ]
+        (y, column, tree) = Terrain.terdict.get(lcval, Terrain.terdict[0])(x, y, z, crustval, bathyval, doSchematics, decision)
+        template = Terrain.template(lcval, tuple(column))
+        ortho = None
+        if haveOrthoColors and not(template[3]):
+            ortho = tuple(mcBlockData.nearest(r, g, b, ir, not(lcval >= 22 and lcval <=25)))
+        return y, template, ortho, tree
+
+    # method that copies a column into arrays
+    @staticmethod
+    def fill(colblocks, coldatas, y, template, ortho=None):
+        """Copy a column into block and data arrays indexed by height."""
+        (blocks, datas, runs, iswater) = template
+        maxy = colblocks.shape[0]
+        base = y - len(blocks)
         # y=0 is always bedrock
+        colblocks[0] = materialNamed('Bedrock')
+        if base > 1:
+            colblocks[1:min(base, maxy)] = materialNamed('End Stone')
+        lo = max(base, 1)
+        hi = min(y, maxy)
+        if hi > lo:
+            colblocks[lo:hi] = blocks[lo-base:hi-base]
+            coldatas[lo:hi] = datas[lo-base:hi-base]
+        if ortho is not None:
+            top = max(y-1, 0)
+            if top < maxy:
+                (colblocks[top], coldatas[top]) = ortho
+
+    # method that resolves a column into runs
+    @staticmethod
+    def runs(x, y, z, lcval, crustval, bathyval, doSchematics, r=None, g=None, b=None, ir=None, decision=nodecision):
+        """Returns (runs, tree) for a column.
+
+        Each run is (lo, hi, block, data) covering lo <= y < hi, listed
+        in the order the blocks are written.  Empty runs are kept so
+        every column of a landcover type has the same shape."""
+        (y, template, ortho, tree) = Terrain.column(x, y, z, lcval, crustval, bathyval, doSchematics, r, g, b, ir, decision)
+        base = y - len(template[0])
+        runs = [ (0, 1, materialNamed('Bedrock'), 0), (1, base, materialNamed('End Stone'), 0) ]
+        runs += [ (max(base+lo, 1), base+hi, block, data) for (lo, hi, block, data) in template[2] ]
+        if ortho is not None:
+            # the topmost block written takes its color from the orthoimagery
+            top = max([index for index, run in enumerate(runs) if run[1] > run[0]])
+            (lo, hi, block, data) = runs[top]
+            runs[top] = (lo, hi-1, block, data)
+            runs.append((hi-1, hi) + ortho)
+        return runs, tree
+
+    @staticmethod
+    def number(values, choices):
+        """Number the entries of an object array by their place in choices.
+
+        Entries which are None become 0 and choices are numbered from 1."""
+        numbers = numpy.zeros(values.shape, dtype=numpy.int64)
+        for number, choice in enumerate(choices, 1):
+            # a 0-d array keeps tuples from being broadcast
+            target = numpy.empty((), dtype=object)
+            target[()] = choice
+            numbers[values == target] = number
+        return numbers
+
+    # method that resolves arrays of columns into runs
+    @staticmethod
+    def columns(x, y, z, lcarray, crustarray, bathyarray, doSchematics, r=None, g=None, b=None, ir=None, decisions=None):
+        """Returns (runs, ortho, trees) for arrays of columns.
+
+        The arguments are those of column as arrays of one shape.
+        Columns are grouped by landcover value and by everything else
+        their terrain method looks at, so each method is called once per
+        group rather than once per column.  runs is a list of (lo, hi,
+        block, data) arrays covering lo <= y < hi, which do not overlap.
+        ortho is either None or (y, block, data, mask) arrays for the
+        block replacing the one at y where mask is True.  trees holds
+        the tree of each column or None."""
+        shape = lcarray.shape
+        if decisions == None:
+            decisions = (numpy.zeros(shape, dtype=bool), numpy.empty(shape, dtype=object), numpy.empty(shape, dtype=object))
+        (stone, tree, plant) = decisions
+
+        # schematics repeat across the map, so their columns depend on position
+        xmod = numpy.zeros(shape, dtype=numpy.int64)
+        zmod = numpy.zeros(shape, dtype=numpy.int64)
+        for lcval in numpy.unique(lcarray):
+            if int(lcval) not in Terrain.terdict:
+                print "lcval value %s not found!" % lcval
+            method = Terrain.terdict.get(int(lcval), Terrain.terdict[0])
+            if hasattr(method, 'schematic'):
+                # the first call loads the schematic
+                method(0, 0, 0, 0, 0, doSchematics, Terrain.nodecision)
+                schem = Schematic.schems[method.schematic]
+                mask = (lcarray == lcval)
+                xmod[mask] = x[mask] % schem.length
+                zmod[mask] = z[mask] % schem.width
+
+        keys = numpy.column_stack([array.ravel().astype(numpy.int64) for array in \
+                                   (lcarray, crustarray, bathyarray, stone, Terrain.number(tree, Terrain.treechoices), \
+                                    Terrain.number(plant, Terrain.plantchoices), xmod, zmod)])
+        # one number per key sorts far faster than rows of keys
+        shifted = keys - keys.min(axis=0)
+        (dummy, first, inverse) = numpy.unique(numpy.ravel_multi_index(shifted.T, shifted.max(axis=0) + 1), \
+                                               return_index=True, return_inverse=True)
+        groups = keys[first]
+
+        # each group's column is built once
+        numgroups = len(groups)
+        offsets = numpy.zeros(numgroups, dtype=numpy.int64)
+        depths = numpy.zeros(numgroups, dtype=numpy.int64)
+        iswater = numpy.zeros(numgroups, dtype=bool)
+        grouptrees = numpy.empty(numgroups, dtype=object)
+        groupruns = []
+        for index, (lcval, crustval, bathyval, isstone, treenum, plantnum, xval, zval) in enumerate(groups.tolist()):
+            decision = (bool(isstone), Terrain.treechoices[treenum-1] if treenum else None, \
+                        Terrain.plantchoices[plantnum-1] if plantnum else None)
+            (offset, column, grouptree) = Terrain.terdict.get(lcval, Terrain.terdict[0])(xval, 0, zval, crustval, bathyval, doSchematics, decision)
+            (blocks, datas, templateruns, templatewater) = Terrain.template(lcval, tuple(column))
+            offsets[index] = offset
+            depths[index] = len(blocks)
+            iswater[index] = templatewater
+            grouptrees[index] = grouptree
+            groupruns.append(templateruns)
+
+        # shorter templates are padded with empty runs
+        numruns = max([len(templateruns) for templateruns in groupruns])
+        runarrays = numpy.zeros((4, numgroups, numruns), dtype=numpy.int64)
+        for index, templateruns in enumerate(groupruns):
+            if templateruns:
+                runarrays[:, index, :len(templateruns)] = numpy.array(templateruns, dtype=numpy.int64).T
+
+        # the template sits directly below y with End Stone beneath it
+        tops = y.ravel().astype(numpy.int64) + offsets[inverse]
+        base = tops - depths[inverse]
+        ones = numpy.ones(base.shape, dtype=numpy.int64)
+        runs = [ (0 * ones, ones, materialNamed('Bedrock') * ones, 0 * ones),
+                 (ones, base, materialNamed('End Stone') * ones, 0 * ones) ]
+        for run in xrange(numruns):
+            (lo, hi, block, data) = [runarray[inverse, run] for runarray in runarrays]
+            runs.append((numpy.maximum(base + lo, 1), base + hi, block, data))
+        runs = [tuple([array.reshape(shape) for array in run]) for run in runs]
+
+        ortho = None
+        if haveOrthoColors:
+            mask = ~iswater[inverse]
+            natural = ~((keys[:, 0] >= 22) & (keys[:, 0] <= 25))
+            colors = numpy.column_stack([array.ravel().astype(numpy.int64) for array in (r, g, b, ir)] + [natural])[mask]
+            (uniquecolors, colorinverse) = numpy.unique(colors, axis=0, return_inverse=True)
+            nearest = numpy.array([mcBlockData.nearest(rval, gval, bval, irval, bool(naturalval)) \
+                                   for (rval, gval, bval, irval, naturalval) in uniquecolors.tolist()], dtype=numpy.int64)
+            orthoblocks = numpy.zeros(base.shape, dtype=numpy.int64)
+            orthodatas = numpy.zeros(base.shape, dtype=numpy.int64)
+            if len(nearest):
+                orthoblocks[mask] = nearest[colorinverse, 0]
+                orthodatas[mask] = nearest[colorinverse, 1]
+            ortho = tuple([array.reshape(shape) for array in (numpy.maximum(tops - 1, 0), orthoblocks, orthodatas, mask)])
+
+        return runs, ortho, grouptrees[inverse].reshape(shape)
+
+    # method that actually places terrain
+    @staticmethod
+    def place(x, y, z, lcval, crustval, bathyval, doSchematics, r=None, g=None, b=None, ir=None, decision=nodecision):
+        (runs, tree) = Terrain.runs(x, y, z, lcval, crustval, bathyval, doSchematics, r, g, b, ir, decision)
+        blocks = [ (y, block) for (lo, hi, block, data) in runs for y in xrange(lo, hi) ]
+        datas = [ (y, data) for (lo, hi, block, data) in runs for y in xrange(lo, hi) ]
+        return blocks, datas, tree
+
+if __name__ == '__main__':
+    # micro-benchmark: columns per second before and after templates
+    import time
+    from utils import height
+
+    def pervoxel(y, column):
+        """Expand a column one voxel at a time as place originally did."""
+        merged = [ (depth, (block, 0)) if type(block) is not tuple else (depth, block) for (depth, block) in column ]
         blocks = [ (0, materialNamed('Bedrock')) ]
         datas = [ (0, 0) ]
         core = [ ((y - height(merged)), ('End Stone', 0)) ] + merged
@@ -192,15 +456,36 @@ class Terrain:
             [ blocks.append((y, materialNamed(block) if type(block) is str else block)) for y in xrange(base, base+depth) if y > 0 ]
             [ datas.append((y, data)) for y in xrange(base, base+depth) if y > 0 ]
             base += depth
-
-        water = materialNamed('Water')
-        water = water(0) if type(water) is tuple else water 
-        iswater = (block == 'Water') if type(block) is str else (block == water)
-        if haveOrthoColors and not(iswater):
-            [block, data] = mcBlockData.nearest(r, g, b, ir, not(lcval >= 22 and lcval <=25))
-            blocks[-1] = (blocks[-1][0], block)
-            datas[-1] = (datas[-1][0], data)
-
-        return blocks, datas, tree
-
-
+        return blocks, datas
+
+    numcols = 20000
+    maxy = 256
+    lcvals = sorted(Terrain.terdict.keys())
+    rng = numpy.random.RandomState(1)
+    lcarray = numpy.array(lcvals)[rng.randint(0, len(lcvals), numcols)]
+    (stone, tree, plant) = Terrain.decide(lcarray, Terrain.draws(rng, lcarray.shape))
+    columns = [(x, int(rng.randint(40, 120)), 3*x, int(lcarray[x]), int(rng.randint(1, 6)), int(rng.randint(0, 33)), (stone[x], tree[x], plant[x])) for x in xrange(numcols)]
+
+    # the array writes stand in for setBlockAt and setBlockDataAt
+    colblocks = numpy.zeros(maxy, dtype=numpy.uint16)
+    coldatas = numpy.zeros(maxy, dtype=numpy.uint8)
+    start = time.time()
+    for (x, y, z, lcval, crustval, bathyval, decision) in columns:
+        (y, column, tree) = Terrain.terdict[lcval](x, y, z, crustval, bathyval, False, decision)
+        (blocks, datas) = pervoxel(y, column)
+        for (y, block) in blocks:
+            if block != 0:
+                colblocks[y] = block
+        for (y, data) in datas:
+            if data != 0:
+                coldatas[y] = data
+    before = numcols / (time.time() - start)
+
+    start = time.time()
+    for (x, y, z, lcval, crustval, bathyval, decision) in columns:
+        (y, template, ortho, tree) = Terrain.column(x, y, z, lcval, crustval, bathyval, False, decision=decision)
+        Terrain.fill(colblocks, coldatas, y, template, ortho)
+    after = numcols / (time.time() - start)
+
+    print "per-voxel (original place): %d columns/second" % before
+    print "template fill:              %d columns/second (%.1fx)" % (after, after / before)
@@ -0,0 +1,67 @@
+# tests for BuildRegion script
+import unittest
+import numpy
+
+try:
+    import BuildRegion
+    from region import Region
+except ImportError:
+    BuildRegion = None
+
+class FakeBand:
+    def __init__(self, array):
+        self.array = array
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize, bufxsize, bufysize):
+        """Nearest neighbour resampling, as GDAL does by default."""
+        rows = yoff + ((numpy.arange(bufysize) + 0.5) * ysize / float(bufysize)).astype(int)
+        cols = xoff + ((numpy.arange(bufxsize) + 0.5) * xsize / float(bufxsize)).astype(int)
+        return self.array[rows[:, numpy.newaxis], cols]
+
+class FakeDataset:
+    def __init__(self, array):
+        self.array = array
+        (self.RasterYSize, self.RasterXSize) = array.shape
+
+    def GetRasterBand(self, band):
+        return FakeBand(self.array)
+
+class FakeGdal:
+    def __init__(self, array):
+        self.array = array
+
+    def Open(self, name, mode):
+        return FakeDataset(self.array)
+
+class FakeRegion:
+    """Just the parts of a region tilecosts looks at."""
+    def __init__(self, size, numtilesx, numtilesy):
+        self.tilesize = size
+        self.tiles = { 'xmin': 0, 'xmax': numtilesx, 'ymin': 0, 'ymax': numtilesy }
+        self.mapname = 'Map.vrt'
+        self.doSchematics = False
+
+@unittest.skipIf(BuildRegion == None, 'BuildRegion needs GDAL and pymclevel')
+class TestTileCosts(unittest.TestCase):
+
+    def setUp(self):
+        self.gdal = BuildRegion.gdal
+
+    def tearDown(self):
+        BuildRegion.gdal = self.gdal
+
+    def test_map_smaller_than_grid(self):
+        # three tiles across, but the map ends a third of the way into
+        # the last column: water in the first column, land after it
+        size = 64
+        array = numpy.zeros((2 * size, 150), dtype=numpy.int16) + 41
+        array[:, :size] = 11
+        BuildRegion.gdal = FakeGdal(array)
+        tiles = [(None, 'Test', x, y) for x in xrange(3) for y in xrange(2)]
+        costs = BuildRegion.tilecosts(FakeRegion(size, 3, 2), tiles)
+        for (tile, cost) in zip(tiles, costs):
+            expected = [0.1, 1.1, 0.1 + 6 / 16.0][tile[2]]
+            self.assertAlmostEqual(cost, expected, msg='tile %dx%d' % (tile[2], tile[3]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# tests for cache module
+import os
+import shutil
+import tempfile
+import unittest
+import cache
+from cache import Cache
+
+class FakeClock:
+    """Time that moves one second whenever it is read."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.time = cache.time
+        cache.time = FakeClock()
+
+    def tearDown(self):
+        cache.time = self.time
+        shutil.rmtree(self.top)
+
+    def download(self, name, content):
+        """Write a finished download as the downloader would."""
+        filename = os.path.join(self.top, name)
+        outfile = open(filename, 'wb')
+        outfile.write(content)
+        outfile.close()
+        return filename
+
+    def member(self, name, content):
+        """Write an extracted member."""
+        path = os.path.join(self.top, 'members', name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        outfile = open(path, 'wb')
+        outfile.write(content)
+        outfile.close()
+        return path
+
+    def test_add_and_lookup(self):
+        mycache = Cache(self.top)
+        self.assertEqual(mycache.lookup('a'), None)
+        archive = mycache.add('a', 'http://example.com/a.zip', self.download('a.zip', 'x' * 100))
+        self.assertEqual(archive, os.path.join(self.top, 'objects', '%s.zip' % Cache.checksum(archive)))
+        self.assertFalse(os.path.exists(os.path.join(self.top, 'a.zip')))
+        self.assertEqual(mycache.lookup('a'), archive)
+        self.assertFalse(mycache.extracted('a'))
+        mycache.setmembers('a', [self.member('a.tif', 'y' * 10)])
+        self.assertTrue(mycache.extracted('a'))
+        self.assertEqual(mycache.hitrate(), (1, 1))
+        self.assertEqual(mycache.usage(), (100, 10))
+
+    def test_manifest_persists(self):
+        mycache = Cache(self.top)
+        archive = mycache.add('a', 'http://example.com/a.zip', self.download('a.zip', 'x' * 100))
+        mycache.setmembers('a', [self.member('a.tif', 'y' * 10)])
+        mycache.lookup('b')
+        mycache.flush()
+        # a new cache on the same directory sees everything
+        mycache = Cache(self.top)
+        self.assertEqual(mycache.lookup('a'), archive)
+        self.assertTrue(mycache.extracted('a'))
+        self.assertEqual(mycache.hitrate(), (1, 1))
+        self.assertEqual(mycache.manifest['entries']['a']['url'], 'http://example.com/a.zip')
+        self.assertEqual(mycache.manifest['entries']['a']['members'], [os.path.join('members', 'a.tif')])
+
+    def test_lookup_in_memory(self):
+        # lookups are counted without writing the manifest
+        mycache = Cache(self.top)
+        mycache.add('a', 'http://example.com/a.zip', self.download('a.zip', 'x' * 100))
+        os.utime(mycache.manifestname, (1000, 1000))
+        mycache.lookup('a')
+        mycache.lookup('b')
+        self.assertEqual(os.path.getmtime(mycache.manifestname), 1000)
+        self.assertEqual(Cache(self.top).hitrate(), (0, 0))
+        mycache.flush()
+        self.assertEqual(Cache(self.top).hitrate(), (1, 1))
+
+    def test_no_extension(self):
+        mycache = Cache(self.top)
+        archive = mycache.add('a', 'http://example.com/a', self.download('a', 'x' * 100))
+        self.assertEqual(archive, os.path.join(self.top, 'objects', Cache.checksum(archive)))
+        self.assertEqual(mycache.lookup('a'), archive)
+        archive = mycache.add('b', 'http://example.com/b.tar.gz', self.download('b.tar.gz', 'y' * 100))
+        self.assertTrue(archive.endswith('.tar.gz'))
+
+    def test_shared_content(self):
+        mycache = Cache(self.top)
+        first = mycache.add('a', 'http://example.com/a.zip', self.download('a.zip', 'x' * 100))
+        second = mycache.add('b', 'http://example.com/b.zip', self.download('b.zip', 'x' * 100))
+        third = mycache.add('c', 'http://example.com/c.zip', self.download('c.zip', 'z' * 100))
+        self.assertEqual(first, second)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.top, 'objects'))), sorted([os.path.basename(first), os.path.basename(third)]))
+        self.assertEqual(mycache.usage(), (200, 0))
+        # removing a frees nothing while b still uses its archive
+        mycache.lookup('b')
+        self.assertEqual(mycache.evict(150), 2)
+        self.assertEqual(sorted(mycache.manifest['entries'].keys()), ['b'])
+        self.assertTrue(os.path.exists(second))
+        self.assertFalse(os.path.exists(third))
+
+    def test_evict_order(self):
+        mycache = Cache(self.top)
+        archives = {}
+        for key in ['a', 'b', 'c']:
+            archives[key] = mycache.add(key, 'http://example.com/%s.zip' % key, self.download('%s.zip' % key, key * 100))
+            mycache.setmembers(key, [self.member('%s.tif' % key, key * 50)])
+        # using a makes b the least recently used
+        mycache.lookup('a')
+        self.assertEqual(mycache.evict(150), 2)
+        self.assertEqual(sorted(mycache.manifest['entries'].keys()), ['a'])
+        for key in ['b', 'c']:
+            self.assertFalse(os.path.exists(archives[key]))
+            self.assertFalse(os.path.exists(os.path.join(self.top, 'members', '%s.tif' % key)))
+        self.assertTrue(os.path.exists(archives['a']))
+        self.assertEqual(mycache.usage(), (100, 50))
+        # evictions are saved too
+        self.assertEqual(sorted(Cache(self.top).manifest['entries'].keys()), ['a'])
+
+    def test_evict_least_recent_first(self):
+        mycache = Cache(self.top)
+        for key in ['a', 'b', 'c']:
+            mycache.add(key, 'http://example.com/%s.zip' % key, self.download('%s.zip' % key, key * 100))
+        mycache.lookup('a')
+        mycache.lookup('b')
+        self.assertEqual(mycache.evict(200), 1)
+        self.assertEqual(sorted(mycache.manifest['entries'].keys()), ['a', 'b'])
+        self.assertEqual(mycache.evict(300), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# tests for download module
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+import BaseHTTPServer
+from download import Downloader
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves FakeHandler.content at every path, honoring Range if asked."""
+    content = ''.join([chr(index % 251) for index in xrange(100000)])
+    honorrange = True
+    ranges = []
+
+    def do_GET(self):
+        FakeHandler.ranges.append(self.headers.get('Range'))
+        start = 0
+        if FakeHandler.honorrange and self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(self.content)-1, len(self.content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(self.content) - start))
+        self.end_headers()
+        self.wfile.write(self.content[start:])
+
+    def log_message(self, *args):
+        pass
+
+class TestFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'file.zip')
+        FakeHandler.honorrange = True
+        FakeHandler.ranges = []
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/file.zip' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def contents(self):
+        infile = open(self.filename, 'rb')
+        retval = infile.read()
+        infile.close()
+        return retval
+
+    def partial(self, numbytes):
+        outfile = open(self.filename, 'wb')
+        outfile.write(FakeHandler.content[:numbytes])
+        outfile.close()
+
+    def test_whole(self):
+        self.assertEqual(Downloader.fetch(self.url, self.filename), len(FakeHandler.content))
+        self.assertEqual(self.contents(), FakeHandler.content)
+        self.assertEqual(FakeHandler.ranges, [None])
+
+    def test_resume(self):
+        self.partial(30000)
+        self.assertEqual(Downloader.fetch(self.url, self.filename, len(FakeHandler.content)), len(FakeHandler.content) - 30000)
+        self.assertEqual(self.contents(), FakeHandler.content)
+        self.assertEqual(FakeHandler.ranges, ['bytes=30000-'])
+
+    def test_range_ignored(self):
+        # the server sends the whole file, which replaces the partial one
+        FakeHandler.honorrange = False
+        self.partial(30000)
+        self.assertEqual(Downloader.fetch(self.url, self.filename), len(FakeHandler.content))
+        self.assertEqual(self.contents(), FakeHandler.content)
+
+    def test_complete(self):
+        self.partial(len(FakeHandler.content))
+        self.assertEqual(Downloader.fetch(self.url, self.filename, len(FakeHandler.content)), 0)
+        self.assertEqual(FakeHandler.ranges, [])
+
+    def test_larger(self):
+        # a larger file is not the one expected, so it is fetched again
+        outfile = open(self.filename, 'wb')
+        outfile.write(FakeHandler.content + 'extra')
+        outfile.close()
+        self.assertEqual(Downloader.fetch(self.url, self.filename, len(FakeHandler.content)), len(FakeHandler.content))
+        self.assertEqual(self.contents(), FakeHandler.content)
+
+    def test_wrong_size(self):
+        self.assertRaises(IOError, Downloader.fetch, self.url, self.filename, len(FakeHandler.content) + 1)
+
+    def test_concurrent(self):
+        jobs = [(key, (self.url, os.path.join(self.tempdir, '%s%d.zip' % (key, index)))) \
+                for key in ['a', 'b'] for index in xrange(3)]
+        def function(url, filename):
+            return (filename, Downloader.fetch(url, filename))
+        retval = Downloader(threads=3)(function, jobs)
+        self.assertEqual(sorted(retval.keys()), ['a', 'b'])
+        for key in retval:
+            (results, numbytes, seconds) = retval[key]
+            self.assertEqual(sorted(results), [os.path.join(self.tempdir, '%s%d.zip' % (key, index)) for index in xrange(3)])
+            self.assertEqual(numbytes, 3 * len(FakeHandler.content))
+            self.assertTrue(seconds >= 0)
+
+class TestExtract(unittest.TestCase):
+
+    members = { 'data/a.tif': 'first', 'data/b.txt': 'second', 'other/a.tif': 'third' }
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.tempdir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def destination(self, name):
+        """Every .tif goes to one place, so only the first is written."""
+        if name.endswith('.tif'):
+            return os.path.join(self.outdir, 'a.tif')
+        return None
+
+    def check(self, archive):
+        written = Downloader.extract(archive, self.destination)
+        self.assertEqual(written, [os.path.join(self.outdir, 'a.tif')])
+        infile = open(written[0])
+        self.assertEqual(infile.read(), 'first')
+        infile.close()
+        self.assertEqual(os.listdir(self.outdir), ['a.tif'])
+
+    def test_zip(self):
+        archive = os.path.join(self.tempdir, 'archive.zip')
+        zf = zipfile.ZipFile(archive, 'w')
+        for name in sorted(self.members):
+            zf.writestr(name, self.members[name])
+        zf.close()
+        self.check(archive)
+
+    def test_existing_directory(self):
+        # another thread may already have made the member directory
+        os.makedirs(self.outdir)
+        archive = os.path.join(self.tempdir, 'archive.zip')
+        zf = zipfile.ZipFile(archive, 'w')
+        for name in sorted(self.members):
+            zf.writestr(name, self.members[name])
+        zf.close()
+        self.check(archive)
+
+    def test_tar(self):
+        archive = os.path.join(self.tempdir, 'archive.tgz')
+        tf = tarfile.open(archive, 'w:gz')
+        for name in sorted(self.members):
+            path = os.path.join(self.tempdir, 'member')
+            outfile = open(path, 'w')
+            outfile.write(self.members[name])
+            outfile.close()
+            tf.add(path, name)
+        tf.close()
+        self.check(archive)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# tests for gridresample module
+import unittest
+import numpy as np
+from scipy.spatial import cKDTree as KDTree
+from gridresample import GridIDT
+from clidt import CLIDT
+
+class TestGridIDT(unittest.TestCase):
+
+    nnear = CLIDT.nnear
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        # landcover-like patches with some noise
+        self.values = np.kron(rng.choice([11, 21, 41, 42, 82], (10, 10)), np.ones((6, 6), dtype=int))
+        noise = rng.random_sample(self.values.shape) < 0.2
+        self.values[noise] = rng.choice([11, 21, 41, 42, 82], noise.sum())
+
+    def resample(self, values, geotrans, origin, scale, shape, majority):
+        """Returns GridIDT's result and CLIDT's, computed as the prep path does for irregular grids."""
+        grid = GridIDT(values, geotrans, origin, scale, shape, majority=majority)()
+        (ny, nx) = values.shape
+        (srcx, srcy) = np.meshgrid(np.arange(nx), np.arange(ny))
+        coords = np.column_stack([(geotrans[0] + geotrans[1] * srcx).ravel(), (geotrans[3] + geotrans[5] * srcy).ravel()])
+        (dstx, dsty) = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]))
+        base = np.column_stack([(origin[0] + scale * dstx).ravel(), (origin[1] - scale * dsty).ravel()])
+        tree = CLIDT(coords, values.flatten(), base, wantCL=False, majority=majority)()
+        return (grid, tree.reshape(shape), np.asarray(coords, dtype=np.int32), np.asarray(base, dtype=np.int32))
+
+    def checkties(self, grid, tree, coords, base, values, majority):
+        """Every difference must come from a tie: neighbours equally far
+        at the nnear cutoff, or equally weighted values in a vote.
+
+        Weighted averages are summed in another order and truncated, so
+        they may also differ by one."""
+        if majority:
+            differ = np.nonzero(grid.ravel() != tree.ravel())[0]
+        else:
+            differ = np.nonzero(abs(grid.ravel() - tree.ravel()) > 1)[0]
+        if len(differ) == 0:
+            return 0
+        (dist, ix) = KDTree(coords).query(base[differ], k=self.nnear + 1)
+        z = values.ravel()
+        for (row, index) in enumerate(differ):
+            cutoff = abs(dist[row, self.nnear - 1] - dist[row, self.nnear]) < 1e-9
+            vote = False
+            if majority:
+                w = 1 / dist[row, :self.nnear]
+                zix = z[ix[row, :self.nnear]]
+                vote = abs(np.sum(w[zix == grid.ravel()[index]]) - np.sum(w[zix == tree.ravel()[index]])) < 1e-9
+            self.assertTrue(cutoff or vote, 'point %d differs without a tie' % index)
+        return len(differ)
+
+    def check(self, values, geotrans, origin, scale, shape, majority=True):
+        (grid, tree, coords, base) = self.resample(values, geotrans, origin, scale, shape, majority)
+        self.assertEqual(grid.shape, shape)
+        differ = self.checkties(grid, tree, coords, base, values, majority)
+        # ties are rare
+        self.assertTrue(differ < 0.1 * grid.size, '%d of %d points differ' % (differ, grid.size))
+
+    def test_regular(self):
+        # 30 meter landcover onto a 6 meter grid
+        self.check(self.values, [1000, 30, 0, 5000, 0, -30], (1000, 5000), 6, (300, 300))
+
+    def test_weighted(self):
+        self.check(self.values, [1000, 30, 0, 5000, 0, -30], (1000, 5000), 6, (300, 300), majority=False)
+
+    def test_majority(self):
+        # a vote only returns values from the source
+        grid = GridIDT(self.values, [1000, 30, 0, 5000, 0, -30], (1000, 5000), 6, (300, 300), majority=True)()
+        self.assertTrue(np.in1d(grid, self.values).all())
+        # a uniform source gives the same value everywhere
+        grid = GridIDT(np.zeros((20, 20), dtype=int) + 41, [0, 30, 0, 600, 0, -30], (0, 600), 6, (100, 100))()
+        self.assertTrue((grid == 41).all())
+
+    def test_edges(self):
+        # windows at each edge of the raster reach past it
+        for (x0, y0) in [(0, 0), (40, 0), (0, 40), (40, 40)]:
+            window = self.values[y0:y0+20, x0:x0+20]
+            geotrans = [1000 + 30 * x0, 30, 0, 5000 - 30 * y0, 0, -30]
+            self.check(window, geotrans, (geotrans[0] - 60, geotrans[3] + 60), 6, (120, 120))
+
+    def test_fractional(self):
+        # an origin off the whole meter and a 30/7 scale ratio
+        self.check(self.values, [1000.6, 30, 0, 5000.3, 0, -30], (1003.8, 4997.2), 7, (250, 250))
+
+    def test_irregular(self):
+        self.assertFalse(GridIDT.regular([1000, 30, 0.5, 5000, 0, -30]))
+        self.assertRaises(AttributeError, GridIDT, self.values, [1000, 30, 0.5, 5000, 0, -30], (1000, 5000), 6, (10, 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+# tests for invdisttree module
+import unittest
+import numpy as np
+from invdisttree import Invdisttree
+
+class TestInvdisttree(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.X = rng.uniform(size=(2000, 2))
+        self.z = rng.choice([11, 21, 41, 42, 82], len(self.X))
+        self.q = rng.uniform(size=(500, 2))
+
+    def test_weighted(self):
+        IDT = Invdisttree(self.X, self.z)
+        self.assertTrue(np.allclose(IDT(self.q, 8), IDT.loop(self.q, 8)))
+
+    def test_majority(self):
+        # random points leave no ties, so both versions agree
+        IDT = Invdisttree(self.X, self.z)
+        self.assertTrue((IDT(self.q, 8, majority=True) == IDT.loop(self.q, 8, majority=True)).all())
+
+    def test_majority_tie(self):
+        # two values at the same distance tie, and the smaller one wins
+        IDT = Invdisttree(np.array([(0, 1), (1, 0), (0, -1), (-1, 0)]), np.array([82, 41, 82, 41]))
+        self.assertEqual(IDT(np.array([(0, 0)]), 4, majority=True)[0], 41)
+
+if __name__ == '__main__':
+    unittest.main()
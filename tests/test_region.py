@@ -0,0 +1,274 @@
+# tests for region module
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import numpy
+from klogger import klogger, klog_levels
+
+try:
+    import region
+    from region import Region
+except ImportError:
+    region = None
+
+class FakeService:
+    """Local stand-in for the request validation service.
+
+    Areas larger than 4 square degrees are too large, as are areas
+    larger than 1 square degree which touch the origin."""
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def respond(self, xmlString):
+        (top, bottom, left, right) = [float(re.search('<%s>([^<]*)</%s>' % (tag, tag), xmlString).group(1)) \
+                                      for tag in ['TOP', 'BOTTOM', 'LEFT', 'RIGHT']]
+        self.calls.append((left, right, bottom, top))
+        if self.error != None:
+            return '<ERROR>%s</ERROR>' % self.error
+        area = (right - left) * (top - bottom)
+        if area > 4 or (area > 1 and left == 0 and bottom == 0):
+            return '<ERROR>The area of interest is too large</ERROR>'
+        return '<DOWNLOAD_URL>http://example.com/%g_%g_%g_%g</DOWNLOAD_URL>' % (left, right, bottom, top)
+
+    processAOI2 = respond
+    getTiledDataDirectURLs2 = respond
+
+class FakeClient:
+    def __init__(self, service):
+        self.service = service
+
+if region != None:
+    class FakeRegion(Region):
+        """A region with its extents set directly rather than looked up."""
+        def __init__(self):
+            self.log = klogger(klog_levels.LOG_ERROR)
+            extents = { 'xmin': 0.0, 'xmax': 4.0, 'ymin': 0.0, 'ymax': 4.0 }
+            self.wgs84extents = { 'ortho': extents, 'landcover': extents, 'elevation': extents }
+            self.pidcalls = []
+
+        def pid2FullPid(self, productID):
+            self.pidcalls.append(productID)
+            return '%sGeoTIFF' % productID
+
+@unittest.skipIf(region == None, 'region needs suds, GDAL and pymclevel')
+class TestRequestValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.downloadtop = Region.downloadtop
+        self.client = region.suds.client.Client
+        Region.downloadtop = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(Region.downloadtop)
+        Region.downloadtop = self.downloadtop
+        region.suds.client.Client = self.client
+
+    def validate(self, service, layerIDs):
+        region.suds.client.Client = lambda url: FakeClient(service)
+        myRegion = FakeRegion()
+        return (myRegion, myRegion.requestvalidation(layerIDs))
+
+    def test_split(self):
+        service = FakeService()
+        (myRegion, retval) = self.validate(service, ['P10'])
+        # the whole area, its quarters, then the quarters of the one at the origin
+        self.assertEqual(len(service.calls), 1 + 4 + 4)
+        self.assertEqual(len(retval['P10']), 3 + 4)
+        self.assertEqual(len(set(retval['P10'])), len(retval['P10']))
+        self.assertTrue('http://example.com/0_1_0_1' in retval['P10'])
+        self.assertTrue('http://example.com/2_4_2_4' in retval['P10'])
+
+    def test_memo(self):
+        service = FakeService()
+        (myRegion, first) = self.validate(service, ['P10', 'N3F'])
+        self.assertEqual(myRegion.pidcalls, ['P10'])
+        self.assertTrue(os.path.exists(os.path.join(Region.downloadtop, 'validation.yaml')))
+        service = FakeService()
+        (myRegion, second) = self.validate(service, ['P10', 'N3F'])
+        self.assertEqual(service.calls, [])
+        self.assertEqual(myRegion.pidcalls, [])
+        self.assertEqual(first, second)
+
+    def test_unknown_error(self):
+        service = FakeService(error='Something else went wrong')
+        self.assertRaises(IOError, self.validate, service, ['N3F'])
+        # the pool is closed and the memo written on the way out
+        self.assertTrue(os.path.exists(os.path.join(Region.downloadtop, 'validation.yaml')))
+
+class FakeYaml:
+    """Loads the same region whatever the file says."""
+    def __init__(self, myRegion):
+        self.myRegion = myRegion
+
+    def load(self, yamlfile):
+        return self.myRegion
+
+@unittest.skipIf(region == None, 'region needs suds, GDAL and pymclevel')
+class TestInitWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.yaml = region.yaml
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir(self.tempdir)
+        os.makedirs(os.path.join('Regions', 'Test'))
+        open(os.path.join('Regions', 'Test', 'Region.yaml'), 'w').close()
+        myRegion = FakeRegion()
+        myRegion.cachemax = 100
+        myRegion.warpmemory = 50
+        region.yaml = FakeYaml(myRegion)
+
+    def tearDown(self):
+        region.yaml = self.yaml
+        region.workerregion = None
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def test_memory_sizes(self):
+        # the sizes given to this run replace those stored with the region
+        region.initworker('Test', 1024, 512)
+        self.assertEqual(region.workerregion.cachemax, 1024)
+        self.assertEqual(region.workerregion.warpmemory, 512)
+
+class FakeBand:
+    def __init__(self, array):
+        self.array = array
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        return self.array[yoff:yoff+ysize, xoff:xoff+xsize].copy()
+
+    def WriteArray(self, array):
+        self.array[:array.shape[0], :array.shape[1]] = array
+
+    def GetNoDataValue(self):
+        return None
+
+class FakeDataset:
+    """A raster held in memory as a (band, row, column) array."""
+    def __init__(self, array, geotransform=None):
+        self.array = array
+        (self.RasterYSize, self.RasterXSize) = array.shape[1:]
+        self.geotransform = geotransform
+        self.projection = None
+
+    def GetRasterBand(self, band):
+        return FakeBand(self.array[band-1])
+
+    def GetGeoTransform(self):
+        return self.geotransform
+
+    def SetGeoTransform(self, geotransform):
+        self.geotransform = list(geotransform)
+
+    def SetProjection(self, projection):
+        self.projection = projection
+
+class FakeDriver:
+    def __init__(self, gdal):
+        self.gdal = gdal
+
+    def Create(self, name, xsize, ysize, bands, datatype):
+        # the file exists on disk so the tile is found next time
+        open(name, 'w').close()
+        self.gdal.datasets[name] = FakeDataset(numpy.zeros((bands, ysize, xsize), dtype=numpy.int16))
+        return self.gdal.datasets[name]
+
+class FakeGdal:
+    """Datasets by name, in memory."""
+    def __init__(self):
+        self.datasets = {}
+
+    def Open(self, name, mode):
+        return self.datasets.get(name)
+
+    def GetDriverByName(self, name):
+        return FakeDriver(self)
+
+class FakeSpatialReference:
+    def ImportFromProj4(self, proj4):
+        self.proj4 = proj4
+
+    def ExportToWkt(self):
+        return self.proj4
+
+class FakeOsr:
+    SpatialReference = FakeSpatialReference
+
+if region != None:
+    class FakePrepRegion(Region):
+        """A tiny region at one meter per pixel."""
+        def __init__(self, regiondir):
+            self.name = 'Test'
+            self.regiondir = regiondir
+            self.mapsdir = regiondir
+            self.t_srs = '+proj=utm +zone=19 +datum=NAD83'
+            self.lclayer = 'XXX'
+            self.scale = 1
+            self.maxdepth = 2
+            self.trim = 0
+            self.vscale = 1
+            self.sealevel = 64
+            self.utmextents = { 'landcover': { 'xmin': -2, 'xmax': 22, 'ymin': -2, 'ymax': 22 } }
+
+@unittest.skipIf(region == None, 'region needs suds, GDAL and pymclevel')
+class TestPrepTile(unittest.TestCase):
+
+    size = 20
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.gdal = region.gdal
+        self.osr = region.osr
+        self.getBathy = region.getBathy
+        region.gdal = FakeGdal()
+        region.osr = FakeOsr()
+        region.getBathy = lambda deptharray, maxdepth, geotrans, projection: \
+            numpy.zeros((deptharray.shape[0]-2*maxdepth, deptharray.shape[1]-2*maxdepth), dtype=numpy.int16)
+        region.workerregion = FakePrepRegion(self.tempdir)
+        rng = numpy.random.RandomState(1)
+        border = self.size + 2 * region.workerregion.maxdepth
+        region.gdal.datasets['el.tif'] = FakeDataset(rng.randint(0, 50, (1, self.size, self.size)))
+        region.gdal.datasets['oi.tif'] = FakeDataset(rng.randint(1, 256, (4, self.size, self.size)))
+        region.gdal.datasets[os.path.join(self.tempdir, 'XXX.tif')] = \
+            FakeDataset(rng.choice([11, 41], (1, border, border)), [-2, 1, 0, 22, 0, -1])
+
+    def tearDown(self):
+        region.gdal = self.gdal
+        region.osr = self.osr
+        region.getBathy = self.getBathy
+        region.workerregion = None
+        shutil.rmtree(self.tempdir)
+
+    def build(self, elgeoxform, recorded):
+        border = self.size + 2 * region.workerregion.maxdepth
+        args = (klogger(klog_levels.LOG_ERROR), 'Test', 0, 0, self.size, self.size, [0, border, 0, border], \
+                [-2, 1, 0, 22, 0, -1], elgeoxform, 'el.tif', 'oi.tif', False, recorded, False)
+        return region.buildmaptile(args)
+
+    def test_origin_shift(self):
+        # extending the region west and north moves the tile's origin
+        # while every input window stays the same
+        (tilex, tiley, tilename, digests, stale) = self.build([100, 1, 0, 200, 0, -1], {})
+        self.assertEqual(region.gdal.datasets[tilename].GetGeoTransform(), [100, 1, 0, 200, 0, -1])
+        (tilex, tiley, tilename, digests, stale) = self.build([90, 1, 0, 210, 0, -1], digests)
+        self.assertEqual(stale, sorted(digests.keys()))
+        self.assertEqual(region.gdal.datasets[tilename].GetGeoTransform(), [90, 1, 0, 210, 0, -1])
+        # the same origin again leaves the tile alone
+        (tilex, tiley, tilename, digests, stale) = self.build([90, 1, 0, 210, 0, -1], digests)
+        self.assertEqual(stale, [])
+
+    def test_update_places_tile(self):
+        # a tile which is only updated is placed again
+        (tilex, tiley, tilename, digests, stale) = self.build([100, 1, 0, 200, 0, -1], {})
+        region.gdal.datasets[tilename].SetGeoTransform([0, 1, 0, 0, 0, -1])
+        recorded = dict(digests)
+        recorded['ortho'] = None
+        (tilex, tiley, tilename, digests, stale) = self.build([100, 1, 0, 200, 0, -1], recorded)
+        self.assertEqual(stale, ['ortho'])
+        self.assertEqual(region.gdal.datasets[tilename].GetGeoTransform(), [100, 1, 0, 200, 0, -1])
+
+if __name__ == '__main__':
+    unittest.main()
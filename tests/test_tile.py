@@ -0,0 +1,164 @@
+# tests for tile module
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from klogger import klogger, klog_levels
+
+try:
+    import tile
+    from tile import Tile
+    from region import Region
+    from terrain import Terrain
+    from pymclevel import mclevel
+except ImportError:
+    tile = None
+
+class FakeRegion:
+    """Just the parts of a region a tile looks at."""
+    def __init__(self, regiondir, size, numtiles):
+        self.name = 'Test'
+        self.tilesize = size
+        self.regiondir = regiondir
+        self.mapname = os.path.join(regiondir, 'Map.vrt')
+        self.storename = os.path.join(regiondir, 'Map.npy')
+        self.tiles = { 'xmin': 0, 'xmax': numtiles, 'ymin': 0, 'ymax': numtiles }
+        self.doOre = True
+        self.doSchematics = False
+
+@unittest.skipIf(tile == None, 'tile needs GDAL and pymclevel')
+class TestEngines(unittest.TestCase):
+
+    size = 64
+    numtiles = 2
+
+    def setUp(self):
+        self.regiondir = tempfile.mkdtemp()
+        self.region = FakeRegion(self.regiondir, self.size, self.numtiles)
+        # patches of every landcover class with some noise
+        rng = numpy.random.RandomState(1)
+        full = self.size * self.numtiles
+        lcvals = numpy.array(sorted(Terrain.terdict.keys()))
+        lcarray = numpy.kron(lcvals[rng.randint(0, len(lcvals), (full // 8, full // 8))], numpy.ones((8, 8), dtype=int))
+        noise = rng.random_sample((full, full)) < 0.1
+        lcarray[noise] = lcvals[rng.randint(0, len(lcvals), noise.sum())]
+        iswater = (lcarray == 11)
+        bands = { 'landcover': lcarray,
+                  'elevation': numpy.where(iswater, 64, rng.randint(64, 100, (full, full))),
+                  'bathy': numpy.where(iswater, rng.randint(1, 10, (full, full)), 0),
+                  'crust': rng.randint(1, 6, (full, full)),
+                  'orthor': rng.randint(0, 256, (full, full)),
+                  'orthog': rng.randint(0, 256, (full, full)),
+                  'orthob': rng.randint(0, 256, (full, full)),
+                  'orthoir': rng.randint(0, 256, (full, full)) }
+        store = numpy.zeros((self.numtiles, self.numtiles, self.size, self.size, len(Region.rasters)), dtype=numpy.int16)
+        for bandname in bands:
+            for ty in xrange(self.numtiles):
+                for tx in xrange(self.numtiles):
+                    store[ty, tx, :, :, Region.rasters[bandname]-1] = \
+                        bands[bandname][ty*self.size:(ty+1)*self.size, tx*self.size:(tx+1)*self.size]
+        numpy.save(self.region.storename, store)
+        self.placetreesintile = tile.Tree.placetreesintile
+
+    def tearDown(self):
+        tile.Tree.placetreesintile = staticmethod(self.placetreesintile)
+        shutil.rmtree(self.regiondir)
+
+    def build(self, engine, tilex, tiley):
+        """Build a tile, returning its chunks, trees and peak."""
+        planted = []
+        def placetreesintile(myTile, trees):
+            planted.extend(trees)
+            self.placetreesintile(myTile, trees)
+        tile.Tree.placetreesintile = staticmethod(placetreesintile)
+        myTile = Tile(self.region, tilex, tiley, engine)
+        myTile.log = klogger(klog_levels.LOG_ERROR)
+        peak = myTile()
+        world = mclevel.MCInfdevOldLevel(myTile.tiledir, create=False)
+        chunks = dict([(chunkpos, (world.getChunk(*chunkpos).Blocks.copy(), world.getChunk(*chunkpos).Data.copy())) \
+                       for chunkpos in world.allChunks])
+        return (chunks, sorted(planted), peak)
+
+    def test_engines_agree(self):
+        for (tilex, tiley) in [(0, 0), (1, 1)]:
+            (columnchunks, columntrees, columnpeak) = self.build('column', tilex, tiley)
+            (arraychunks, arraytrees, arraypeak) = self.build('array', tilex, tiley)
+            self.assertEqual(sorted(columnchunks.keys()), sorted(arraychunks.keys()))
+            for chunkpos in columnchunks:
+                self.assertTrue((columnchunks[chunkpos][0] == arraychunks[chunkpos][0]).all(), 'blocks differ in chunk %s' % (chunkpos,))
+                self.assertTrue((columnchunks[chunkpos][1] == arraychunks[chunkpos][1]).all(), 'data differ in chunk %s' % (chunkpos,))
+            self.assertTrue(len(columntrees) > 0)
+            self.assertEqual(columntrees, arraytrees)
+            self.assertEqual(columnpeak, arraypeak)
+
+class FakeBand:
+    def __init__(self, array):
+        self.array = array
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        return self.array[yoff:yoff+ysize, xoff:xoff+xsize].copy()
+
+class FakeDataset:
+    """A map file held in memory as a (band, row, column) array."""
+    def __init__(self, array):
+        self.array = array
+        (self.RasterYSize, self.RasterXSize) = array.shape[1:]
+
+    def GetRasterBand(self, band):
+        return FakeBand(self.array[band-1])
+
+class FakeGdal:
+    def __init__(self, array):
+        self.array = array
+
+    def Open(self, name, mode):
+        return FakeDataset(self.array)
+
+@unittest.skipIf(tile == None, 'tile needs GDAL and pymclevel')
+class TestReadBands(unittest.TestCase):
+
+    size = 64
+    numtiles = 2
+
+    def setUp(self):
+        self.regiondir = tempfile.mkdtemp()
+        self.gdal = tile.gdal
+        # the map is narrower than the grid of tiles and runs past its bottom
+        rng = numpy.random.RandomState(1)
+        full = self.size * self.numtiles
+        self.array = rng.randint(1, 100, (len(Region.rasters), full + 12, full - 8)).astype(numpy.int16)
+        tile.gdal = FakeGdal(self.array)
+
+    def tearDown(self):
+        tile.gdal = self.gdal
+        shutil.rmtree(self.regiondir)
+
+    def buildstore(self, region):
+        """Store the map as Region.buildstore does."""
+        store = numpy.zeros((self.numtiles, self.numtiles, self.size, self.size, len(Region.rasters)), dtype=numpy.int16)
+        grid = numpy.zeros((len(Region.rasters), self.numtiles * self.size, self.numtiles * self.size), dtype=numpy.int16)
+        rows = min(grid.shape[1], self.array.shape[1])
+        cols = min(grid.shape[2], self.array.shape[2])
+        grid[:, :rows, :cols] = self.array[:, :rows, :cols]
+        for ty in xrange(self.numtiles):
+            for tx in xrange(self.numtiles):
+                store[ty, tx] = grid[:, ty*self.size:(ty+1)*self.size, tx*self.size:(tx+1)*self.size].transpose(1, 2, 0)
+        numpy.save(region.storename, store)
+
+    def test_modes_agree(self):
+        # the same tile gets the same bands whether the region was streamed or stored
+        mapregion = FakeRegion(self.regiondir, self.size, self.numtiles)
+        mapregion.storename = os.path.join(self.regiondir, 'Missing.npy')
+        storeregion = FakeRegion(self.regiondir, self.size, self.numtiles)
+        self.buildstore(storeregion)
+        halo = tile.Tree.treeWidth
+        for (tilex, tiley) in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+            (mapbands, mapinside) = Tile(mapregion, tilex, tiley).readbands(halo)
+            (storebands, storeinside) = Tile(storeregion, tilex, tiley).readbands(halo)
+            self.assertTrue((mapinside == storeinside).all(), 'inside differs in tile %dx%d' % (tilex, tiley))
+            for (mapband, storeband) in zip(mapbands, storebands):
+                self.assertTrue((mapband == storeband).all(), 'bands differ in tile %dx%d' % (tilex, tiley))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# tests for utmll module
+import unittest
+import numpy
+import utmll
+
+try:
+    from region import Region
+except ImportError:
+    Region = None
+
+# (lat, lon) and (easting, northing, zone number, zone letter) to the meter
+known = [ ((50.77535, 6.08389), (294409, 5628898, 32, 'U')),    # Aachen
+          ((40.71435, -74.00597), (583960, 4507523, 18, 'T')),  # New York
+          ((-41.28646, 174.77624), (313784, 5427057, 60, 'G')), # Wellington
+          ((-33.92487, 18.42406), (261878, 6243186, 34, 'H')),  # Cape Town
+          ((-32.89018, -68.84405), (514586, 6360877, 19, 'H')), # Mendoza
+          ((64.83778, -147.71639), (466013, 7190568, 6, 'W')),  # Fairbanks
+          ((56.79680, -5.00601), (377486, 6296562, 30, 'V')),   # Ben Nevis
+          ((60.0, 5.0), (276980, 6658157, 32, 'V')),            # Norway's zone 32
+          ((0.0, -72.0), (166021, 0, 19, 'N')) ]                # zone 18/19 boundary
+
+class TestUtmll(unittest.TestCase):
+
+    def test_known(self):
+        for ((lat, lon), (easting, northing, zone, letter)) in known:
+            (myeasting, mynorthing, myzone, myletter) = utmll.from_latlon(lat, lon)
+            self.assertEqual((myzone, myletter), (zone, letter))
+            self.assertAlmostEqual(myeasting, easting, delta=1)
+            self.assertAlmostEqual(mynorthing, northing, delta=1)
+            (mylat, mylon) = utmll.to_latlon(easting, northing, zone, letter)
+            self.assertAlmostEqual(mylat, lat, delta=1e-5)
+            self.assertAlmostEqual(mylon, lon, delta=1e-5)
+
+    def test_arrays(self):
+        # points in one zone convert together as they do one at a time
+        points = [point for (point, utm) in known if utm[2] == 32]
+        (eastings, northings, zone, letter) = utmll.from_latlon([lat for (lat, lon) in points], [lon for (lat, lon) in points], 32)
+        for index, (lat, lon) in enumerate(points):
+            (easting, northing, dummy, dummy) = utmll.from_latlon(lat, lon)
+            self.assertAlmostEqual(eastings[index], easting, places=6)
+            self.assertAlmostEqual(northings[index], northing, places=6)
+
+    def test_force_zone_number(self):
+        # the boundary is the eastern edge of zone 18
+        (easting, northing, zone, letter) = utmll.from_latlon(0.0, -72.0, 18)
+        self.assertEqual(zone, 18)
+        self.assertAlmostEqual(easting, 833979, delta=1)
+        self.assertAlmostEqual(northing, 0, delta=1)
+        (lat, lon) = utmll.to_latlon(easting, northing, 18, northern=True)
+        self.assertAlmostEqual(lat, 0.0, delta=1e-5)
+        self.assertAlmostEqual(lon, -72.0, delta=1e-5)
+        # New York projected one zone east
+        (easting, northing, zone, letter) = utmll.from_latlon(40.71435, -74.00597, 19)
+        self.assertEqual(zone, 19)
+        (lat, lon) = utmll.to_latlon(easting, northing, 19, northern=True, strict=False)
+        self.assertAlmostEqual(lat, 40.71435, delta=1e-5)
+        self.assertAlmostEqual(lon, -74.00597, delta=1e-5)
+
+if Region != None:
+    class FakeRegion(Region):
+        """A region with only its zone set."""
+        def __init__(self, zone):
+            self.zone = zone
+
+@unittest.skipIf(Region == None, 'region needs suds, GDAL and pymclevel')
+class TestRegionConversions(unittest.TestCase):
+
+    def test_known(self):
+        for ((lat, lon), (easting, northing, zone, letter)) in known:
+            myRegion = FakeRegion(zone)
+            (eastings, northings) = myRegion.fromlatlon(numpy.array([lat]), numpy.array([lon]))
+            # the region's northings are signed rather than offset in the south
+            if lat < 0:
+                northing -= 10000000
+            self.assertAlmostEqual(eastings[0], easting, delta=1)
+            self.assertAlmostEqual(northings[0], northing, delta=1)
+            (lats, lons) = myRegion.tolatlon(eastings, northings)
+            self.assertAlmostEqual(lats[0], lat, delta=1e-5)
+            self.assertAlmostEqual(lons[0], lon, delta=1e-5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,22 +5,33 @@
 from __future__ import division
 import yaml
 from region import Region
+from buildgraph import BuildGraph
 import os
 from itertools import product
+import numpy
 
-from utils import cleanmkdir, setspawnandsave
+from utils import cleanmkdir, setspawnandsave, tileseed
 from osgeo import gdal
 from osgeo.gdalconst import GA_ReadOnly
 
 from pymclevel import mclevel, box
 from terrain import Terrain
-from tree import Tree, treeObjs
+from tree import Tree
 from ore import Ore
 
 class Tile:
     """Tiles are the base render object.  or something."""
 
-    def __init__(self, region, tilex, tiley):
+    # terrain engines
+    # column: each column is copied from its compiled template
+    # array: columns are built once per group of alike columns
+    #        and whole chunk arrays are filled at once
+    engines = ['column', 'array']
+
+    # modules whose code decides what a tile contains
+    modules = ['tile', 'terrain', 'tree', 'ore', 'schematic', 'utils']
+
+    def __init__(self, region, tilex, tiley, engine='column'):
         """Create a tile based on the region and the tile's coordinates."""
         # NB: smart people check that files have been gotten.
         # today we assume that's already been done.
@@ -28,52 +39,55 @@ class Tile:
         self.name = region.name
         self.size = region.tilesize
         self.mapname = region.mapname
+        self.storename = region.storename
         self.tilex = int(tilex)
         self.tiley = int(tiley)
         self.tiles = region.tiles
         self.doOre = region.doOre
         self.doSchematics = region.doSchematics
 
+        if engine not in Tile.engines:
+            raise AttributeError, "engine (%s) must be one of %s" % (engine, ', '.join(Tile.engines))
+        self.engine = engine
+
         if (self.tilex < self.tiles['xmin']) or (self.tilex >= self.tiles['xmax']):
             raise AttributeError, "tilex (%d) must be between %d and %d" % (self.tilex, self.tiles['xmin'], self.tiles['xmax'])
         if (self.tiley < self.tiles['ymin']) or (self.tiley >= self.tiles['ymax']):
             raise AttributeError, "tiley (%d) must be between %d and %d" % (self.tiley, self.tiles['ymin'], self.tiles['ymax'])
 
-        # create the tile directory if necessary
         self.tiledir = os.path.join(region.regiondir, 'Tiles', '%dx%d' % (self.tilex, self.tiley))
-        self.skip = False
-        if os.path.isfile(os.path.join(self.tiledir, 'Tile.yaml')):
-            self.skip = True
-        else:
-            cleanmkdir(self.tiledir)
 
-    def __call__(self):
-        """Actually build the Minecraft world that corresponds to a tile."""
+    def __call__(self, recorded=None, dryrun=False):
+        """Actually build the Minecraft world that corresponds to a tile.
 
-        if self.skip == True:
-            self.log.log_info("Skipping extant tile %dx%d" % (self.tilex, self.tiley))
-            self.world = mclevel.MCInfdevOldLevel(self.tiledir)
-            peak = self.world.playerSpawnPosition()
-            self.peak = peak[1] - 2
-            del self.world
-            return self.peak
+        The tile is only built if the digest of its inputs differs from
+        recorded.  If dryrun is True, it is never built.  Sets self.digest
+        and self.built, which is True if the tile is (or would be) built,
+        and returns the peak.  The peak of a current tile is that of its
+        last build."""
 
-        # calculate offsets
-        ox = (self.tilex-self.tiles['xmin'])*self.size
-        oy = (self.tiley-self.tiles['ymin'])*self.size
-        sx = self.size
-        sy = self.size
-
-        # load arrays from map file
-        mapds = gdal.Open(self.mapname, GA_ReadOnly)
-        lcarray = mapds.GetRasterBand(Region.rasters['landcover']).ReadAsArray(ox, oy, sx, sy)
-        elarray = mapds.GetRasterBand(Region.rasters['elevation']).ReadAsArray(ox, oy, sx, sy)
-        bathyarray = mapds.GetRasterBand(Region.rasters['bathy']).ReadAsArray(ox, oy, sx, sy)
-        crustarray = mapds.GetRasterBand(Region.rasters['crust']).ReadAsArray(ox, oy, sx, sy)
-        orthor = mapds.GetRasterBand(Region.rasters['orthor']).ReadAsArray(ox, oy, sx, sy)
-        orthog = mapds.GetRasterBand(Region.rasters['orthog']).ReadAsArray(ox, oy, sx, sy)
-        orthob = mapds.GetRasterBand(Region.rasters['orthob']).ReadAsArray(ox, oy, sx, sy)
-        orthoir = mapds.GetRasterBand(Region.rasters['orthoir']).ReadAsArray(ox, oy, sx, sy)
+        # trees rooted in the halo around the tile reach into it
+        halo = Tree.treeWidth
+        (halobands, inside) = self.readbands(halo)
+        core = (slice(halo, halo+self.size), slice(halo, halo+self.size))
+        bands = [band[core] for band in halobands]
+        (lcarray, elarray, bathyarray, crustarray, orthor, orthog, orthob, orthoir) = bands
+
+        # the tile is current if its inputs are unchanged
+        seed = tileseed(self.name, self.tilex, self.tiley)
+        self.digest = BuildGraph.digest(BuildGraph.codeversion(Tile.modules), self.size, \
+                                        self.doOre, self.doSchematics, self.engine, seed, inside, *halobands)
+        tileyaml = os.path.join(self.tiledir, 'Tile.yaml')
+        self.built = self.digest != recorded or not os.path.isfile(tileyaml)
+        if dryrun:
+            self.peak = None
+            return self.peak
+        if not self.built:
+            # reuse the results of the last build
+            self.log.log_info("Skipping current tile %dx%d" % (self.tilex, self.tiley))
+            self.peak = Tile.loadresults(self.tiledir)
+            return self.peak
+        cleanmkdir(self.tiledir)
 
         # calculate Minecraft corners
         self.mcoffsetx = self.tilex * self.size
@@ -86,9 +100,146 @@ class Tile:
 
         # do the terrain thing (no trees, ore or building)
         self.peak = [0, 0, 0]
-        treeobjs = dict([(tree.name, tree) for tree in treeObjs])
-        self.trees = dict([(name, list()) for name in treeobjs])
 
+        halodraws = self.readdraws(halo)
+        halodecisions = Terrain.decide(halobands[0], halodraws)
+        draws = dict([(name, halodraws[name][core]) for name in halodraws])
+        decisions = [decision[core] for decision in halodecisions]
+
+        if self.engine == 'array':
+            trees = self.arrayterrain(bands, draws, decisions)
+        else:
+            trees = self.columnterrain(bands, draws, decisions)
+
+        # plant every tree that reaches into the tile, including those
+        # rooted in the halo, after the terrain they stand on
+        trees += self.halotrees(halo, halobands, inside, halodraws, halodecisions)
+        Tree.placetreesintile(self, trees)
+
+        # now that terrain and trees are done, place ore and replace
+        # all 'end stone' with stone in one pass over each chunk
+        Ore.placeoreintile(self)
+
+        # stick the player and the spawn at the peak
+        setspawnandsave(self.world, self.peak)
+
+        # write the results, then Tile.yaml to mark the tile complete
+        del self.world
+        self.saveresults()
+        stream = file(tileyaml, 'w')
+        yaml.dump({'tile': '%dx%d' % (self.tilex, self.tiley), 'digest': self.digest, 'status': 'complete'}, stream)
+        stream.close()
+
+        # return peak
+        return self.peak
+
+    def readbands(self, halo):
+        """Read every band of the tile with a border of halo columns.
+
+        Returns the bands, each (size+2*halo) square and indexed [z, x],
+        and a boolean array marking the columns which lie on the map.
+        The map is the region's grid of tiles whether it is read from the
+        store or the map file, and columns the map file lacks are zero."""
+        full = self.size + 2 * halo
+        bandnames = ['landcover', 'elevation', 'bathy', 'crust', 'orthor', 'orthog', 'orthob', 'orthoir']
+        bands = [numpy.zeros((full, full), dtype=numpy.int16) for bandname in bandnames]
+        inside = numpy.zeros((full, full), dtype=bool)
+        # window corner in map coordinates
+        wx = (self.tilex-self.tiles['xmin'])*self.size - halo
+        wy = (self.tiley-self.tiles['ymin'])*self.size - halo
+
+        # load arrays from the store if there is one, otherwise the map file
+        if os.path.isfile(self.storename):
+            # one contiguous block holds every band of a tile
+            store = numpy.load(self.storename, mmap_mode='r')
+            (numtilesy, numtilesx) = store.shape[:2]
+            for ty, tx in product(xrange(max(wy, 0) // self.size, min((wy + full - 1) // self.size + 1, numtilesy)), \
+                                  xrange(max(wx, 0) // self.size, min((wx + full - 1) // self.size + 1, numtilesx))):
+                x0 = max(wx, tx * self.size)
+                x1 = min(wx + full, (tx + 1) * self.size)
+                y0 = max(wy, ty * self.size)
+                y1 = min(wy + full, (ty + 1) * self.size)
+                block = store[ty, tx, y0-ty*self.size:y1-ty*self.size, x0-tx*self.size:x1-tx*self.size]
+                for index, bandname in enumerate(bandnames):
+                    bands[index][y0-wy:y1-wy, x0-wx:x1-wx] = block[:, :, Region.rasters[bandname]-1]
+                inside[y0-wy:y1-wy, x0-wx:x1-wx] = True
+        else:
+            # the store covers the grid of tiles, so the map file is
+            # clipped to it and anything the map file lacks stays zero
+            x0 = max(wx, 0)
+            x1 = min(wx + full, (self.tiles['xmax'] - self.tiles['xmin']) * self.size)
+            y0 = max(wy, 0)
+            y1 = min(wy + full, (self.tiles['ymax'] - self.tiles['ymin']) * self.size)
+            mapds = gdal.Open(self.mapname, GA_ReadOnly)
+            readx1 = min(x1, mapds.RasterXSize)
+            ready1 = min(y1, mapds.RasterYSize)
+            if readx1 > x0 and ready1 > y0:
+                for index, bandname in enumerate(bandnames):
+                    bands[index][y0-wy:ready1-wy, x0-wx:readx1-wx] = \
+                        mapds.GetRasterBand(Region.rasters[bandname]).ReadAsArray(x0, y0, readx1-x0, ready1-y0)
+            inside[y0-wy:y1-wy, x0-wx:x1-wx] = True
+            mapds = None
+        return (bands, inside)
+
+    def readdraws(self, halo):
+        """Return the random draws of the tile's columns and its halo.
+
+        Each column takes its draws from the stream of the tile it lies
+        in, so the same column gets the same draws from every tile."""
+        full = self.size + 2 * halo
+        draws = dict([(name, numpy.zeros((full, full))) for name in Terrain.drawnames])
+        for ty, tx in product(xrange(self.tiley-1, self.tiley+2), xrange(self.tilex-1, self.tilex+2)):
+            # the neighbour's corner in window coordinates
+            x0 = (tx - self.tilex) * self.size + halo
+            y0 = (ty - self.tiley) * self.size + halo
+            if x0 >= full or y0 >= full or x0 + self.size <= 0 or y0 + self.size <= 0:
+                continue
+            tiledraws = Terrain.draws(numpy.random.RandomState(tileseed(self.name, tx, ty)), (self.size, self.size))
+            window = (slice(max(y0, 0), min(y0 + self.size, full)), slice(max(x0, 0), min(x0 + self.size, full)))
+            tilewindow = (slice(max(-y0, 0), min(full - y0, self.size)), slice(max(-x0, 0), min(full - x0, self.size)))
+            for name in draws:
+                draws[name][window] = tiledraws[name][tilewindow]
+        return draws
+
+    def halotrees(self, halo, bands, inside, draws, decisions):
+        """Return the trees rooted in the halo around the tile."""
+        (lcarray, elarray, bathyarray, crustarray, orthor, orthog, orthob, orthoir) = bands
+        (stone, tree, plant) = decisions
+        trees = []
+        full = self.size + 2 * halo
+        for wx, wz in product(xrange(full), xrange(full)):
+            if (halo <= wx < halo + self.size and halo <= wz < halo + self.size) or not inside[wz, wx]:
+                continue
+            mcx = int(self.mcoffsetx+wx-halo)
+            mcz = int(self.mcoffsetz+wz-halo)
+            mcy = int(elarray[wz, wx])
+            decision = (stone[wz, wx], tree[wz, wx], plant[wz, wx])
+            (y, template, ortho, coltree) = Terrain.column(mcx, mcy, mcz, int(lcarray[wz, wx]), int(crustarray[wz, wx]), \
+                                                           int(bathyarray[wz, wx]), self.doSchematics, int(orthor[wz, wx]), \
+                                                           int(orthog[wz, wx]), int(orthob[wz, wx]), int(orthoir[wz, wx]), decision)
+            if coltree:
+                trees.append((coltree, mcx, mcy, mcz, draws['treeheight'][wz, wx]))
+        return trees
+
+    def saveresults(self):
+        """Store the peak as an int32 array in Tile.npz."""
+        resultfile = open(os.path.join(self.tiledir, 'Tile.npz'), 'wb')
+        numpy.savez(resultfile, peak=numpy.array(self.peak, dtype=numpy.int32))
+        resultfile.close()
+
+    @staticmethod
+    def loadresults(tiledir):
+        """Return the peak stored by saveresults."""
+        results = numpy.load(os.path.join(tiledir, 'Tile.npz'))
+        peak = results['peak'].tolist()
+        results.close()
+        return peak
+
+    def columnterrain(self, bands, draws, decisions):
+        """Place terrain one column at a time and return the trees to plant."""
+        (lcarray, elarray, bathyarray, crustarray, orthor, orthog, orthob, orthoir) = bands
+        (stone, tree, plant) = decisions
+        trees = []
         for myx, myz in product(xrange(self.size), xrange(self.size)):
             mcx = int(self.mcoffsetx+myx)
             mcz = int(self.mcoffsetz+myz)
@@ -102,34 +253,60 @@ class Tile:
             irval = int(orthoir[myz, myx])
             if mcy > self.peak[1]:
                 self.peak = [mcx, mcy, mcz]
-            (blocks, datas, tree) = Terrain.place(mcx, mcy, mcz, lcval, crustval, bathyval, self.doSchematics, rval, gval, bval, irval)
-            [ self.world.setBlockAt(mcx, y, mcz, block) for (y, block) in blocks if block != 0 ]
-            [ self.world.setBlockDataAt(mcx, y, mcz, data) for (y, data) in datas if data != 0 ]
+            decision = (stone[myz, myx], tree[myz, myx], plant[myz, myx])
+            (y, template, ortho, coltree) = Terrain.column(mcx, mcy, mcz, lcval, crustval, bathyval, self.doSchematics, rval, gval, bval, irval, decision)
+            chunk = self.world.getChunk(mcx >> 4, mcz >> 4)
+            Terrain.fill(chunk.Blocks[mcx & 0xf, mcz & 0xf], chunk.Data[mcx & 0xf, mcz & 0xf], y, template, ortho)
+            chunk.dirty = True
+
+            if coltree:
+                trees.append((coltree, mcx, mcy, mcz, draws['treeheight'][myz, myx]))
+        return trees
 
-            # if trees are placed, elevation cannot be changed
-            if tree:
-                Tree.placetreeintile(self, tree, mcx, mcy, mcz)
+    def arrayterrain(self, bands, draws, decisions):
+        """Place terrain by filling whole chunk arrays at once and return the trees to plant."""
+        # columns are indexed [x, z] like chunk arrays
+        (lcarray, elarray, bathyarray, crustarray, orthor, orthog, orthob, orthoir) = [band.T for band in bands]
+        (xs, zs) = numpy.mgrid[0:self.size, 0:self.size]
+        mcx = xs + self.mcoffsetx
+        mcz = zs + self.mcoffsetz
+        (runs, ortho, trees) = Terrain.columns(mcx, elarray, mcz, lcarray, crustarray, bathyarray, self.doSchematics, \
+                                               orthor, orthog, orthob, orthoir, [decision.T for decision in decisions])
 
-        # now that terrain and trees are done, place ore
-        if self.doOre:
-            Ore.placeoreintile(self)
+        # the first highest column in the order columnterrain visits them
+        if elarray.max() > self.peak[1]:
+            (x, z) = numpy.unravel_index(elarray.argmax(), elarray.shape)
+            self.peak = [int(mcx[x, z]), int(elarray[x, z]), int(mcz[x, z])]
 
-        # replace all 'end stone' with stone
-        EndStoneID = self.world.materials["End Stone"].ID
-        StoneID = self.world.materials["Stone"].ID
+        # runs do not overlap, so each column of a chunk is the running
+        # sum of the changes in block and data where runs begin and end
+        height = self.world.Height
         for xpos, zpos in self.world.allChunks:
             chunk = self.world.getChunk(xpos, zpos)
-            chunk.Blocks[chunk.Blocks == EndStoneID] = StoneID
-
-        # stick the player and the spawn at the peak
-        setspawnandsave(self.world, self.peak)
+            window = (slice(xpos * 16 - self.mcoffsetx, (xpos + 1) * 16 - self.mcoffsetx), \
+                      slice(zpos * 16 - self.mcoffsetz, (zpos + 1) * 16 - self.mcoffsetz))
+            blocks = numpy.zeros((16, 16, height+1), dtype=numpy.int16)
+            datas = numpy.zeros((16, 16, height+1), dtype=numpy.int16)
+            for run in runs:
+                (lo, hi, block, data) = [array[window] for array in run]
+                lo = numpy.clip(lo, 0, height)
+                hi = numpy.clip(hi, 0, height)
+                (x, z) = numpy.nonzero(hi > lo)
+                (lo, hi, block, data) = (lo[x, z], hi[x, z], block[x, z], data[x, z])
+                blocks[x, z, lo] += block
+                blocks[x, z, hi] -= block
+                datas[x, z, lo] += data
+                datas[x, z, hi] -= data
+            chunk.Blocks[:] = blocks.cumsum(axis=2, dtype=numpy.int16)[:, :, :height]
+            chunk.Data[:] = datas.cumsum(axis=2, dtype=numpy.int16)[:, :, :height]
+            if ortho is not None:
+                (top, block, data, mask) = [array[window] for array in ortho]
+                (x, z) = numpy.nonzero(mask & (top < height))
+                chunk.Blocks[x, z, top[x, z]] = block[x, z]
+                chunk.Data[x, z, top[x, z]] = data[x, z]
+            chunk.dirty = True
 
-        # write Tile.yaml with relevant data (peak at least)
-        # NB: world is not dump-friendly. :-)
-        del self.world
-        stream = file(os.path.join(self.tiledir, 'Tile.yaml'), 'w')
-        yaml.dump(self, stream)
-        stream.close()
-
-        # return peak
-        return self.peak
+        # trees in the order columnterrain finds them
+        (treexs, treezs) = numpy.nonzero(trees.astype(bool))
+        return [(trees[x, z], int(mcx[x, z]), int(elarray[x, z]), int(mcz[x, z]), draws['treeheight'][z, x]) \
+                for (x, z) in zip(treexs, treezs)]
@@ -2,7 +2,6 @@
 from __future__ import division
 from math import hypot
 import numpy
-from random import randint
 from itertools import product
 from utils import materialNamed
 
@@ -43,66 +42,105 @@ class Tree:
             self.heights = heights
         else:
             raise AttributeError, "heights array is not right: ", heights
+        # every height this tree can have is baked once
+        self.stamps = dict([(height, self.bake(height)) for height in xrange(self.heights[0], self.heights[1]+1)])
 
-    # call routine places a tree in a particular location
-    def __call__(self, coords):
-        """Places tree in a particular location."""
-        # coords: [x, y, z]
-        # __call__ returns blocks, datas
-        # which are lists of x, y, z, value tuples
-        (x, base, z) = coords
-        height = randint(self.heights[0], self.heights[1])
-        leafbottom = base + self.heights[2]
-        maxleafheight = base + height + 1
-        leafheight = maxleafheight - leafbottom
+    def drawheight(self, draw):
+        """Turn a pre-drawn random value in [0, 1) into a tree height."""
+        return self.heights[0] + int(draw * (self.heights[1] - self.heights[0] + 1))
+
+    def bake(self, height):
+        """Build the voxel stamp of a tree of this height.
+
+        The stamp is (blocks, data, datamask) indexed [x, z, y] like chunk
+        arrays, with the trunk base at [treeWidth, treeWidth, 0].  Zero
+        blocks are left alone, as is data wherever datamask is False."""
+        width = Tree.treeWidth*2+1
+        blocks = numpy.zeros((width, width, height+1), dtype=numpy.uint8)
+        data = numpy.zeros((width, width, height+1), dtype=numpy.uint8)
         # cactus and sugarcane have no patterns
         if self.pattern == None:
-            blocks = [ (x, base+y, z, self.data) for y in xrange(height) ]
-            datas = []
+            blocks[Tree.treeWidth, Tree.treeWidth, :height] = materialNamed(self.data)
         else:
-            blocks = []
-            datas = []
-            lxzrange = xrange(Tree.leafDistance.shape[0])
-            lyrange = xrange(leafheight)
-            for leafx, leafz, leafy in product(lxzrange, lxzrange, lyrange):
-                myleafx = x+leafx-Tree.treeWidth
-                myleafy = leafbottom+leafy
-                myleafz = z+leafz-Tree.treeWidth
+            leafbottom = self.heights[2]
+            leafheight = height + 1 - leafbottom
+            for leafx, leafz, leafy in product(xrange(width), xrange(width), xrange(leafheight)):
                 if self.pattern(leafx, leafy, leafz, leafheight-1):
-                    blocks.append((myleafx, myleafy, myleafz, 'Leaves'))
-                    datas.append((myleafx, myleafy, myleafz, self.data))
-            for y in xrange(base,base+height):
-                blocks.append((x, y, z, 'Wood'))
-                datas.append((x, y, z, self.data))
-        return blocks, datas
+                    blocks[leafx, leafz, leafbottom+leafy] = materialNamed('Leaves')
+                    data[leafx, leafz, leafbottom+leafy] = self.data
+            blocks[Tree.treeWidth, Tree.treeWidth, :height] = materialNamed('Wood')
+            data[Tree.treeWidth, Tree.treeWidth, :height] = self.data
+        return (blocks, data, (blocks != 0) & (data != 0))
+
+    def chunks(self, coords):
+        """Return the chunks a tree at coords overlaps."""
+        (x, base, z) = coords[:3]
+        x0 = x - Tree.treeWidth
+        z0 = z - Tree.treeWidth
+        width = Tree.treeWidth*2+1
+        return list(product(xrange(x0 >> 4, ((x0 + width - 1) >> 4) + 1), \
+                            xrange(z0 >> 4, ((z0 + width - 1) >> 4) + 1)))
+
+    def paste(self, chunk, cx, cz, coords):
+        """Paste the part of a tree at [x, y, z, height] which falls in a chunk."""
+        (x, base, z, height) = coords
+        (blocks, data, datamask) = self.stamps[height]
+        x0 = x - Tree.treeWidth
+        z0 = z - Tree.treeWidth
+        (sizex, sizez, sizey) = blocks.shape
+        y0 = max(base, 0)
+        y1 = min(base + sizey, chunk.Blocks.shape[2])
+        if y0 >= y1:
+            return
+        lox = max(x0, cx << 4)
+        hix = min(x0 + sizex, (cx + 1) << 4)
+        loz = max(z0, cz << 4)
+        hiz = min(z0 + sizez, (cz + 1) << 4)
+        stampslice = (slice(lox - x0, hix - x0), slice(loz - z0, hiz - z0), slice(y0 - base, y1 - base))
+        chunkslice = (slice(lox & 0xf, ((hix - 1) & 0xf) + 1), slice(loz & 0xf, ((hiz - 1) & 0xf) + 1), slice(y0, y1))
+        mask = blocks[stampslice] != 0
+        chunk.Blocks[chunkslice][mask] = blocks[stampslice][mask]
+        mask = datamask[stampslice]
+        chunk.Data[chunkslice][mask] = data[stampslice][mask]
+        chunk.dirty = True
 
     @staticmethod
-    def placetreeintile(tile, tree, mcx, mcy, mcz):
-        coords = [mcx, mcy, mcz]
-        myx = tile.mcoffsetx - mcx
-        myz = tile.mcoffsetx - mcz
-        if (myx < Tree.treeWidth+1 or (tile.size-myx) < Tree.treeWidth+1 or
-            myz < Tree.treeWidth+1 or (tile.size-myz) < Tree.treeWidth+1):
-            # tree is too close to the edge, plant it later
-            try:
-                tile.trees[tree]
-            except KeyError:
-                tile.trees[tree] = []
-            tile.trees[tree].append(coords)
-        else:
-            # plant it now!
-            (blocks, datas) = treeObjs[tree](coords)
-            [ tile.world.setBlockAt(x, y, z, materialNamed(block)) for (x, y, z, block) in blocks if block != 'Air' ]
-            [ tile.world.setBlockDataAt(x, y, z, data) for (x, y, z, data) in datas if data != 0 ]
+    def bucket(trees):
+        """Group trees by the chunks they overlap.
+
+        trees is a list of (treeobj, [x, y, z, height]) in planting order.
+        Returns a dictionary of (cx, cz): [(treeobj, coords), ...] with
+        the trees of each chunk in that order."""
+        buckets = {}
+        for (treeobj, coords) in trees:
+            for chunkpos in treeobj.chunks(coords):
+                buckets.setdefault(chunkpos, []).append((treeobj, coords))
+        return buckets
+
+    @staticmethod
+    def placetreesinchunks(buckets, world):
+        """Plant bucketed trees, loading each chunk once."""
+        for (cx, cz) in buckets:
+            if world.containsChunk(cx, cz):
+                chunk = world.getChunk(cx, cz)
+                for (treeobj, coords) in buckets[(cx, cz)]:
+                    treeobj.paste(chunk, cx, cz, coords)
 
     @staticmethod
-    def placetreesinregion(trees, treeobjs, world):
-        for tree in trees:
-            coords = trees[tree]
-            for coord in coords:
-                (blocks, datas) = treeobjs[tree](coord)
-                [ world.setBlockAt(x, y, z, materialNamed(block)) for (x, y, z, block) in blocks if block != 'Air' ]
-                [ world.setBlockDataAt(x, y, z, data) for (x, y, z, data) in datas if data != 0 ]
+    def placetreesintile(tile, trees):
+        """Plant trees given as (tree, mcx, mcy, mcz, draw) in a tile.
+
+        Trees are planted in order of position so that where two trees
+        overlap, every tile they reach agrees on which one wins.  Parts
+        of trees outside the tile's chunks are left to the neighbours."""
+        # the height is drawn with the rest of the columns so that
+        # neighbouring tiles agree on it
+        treeobjs = dict([(treeobj.name, treeobj) for treeobj in treeObjs])
+        planted = []
+        for (tree, mcx, mcy, mcz, draw) in sorted(trees, key=lambda tree: (tree[1], tree[3])):
+            treeobj = treeobjs[tree]
+            planted.append((treeobj, [mcx, mcy, mcz, treeobj.drawheight(draw)]))
+        Tree.placetreesinchunks(Tree.bucket(planted), tile.world)
 
 treeObjs = [ 
     Tree('Cactus', None, 'Cactus', [3, 3, 3]), 
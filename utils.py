@@ -1,6 +1,7 @@
 # utils module
 import os, fnmatch
 import shutil
+import zlib
 from memoize import memoize
 from pymclevel.materials import alphaMaterials
 
@@ -33,6 +34,10 @@ def save(world):
     world.SizeOnDisk = sizeOnDisk
     world.saveInPlace()
 
+def tileseed(name, tilex, tiley):
+    """Returns the random seed for a tile of a region."""
+    return zlib.crc32('%s:%d:%d' % (name, tilex, tiley)) & 0xffffffff
+
 @memoize()
 def materialNamed(string):
     "Returns block ID for block with name given in string."
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 
 K0 = 0.9996
@@ -10,17 +11,20 @@ E_P2 = E / (1.0 - E)
 
 SQRT_E = math.sqrt(1 - E)
 _E = (1 - SQRT_E) / (1 + SQRT_E)
-_E3 = _E * _E * _E
+_E2 = _E * _E
+_E3 = _E2 * _E
 _E4 = _E3 * _E
+_E5 = _E4 * _E
 
 M1 = (1 - E / 4 - 3 * E2 / 64 - 5 * E3 / 256)
 M2 = (3 * E / 8 + 3 * E2 / 32 + 45 * E3 / 1024)
 M3 = (15 * E2 / 256 + 45 * E3 / 1024)
 M4 = (35 * E3 / 3072)
 
-P2 = (3 * _E / 2 - 27 * _E3 / 32)
-P3 = (21 * _E3 / 16 - 55 * _E4 / 32)
-P4 = (151 * _E3 / 96)
+P2 = (3 * _E / 2 - 27 * _E3 / 32 + 269 * _E5 / 512)
+P3 = (21 * _E2 / 16 - 55 * _E4 / 32)
+P4 = (151 * _E3 / 96 - 417 * _E5 / 128)
+P5 = (1097 * _E4 / 512)
 
 R = 6378137
 
@@ -34,45 +38,60 @@ ZONE_LETTERS = [
 ZONE_IDS_NORTH_BASE = 32600
 ZONE_IDS_SOUTH_BASE = 32700
 
-def to_latlon(easting, northing, zone_number, zone_letter):
-	zone_letter = zone_letter.upper()
 
-	if not 100000 <= easting < 1000000:
-		raise OutOfRangeError('easting out of range (must be between 100.000 m and 999.999 m)')
-	if not 0 <= northing <= 10000000:
-		raise OutOfRangeError('northing out of range (must be between 0 m and 10.000.000 m)')
+class OutOfRangeError(ValueError):
+	pass
+
+# easting and northing may be numpy arrays
+# give either zone_letter or northern; strict=False allows points outside the zone
+def to_latlon(easting, northing, zone_number, zone_letter=None, northern=None, strict=True):
+	if (zone_letter is None) == (northern is None):
+		raise ValueError('either zone_letter or northern must be given')
+
+	if zone_letter is not None:
+		zone_letter = zone_letter.upper()
+		if not 'C' <= zone_letter <= 'X' or zone_letter in ['I', 'O']:
+			raise OutOfRangeError('zone letter out of range (must be between C and X)')
+		northern = (zone_letter >= 'N')
+
+	easting = np.asarray(easting, dtype=np.float64)
+	northing = np.asarray(northing, dtype=np.float64)
+
+	if strict:
+		if not np.all((100000 <= easting) & (easting < 1000000)):
+			raise OutOfRangeError('easting out of range (must be between 100.000 m and 999.999 m)')
+		if not np.all((0 <= northing) & (northing <= 10000000)):
+			raise OutOfRangeError('northing out of range (must be between 0 m and 10.000.000 m)')
 	if not 1 <= zone_number <= 60:
 		raise OutOfRangeError('zone number out of range (must be between 1 and 60)')
-	if not 'C' <= zone_letter <= 'X' or zone_letter in ['I', 'O']:
-		raise OutOfRangeError('zone letter out of range (must be between C and X)')
 
 	x = easting - 500000
 	y = northing
 
-	if zone_letter < 'N':
-		y -= 10000000
+	if not northern:
+		y = y - 10000000
 
 	m = y / K0
 	mu = m / (R * M1)
 
-	p_rad = (mu + P2 * math.sin(2 * mu) + P3 * math.sin(4 * mu) + P4 * math.sin(6 * mu))
+	p_rad = (mu + P2 * np.sin(2 * mu) + P3 * np.sin(4 * mu) + P4 * np.sin(6 * mu) + P5 * np.sin(8 * mu))
 
-	p_sin = math.sin(p_rad)
+	p_sin = np.sin(p_rad)
 	p_sin2 = p_sin * p_sin
 
-	p_cos = math.cos(p_rad)
+	p_cos = np.cos(p_rad)
 
 	p_tan = p_sin / p_cos
 	p_tan2 = p_tan * p_tan
 	p_tan4 = p_tan2 * p_tan2
 
 	ep_sin = 1 - E * p_sin2
-	ep_sin_sqrt = math.sqrt(1 - E * p_sin2)
+	ep_sin_sqrt = np.sqrt(1 - E * p_sin2)
 
 	n = R / ep_sin_sqrt
 	r = (1 - E) / ep_sin
 
-	c = _E * p_cos**2
+	c = E_P2 * p_cos**2
 	c2 = c * c
 
 	d = x / (n * K0)
@@ -91,33 +110,41 @@ def to_latlon(easting, northing, zone_number, zone_letter):
 				 d3 / 6 * (1 + 2 * p_tan2 + c) +
 				 d5 / 120 * (5 - 2 * c + 28 * p_tan2 - 3 * c2 + 8 * E_P2 + 24 * p_tan4)) / p_cos
 
-	return (math.degrees(latitude),
-			math.degrees(longitude) + zone_number_to_central_longitude(zone_number))
+	return (np.degrees(latitude),
+			np.degrees(longitude) + zone_number_to_central_longitude(zone_number))
 
 
-def from_latlon(latitude, longitude):
-	if not -80.0 <= latitude <= 84.0:
+# latitude and longitude may be numpy arrays
+# points are projected into force_zone_number if given, otherwise the zone of their centre
+def from_latlon(latitude, longitude, force_zone_number=None):
+	latitude = np.asarray(latitude, dtype=np.float64)
+	longitude = np.asarray(longitude, dtype=np.float64)
+
+	if not np.all((-80.0 <= latitude) & (latitude <= 84.0)):
 		raise OutOfRangeError('latitude out of range (must be between 80 deg S and 84 deg N)')
-	if not -180.0 <= longitude <= 180.0:
+	if not np.all((-180.0 <= longitude) & (longitude <= 180.0)):
 		raise OutOfRangeError('longitude out of range (must be between 180 deg W and 180 deg E)')
 
-	lat_rad = math.radians(latitude)
-	lat_sin = math.sin(lat_rad)
-	lat_cos = math.cos(lat_rad)
+	lat_rad = np.radians(latitude)
+	lat_sin = np.sin(lat_rad)
+	lat_cos = np.cos(lat_rad)
 
 	lat_tan = lat_sin / lat_cos
 	lat_tan2 = lat_tan * lat_tan
 	lat_tan4 = lat_tan2 * lat_tan2
 
-	lon_rad = math.radians(longitude)
+	lon_rad = np.radians(longitude)
 
-	zone_number = latlon_to_zone_number(latitude, longitude)
+	if force_zone_number is None:
+		zone_number = latlon_to_zone_number(np.mean(latitude), np.mean(longitude))
+	else:
+		zone_number = force_zone_number
 	central_lon = zone_number_to_central_longitude(zone_number)
-	central_lon_rad = math.radians(central_lon)
+	central_lon_rad = np.radians(central_lon)
 
-	zone_letter = latitude_to_zone_letter(latitude)
+	zone_letter = latitude_to_zone_letter(np.mean(latitude))
 
-	n = R / math.sqrt(1 - E * lat_sin**2)
+	n = R / np.sqrt(1 - E * lat_sin**2)
 	c = E_P2 * lat_cos**2
 
 	a = lat_cos * (lon_rad - central_lon_rad)
@@ -128,9 +155,9 @@ def from_latlon(latitude, longitude):
 	a6 = a5 * a
 
 	m = R * (M1 * lat_rad -
-			 M2 * math.sin(2 * lat_rad) +
-			 M3 * math.sin(4 * lat_rad) -
-			 M4 * math.sin(6 * lat_rad))
+			 M2 * np.sin(2 * lat_rad) +
+			 M3 * np.sin(4 * lat_rad) -
+			 M4 * np.sin(6 * lat_rad))
 
 	easting = K0 * n * (a +
 						a3 / 6 * (1 - lat_tan2 + c) +
@@ -140,8 +167,7 @@ def from_latlon(latitude, longitude):
 										a4 / 24 * (5 - lat_tan2 + 9 * c + 4 * c**2) +
 										a6 / 720 * (61 - 58 * lat_tan2 + lat_tan4 + 600 * c - 330 * E_P2)))
 
-	if latitude < 0:
-		northing += 10000000
+	northing = np.where(latitude < 0, northing + 10000000, northing)
 
 	return easting, northing, zone_number, zone_letter
 